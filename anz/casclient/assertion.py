@@ -12,14 +12,45 @@ class Assertion( object ):
     
     implements( IAssertion )
     
-    def __init__( self, principal ):
+    # Assertions are kept in the session of each user, no __dict__ keeps
+    # them small in memory.
+    __slots__ = ( 'principal', 'validFromDate', 'validUntilDate',
+                  'attributes' )
+    
+    def __init__( self, principal, validFromDate=None, validUntilDate=None,
+                  attributes=None ):
         ''' Creates a new Assrtion with the supplied Principal.
         
         @param principal
         the Principal object to associate with the Assertion.
         
+        @param validFromDate
+        when the assertion is valid from (naive UTC datetime), default to
+        now.
+        
+        @param validUntilDate
+        when the assertion is valid until (naive UTC datetime), None means
+        no limit.
+        
+        @param attributes
+        attributes of the authentication, attribute name as key.
+        
         '''
         self.principal = principal
+        self.validFromDate = validFromDate or datetime.datetime.utcnow()
+        self.validUntilDate = validUntilDate
+        self.attributes = attributes or {}
+    
+    def __reduce__( self ):
+        return ( Assertion, (self.principal, self.validFromDate,
+                             self.validUntilDate, self.attributes or None) )
+    
+    def __setstate__( self, state ):
+        # assertions pickled before __slots__ were used
+        self.principal = state.get( 'principal' )
+        self.validFromDate = None
+        self.validUntilDate = None
+        self.attributes = {}
     
     def getPrincipal( self ):
         ''' The principal for which this assertion is valid.
@@ -29,3 +60,23 @@ class Assertion( object ):
         
         '''
         return self.principal
+    
+    def getValidFromDate( self ):
+        ''' See interfaces.IAssertion. '''
+        return self.validFromDate
+    
+    def getValidUntilDate( self ):
+        ''' See interfaces.IAssertion. '''
+        return self.validUntilDate
+    
+    def getAttributes( self ):
+        ''' See interfaces.IAssertion. '''
+        return self.attributes
+    
+    def isValid( self ):
+        ''' See interfaces.IAssertion. '''
+        now = datetime.datetime.utcnow()
+        if self.validFromDate is not None and now < self.validFromDate:
+            return False
+        
+        return self.validUntilDate is None or now < self.validUntilDate
@@ -0,0 +1,685 @@
+
+# python
+import asyncore
+import errno
+import os
+import socket
+import ssl
+import sys
+import threading
+import time
+from urlparse import urlsplit
+from logging import getLogger
+
+from anz.casclient.exceptions import ConnectionException, \
+     DeadlineExceededException, HTTPErrorException
+from anz.casclient.transport import getRemainingTime, getRedirect, \
+     DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT, MAX_REDIRECTS
+
+LOG = getLogger( 'anz.casclient' )
+
+# Seconds the addresses a host name resolved to are reused for.
+RESOLVE_TTL = 60
+
+class AsyncRequest( object ):
+    ''' A request sent by an AsyncTransport, wait() blocks until its
+    response arrived.
+
+    Building it does not resolve the host name, the transport resolves it
+    in a resolver thread when a new connection is needed.
+
+    '''
+
+    def __init__( self, url, data=None, headers=None, connectTimeout=None,
+                  readTimeout=None ):
+        parts = urlsplit( url )
+        self.scheme = parts.scheme or 'http'
+        if self.scheme not in ( 'http', 'https' ):
+            raise ConnectionException( 'Unsupported scheme: %s' %
+                                       self.scheme )
+
+        self.host = parts.hostname
+        self.port = parts.port or ( self.scheme == 'https' and 443 or 80 )
+
+        path = parts.path or '/'
+        if parts.query:
+            path = '%s?%s' % ( path, parts.query )
+
+        self.method = method = data is None and 'GET' or 'POST'
+        lines = [ '%s %s HTTP/1.1' % (method, path),
+                  'Host: %s' % parts.netloc ]
+        for name, value in ( headers or {} ).items():
+            lines.append( '%s: %s' % (name, value) )
+
+        if data is not None:
+            lines.append( 'Content-Length: %d' % len(data) )
+
+        self.message = '\r\n'.join( lines ) + '\r\n\r\n' + ( data or '' )
+
+        self.connectTimeout = connectTimeout or DEFAULT_CONNECT_TIMEOUT
+        self.readTimeout = readTimeout or DEFAULT_READ_TIMEOUT
+
+        # whether it is sent on a kept-alive connection, which the server
+        # may have closed in the meantime
+        self.reused = False
+
+        self.status = None
+        self.location = None
+        self.body = None
+        self.error = None
+        self._done = threading.Event()
+
+    def getOrigin( self ):
+        ''' Return the ( scheme, host, port ) connections are kept by. '''
+        return self.scheme, self.host, self.port
+
+    def wait( self, timeout=None ):
+        ''' Wait for the response and return its body.
+
+        @param timeout
+        max seconds to wait, None means no limit.
+
+        '''
+        self._done.wait( timeout )
+        if not self._done.isSet():
+            raise DeadlineExceededException( 'Deadline exceeded.' )
+
+        if self.error is not None:
+            raise self.error
+
+        return self.body
+
+    def finish( self, body=None, error=None, status=None, location=None ):
+        if self._done.isSet():
+            return
+
+        self.status = status
+        self.location = location
+        self.body = body
+        self.error = error
+        self._done.set()
+
+class _ResponseReader( object ):
+    ''' Reads a HTTP/1.x response as it arrives, framed by Content-Length,
+    chunked transfer encoding or the end of the connection.
+
+    '''
+
+    def __init__( self, method ):
+        self.method = method
+        self.status = None
+        self.headers = None
+        self.body = None
+        self.received = False
+        self.done = False
+
+        # whether the connection may carry another request afterwards
+        self.keepAlive = False
+
+        self._buffer = ''
+        # bytes of body expected, None reads until the connection closes
+        self._length = None
+        self._chunked = False
+        # size of the chunk being read, None while reading a chunk size
+        # line, -1 while reading the trailers
+        self._chunkLeft = None
+        self._chunks = []
+
+    def feed( self, data ):
+        ''' Add data received from the server, done tells whether the
+        response is complete.
+
+        '''
+        self.received = True
+        self._buffer += data
+        while self.headers is None:
+            head, sep, rest = self._buffer.partition( '\r\n\r\n' )
+            if not sep:
+                return
+
+            self._buffer = rest
+            self._readHead( head )
+
+        if self._chunked:
+            self._readChunks()
+        elif self._length is not None and len( self._buffer ) >= \
+             self._length:
+            self.body = self._buffer[:self._length]
+            self.done = True
+
+    def eof( self ):
+        ''' The server closed the connection.
+
+        @return
+        whether the response is complete.
+
+        '''
+        if self.headers is not None and not self._chunked and \
+           self._length is None:
+            self.body = self._buffer
+            self.done = True
+
+        self.keepAlive = False
+        return self.done
+
+    def _readHead( self, head ):
+        lines = head.split( '\r\n' )
+        try:
+            version, status = lines[0].split( ' ', 2 )[:2]
+            status = int( status )
+        except ValueError:
+            raise ConnectionException( 'Bad response from CAS server.' )
+
+        if 100 <= status < 200:
+            # interim response, the final one follows
+            return
+
+        headers = {}
+        for line in lines[1:]:
+            name, sep, value = line.partition( ':' )
+            headers[name.strip().lower()] = value.strip()
+
+        self.status = status
+        self.headers = headers
+
+        connection = headers.get( 'connection', '' ).lower()
+        if version == 'HTTP/1.1':
+            self.keepAlive = 'close' not in connection
+        else:
+            self.keepAlive = 'keep-alive' in connection
+
+        length = headers.get( 'content-length', '' )
+        if self.method == 'HEAD' or status in ( 204, 304 ):
+            self._length = 0
+        elif 'chunked' in headers.get( 'transfer-encoding', '' ).lower():
+            self._chunked = True
+        elif length.isdigit():
+            self._length = int( length )
+        else:
+            self.keepAlive = False
+
+    def _readChunks( self ):
+        while not self.done:
+            if self._chunkLeft is None:
+                end = self._buffer.find( '\r\n' )
+                if end < 0:
+                    return
+
+                try:
+                    size = int( self._buffer[:end].split(';')[0], 16 )
+                except ValueError:
+                    raise ConnectionException(
+                        'Bad response from CAS server.' )
+
+                self._buffer = self._buffer[end + 2:]
+                self._chunkLeft = size or -1
+            elif self._chunkLeft == -1:
+                if self._buffer.startswith( '\r\n' ):
+                    end = 0
+                else:
+                    end = self._buffer.find( '\r\n\r\n' )
+                    if end < 0:
+                        return
+                    end += 2
+
+                self._buffer = self._buffer[end + 2:]
+                self.body = ''.join( self._chunks )
+                self.done = True
+            else:
+                if len( self._buffer ) < self._chunkLeft + 2:
+                    return
+
+                self._chunks.append( self._buffer[:self._chunkLeft] )
+                self._buffer = self._buffer[self._chunkLeft + 2:]
+                self._chunkLeft = None
+
+class _Connection( asyncore.dispatcher ):
+    ''' A kept-alive connection to one server, driven by the event loop.
+
+    It sends one request at a time, and waits in the idle connections of
+    its transport between requests. Each address the host name resolved
+    to is tried in turn until one accepts the connection.
+
+    '''
+
+    def __init__( self, transport, request, addresses ):
+        asyncore.dispatcher.__init__( self, map=transport._map )
+        self.transport = transport
+        self.origin = request.getOrigin()
+        self.addresses = list( addresses )
+        self.handshaking = False
+        self.wantWrite = False
+        self.lastUsed = time.time()
+        self.start( request )
+        self._connectNext( None )
+
+    def start( self, request ):
+        ''' Send request on this connection. '''
+        self.request = request
+        self.outgoing = request.message
+        self.sent = False
+        self.reader = _ResponseReader( request.method )
+        timeout = self.connected and request.readTimeout or \
+                  request.connectTimeout
+        self.expires = time.time() + timeout
+
+    def readable( self ):
+        # idle connections are read to notice the server closing them
+        return self.connected and not self.wantWrite
+
+    def writable( self ):
+        return not self.connected or self.wantWrite or \
+               ( not self.handshaking and bool(self.outgoing) )
+
+    def handle_connect( self ):
+        self.expires = time.time() + self.request.readTimeout
+        if self.request.scheme == 'https':
+            context = ssl.create_default_context()
+            self.del_channel()
+            self.set_socket( context.wrap_socket(
+                self.socket, server_hostname=self.request.host,
+                do_handshake_on_connect=False), self._map )
+            self.handshaking = True
+            self._handshake()
+
+    def handle_read( self ):
+        if self.handshaking:
+            return self._handshake()
+
+        while True:
+            try:
+                data = self.socket.recv( 65536 )
+            except ssl.SSLWantReadError:
+                return
+            except ssl.SSLError, e:
+                if 'eof' not in str( e ).lower():
+                    raise
+
+                # closed without close_notify
+                data = ''
+            except socket.error, e:
+                if e.args[0] in ( errno.EAGAIN, errno.EWOULDBLOCK ):
+                    return
+
+                raise
+
+            if not data:
+                return self.handle_close()
+
+            if self.request is None:
+                # nothing is expected on an idle connection
+                return self._discard()
+
+            self.expires = time.time() + self.request.readTimeout
+            self.reader.feed( data )
+            if self.reader.done:
+                return self._complete()
+
+            # ssl sockets may hold more decrypted data than select sees.
+            if not isinstance( self.socket, ssl.SSLSocket ) or \
+               not self.socket.pending():
+                return
+
+    def handle_write( self ):
+        if self.handshaking:
+            return self._handshake()
+
+        try:
+            sent = self.socket.send( self.outgoing )
+        except ssl.SSLWantWriteError:
+            return
+
+        self.outgoing = self.outgoing[sent:]
+        self.sent = self.sent or sent > 0
+
+    def handle_close( self ):
+        if self.request is None:
+            return self._discard()
+
+        if not self.connected:
+            return self._connectNext( 'connection refused' )
+
+        if self.reader.eof():
+            return self._complete()
+
+        if not self._retry():
+            self.fail( 'Connection closed by the CAS server.' )
+
+    def handle_error( self ):
+        error = sys.exc_info()[1]
+        if self.request is None:
+            return self._discard()
+
+        if not self.connected:
+            return self._connectNext( error )
+
+        if isinstance( error, ConnectionException ):
+            return self.fail( str(error) )
+
+        if not self._retry():
+            LOG.warning( error )
+            self.fail( 'Fail to connect, %s' % error )
+
+    def checkTimeout( self, now ):
+        if self.request is None:
+            if now - self.lastUsed > self.transport.idleTimeout:
+                self._discard()
+        elif now > self.expires:
+            if not self.connected:
+                self._connectNext( 'timed out' )
+            else:
+                self.fail( 'Fail to connect, timed out' )
+
+    def fail( self, message ):
+        request, self.request = self.request, None
+        self._discard()
+        request.finish( error=ConnectionException(message) )
+
+    def _connectNext( self, error ):
+        # try the next address of the host
+        if self.socket is not None:
+            self.close()
+
+        if not self.addresses:
+            return self.fail( 'Fail to connect, %s' % error )
+
+        family, address = self.addresses.pop( 0 )
+        self.create_socket( family, socket.SOCK_STREAM )
+        self.expires = time.time() + self.request.connectTimeout
+        try:
+            self.connect( address )
+        except socket.error, e:
+            self._connectNext( e )
+
+    def _retry( self ):
+        # The server closed the kept-alive connection before answering,
+        # send the request again on a new one. A POST the server may have
+        # received already is not sent twice.
+        request = self.request
+        if not request.reused or self.reader.received or \
+           ( request.method != 'GET' and self.sent ):
+            return False
+
+        self.request = None
+        self._discard()
+        request.reused = False
+        self.transport._dispatch( request, reuse=False )
+        return True
+
+    def _discard( self ):
+        self.close()
+        self.transport._unpark( self )
+
+    def _handshake( self ):
+        try:
+            self.socket.do_handshake()
+        except ssl.SSLWantReadError:
+            self.wantWrite = False
+            return
+        except ssl.SSLWantWriteError:
+            self.wantWrite = True
+            return
+
+        self.handshaking = False
+        self.wantWrite = False
+
+    def _complete( self ):
+        request, self.request = self.request, None
+        reader = self.reader
+        if reader.keepAlive and self.connected:
+            self.lastUsed = time.time()
+            self.transport._park( self )
+        else:
+            self.close()
+
+        if reader.status >= 400:
+            LOG.warning( 'HTTP Error %s' % reader.status )
+            return request.finish( error=HTTPErrorException(reader.status) )
+
+        request.finish( body=reader.body, status=reader.status,
+                        location=reader.headers.get('location') )
+
+class AsyncTransport( object ):
+    ''' HTTP transport running all its requests from a single event loop
+    thread over non-blocking sockets, so many outstanding CAS requests
+    share one thread instead of each blocking a socket read. It is built
+    on asyncore, Python 2 has no asyncio.
+
+    Connections are HTTP/1.1 and kept alive: at most poolSize idle
+    connections per server are kept for idleTimeout seconds, so the TCP
+    connection and TLS session are reused like with the pooled transport.
+    Host names are resolved in a resolver thread, never in the event loop
+    or the calling thread, and the addresses are reused for RESOLVE_TTL
+    seconds.
+
+    submit() returns an AsyncRequest right away, several can be waited for
+    together. request() has the same signature as transport.Transport
+    .request, follows redirects like it and blocks the calling thread
+    until the response arrived.
+
+    '''
+
+    def __init__( self, poolSize=10, idleTimeout=30 ):
+        ''' Construct a transport.
+
+        @param poolSize
+        max number of idle connections kept per server
+
+        @param idleTimeout
+        seconds an idle connection is kept before it is closed
+
+        '''
+        self.poolSize = poolSize
+        self.idleTimeout = idleTimeout
+
+        self._map = {}
+        self._new = []
+        self._lock = threading.Lock()
+        self._thread = None
+        self._wakeup = None
+
+        # event loop thread only: origin as key, idle connections as value
+        self._idle = {}
+
+        # ( host, port ) as key, ( addresses, expiry time ) as value
+        self._addresses = {}
+        # ( host, port ) as key, requests waiting for it to resolve as value
+        self._resolving = {}
+
+    def configure( self, poolSize=10, idleTimeout=30 ):
+        ''' Apply new pool settings, see __init__. Idle connections beyond
+        them are closed by the event loop as they expire.
+
+        '''
+        self.poolSize = poolSize
+        self.idleTimeout = idleTimeout
+
+    def submit( self, url, data=None, headers=None, connectTimeout=None,
+                readTimeout=None ):
+        ''' Hand a request to the event loop thread.
+
+        @return
+        an AsyncRequest object.
+
+        '''
+        request = AsyncRequest( url, data, headers, connectTimeout,
+                                readTimeout )
+        self._post( request )
+        return request
+
+    def request( self, url, data=None, headers=None, connectTimeout=None,
+                 readTimeout=None ):
+        ''' Send a request and return the body of the response.
+        See transport.Transport.request.
+
+        '''
+        for i in range( MAX_REDIRECTS + 1 ):
+            remaining = getRemainingTime()
+            if remaining is not None and remaining <= 0:
+                raise DeadlineExceededException( 'Deadline exceeded.' )
+
+            request = self.submit( url, data, headers, connectTimeout,
+                                   readTimeout )
+            body = request.wait( remaining )
+            target = getRedirect( request.method, request.status,
+                                  request.location, url )
+            if target is None:
+                return body
+
+            url = target
+
+        raise ConnectionException( 'Too many redirects.' )
+
+    def _post( self, request ):
+        self._lock.acquire()
+        try:
+            self._new.append( request )
+            if self._thread is None or not self._thread.isAlive():
+                self._start()
+        finally:
+            self._lock.release()
+
+        os.write( self._wakeup[1], 'x' )
+
+    def _dispatch( self, request, reuse=True ):
+        # event loop thread: send request on an idle connection to its
+        # server or on a new one
+        idle = self._idle.get( request.getOrigin() )
+        if reuse and idle:
+            connection = idle.pop()
+            request.reused = True
+            return connection.start( request )
+
+        key = ( request.host, request.port )
+        addresses = _getNumericAddresses( *key )
+        if addresses is None:
+            self._lock.acquire()
+            try:
+                addresses, expires = self._addresses.get( key,
+                                                          (None, 0) )
+                if expires < time.time():
+                    addresses = None
+                    waiting = self._resolving.setdefault( key, [] )
+                    waiting.append( request )
+                    if len( waiting ) > 1:
+                        # already being resolved
+                        return
+            finally:
+                self._lock.release()
+
+        if addresses is None:
+            thread = threading.Thread( target=self._resolve, args=(key,),
+                                       name='anz.casclient resolver' )
+            thread.setDaemon( True )
+            thread.start()
+            return
+
+        _Connection( self, request, addresses )
+
+    def _resolve( self, key ):
+        # resolver thread: getaddrinfo may block for seconds
+        try:
+            addresses = [ (info[0], info[4]) for info in
+                          socket.getaddrinfo(key[0], key[1], 0,
+                                             socket.SOCK_STREAM) ]
+            error = None
+        except socket.error, e:
+            addresses = None
+            error = e
+
+        self._lock.acquire()
+        try:
+            if addresses:
+                self._addresses[key] = ( addresses,
+                                         time.time() + RESOLVE_TTL )
+            waiting = self._resolving.pop( key, [] )
+        finally:
+            self._lock.release()
+
+        for request in waiting:
+            if addresses:
+                self._post( request )
+            else:
+                request.finish( error=ConnectionException(
+                    'Fail to connect, %s' % error) )
+
+    def _park( self, connection ):
+        idle = self._idle.setdefault( connection.origin, [] )
+        if len( idle ) < self.poolSize:
+            idle.append( connection )
+        else:
+            connection.close()
+
+    def _unpark( self, connection ):
+        idle = self._idle.get( connection.origin, [] )
+        if connection in idle:
+            idle.remove( connection )
+
+    def _start( self ):
+        if self._wakeup is None:
+            self._wakeup = os.pipe()
+
+        self._thread = threading.Thread( target=self._run,
+                                         name='anz.casclient event loop' )
+        self._thread.setDaemon( True )
+        self._thread.start()
+
+    def _run( self ):
+        wakeup = _WakeupDispatcher( self._wakeup[0], self._map )
+        while True:
+            self._lock.acquire()
+            try:
+                new, self._new = self._new, []
+            finally:
+                self._lock.release()
+
+            for request in new:
+                try:
+                    self._dispatch( request )
+                except Exception, e:
+                    LOG.warning( e )
+                    request.finish( error=ConnectionException(
+                        'Fail to connect, %s' % e) )
+
+            now = time.time()
+            for dispatcher in self._map.values():
+                if dispatcher is not wakeup:
+                    dispatcher.checkTimeout( now )
+
+            try:
+                asyncore.loop( timeout=0.1, map=self._map, count=1 )
+            except Exception, e:
+                LOG.warning( e )
+
+def _getNumericAddresses( host, port ):
+    # addresses of a host given as an IP address, None for a host name
+    for family in ( socket.AF_INET, socket.AF_INET6 ):
+        try:
+            socket.inet_pton( family, host )
+        except ( socket.error, ValueError ):
+            continue
+
+        if family == socket.AF_INET6:
+            return [ (family, (host, port, 0, 0)) ]
+
+        return [ (family, (host, port)) ]
+
+    return None
+
+class _WakeupDispatcher( asyncore.file_dispatcher ):
+    ''' Wakes the event loop up when a request is submitted. '''
+
+    def writable( self ):
+        return False
+
+    def handle_read( self ):
+        self.recv( 512 )
+
+    def handle_close( self ):
+        pass
+
+_asyncTransport = AsyncTransport()
+
+def getAsyncTransport():
+    ''' Retrieve the event loop transport shared by the whole process. '''
+    return _asyncTransport
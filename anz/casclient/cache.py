@@ -0,0 +1,146 @@
+
+# python
+import threading
+import time
+from collections import OrderedDict
+
+class LRUCache( object ):
+    ''' A thread-safe cache holding at most maxSize entries, the least
+    recently used one is evicted first. Entries expire ttl seconds after
+    they were set.
+
+    '''
+
+    def __init__( self, maxSize=1000, ttl=5 ):
+        ''' Construct a cache.
+
+        @param maxSize
+        max number of entries
+
+        @param ttl
+        seconds an entry is valid for
+
+        '''
+        self.maxSize = maxSize
+        self.ttl = ttl
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get( self, key ):
+        ''' Return the value cached for key or None. '''
+        now = time.time()
+        self._lock.acquire()
+        try:
+            entry = self._data.pop( key, None )
+            if entry is None:
+                self.misses += 1
+                return None
+
+            if entry[1] < now:
+                self.misses += 1
+                self.evictions += 1
+                return None
+
+            # mark as most recently used
+            self._data[key] = entry
+            self.hits += 1
+            return entry[0]
+        finally:
+            self._lock.release()
+
+    def set( self, key, value ):
+        ''' Cache value for key. '''
+        self._lock.acquire()
+        try:
+            self._data.pop( key, None )
+            self._data[key] = ( value, time.time() + self.ttl )
+            while len( self._data ) > self.maxSize:
+                self._data.popitem( last=False )
+                self.evictions += 1
+        finally:
+            self._lock.release()
+
+    def configure( self, maxSize, ttl ):
+        ''' Change the size limit and the ttl of the cache. '''
+        self._lock.acquire()
+        try:
+            self.maxSize = maxSize
+            self.ttl = ttl
+            while len( self._data ) > self.maxSize:
+                self._data.popitem( last=False )
+                self.evictions += 1
+        finally:
+            self._lock.release()
+
+    def clear( self ):
+        ''' Remove all entries. '''
+        self._lock.acquire()
+        try:
+            self._data.clear()
+        finally:
+            self._lock.release()
+
+    def getStats( self ):
+        ''' Return a dict of the size, limits, hits, misses and evictions
+        of the cache.
+
+        '''
+        return { 'size': len( self._data ),
+                 'maxSize': self.maxSize,
+                 'ttl': self.ttl,
+                 'hits': self.hits,
+                 'misses': self.misses,
+                 'evictions': self.evictions }
+
+class ThreadLocalCache( object ):
+    ''' A cache whose entries are private to the thread that set them, so
+    reads and writes take no lock. Each thread keeps at most maxSize
+    entries, for ttl seconds each.
+
+    invalidate() drops the entries of all the threads at once.
+
+    '''
+
+    def __init__( self, maxSize=100, ttl=5 ):
+        self.maxSize = maxSize
+        self.ttl = ttl
+
+        self._generation = 0
+        self._local = threading.local()
+
+    def get( self, key ):
+        ''' Return the value cached for key by the current thread or None.
+        '''
+        data = getattr( self._local, 'data', None )
+        if data is None:
+            return None
+
+        entry = data.get( key )
+        if entry is None:
+            return None
+
+        if entry[1] < time.time() or entry[2] != self._generation:
+            del data[key]
+            return None
+
+        return entry[0]
+
+    def set( self, key, value ):
+        ''' Cache value for key in the current thread. '''
+        data = getattr( self._local, 'data', None )
+        if data is None:
+            data = self._local.data = OrderedDict()
+
+        data.pop( key, None )
+        data[key] = ( value, time.time() + self.ttl, self._generation )
+        while len( data ) > self.maxSize:
+            data.popitem( last=False )
+
+    def invalidate( self ):
+        ''' Drop the entries of all the threads. '''
+        self._generation += 1
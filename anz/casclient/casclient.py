@@ -1,15 +1,17 @@
 
 # python
-from xml.dom import minidom as minidom
-from urllib import quote
+import os
+from urllib import quote, unquote_plus
 from logging import getLogger
 
 # zope
 from AccessControl import ClassSecurityInfo
+from AccessControl.Permissions import manage_users as ManageUsers
 from Acquisition import aq_base
 from Globals import InitializeClass
 from OFS.Cache import Cacheable
 from zope.interface import implements
+from zope.component import queryAdapter
 from Products.PageTemplates.PageTemplateFile import PageTemplateFile
 import transaction
 
@@ -18,19 +20,42 @@ from Products.PluggableAuthService.plugins.BasePlugin import BasePlugin
 from Products.PluggableAuthService.utils import classImplements
 from Products.PluggableAuthService.interfaces.plugins import \
         IExtractionPlugin, IChallengePlugin, IAuthenticationPlugin, \
-        ICredentialsResetPlugin, ICredentialsUpdatePlugin
+        ICredentialsResetPlugin, ICredentialsUpdatePlugin, \
+        IPropertiesPlugin, IGroupsPlugin
 
 from anz.casclient.interfaces import IAnzCASClient
+from anz.casclient.interfaces import IProxyGrantingTicketStorage
+from anz.casclient.interfaces import ISessionMappingStorage
 from anz.casclient.assertion import Assertion
 from anz.casclient.principal import Principal
 from anz.casclient.proxygrantingticketstorage import ProxyGrantingTicketStorage
-from anz.casclient.sessionmappingstorage import SessionMappingStorage
+from anz.casclient.proxygrantingticketstorage import getPgtRendezvous, \
+     getPgtHandover
+from anz.casclient.sessionmappingstorage import \
+     PartitionedSessionMappingStorage
 from anz.casclient.validationspecification import Cas10TicketValidator
 from anz.casclient.validationspecification import Cas20ServiceTicketValidator
 from anz.casclient.validationspecification import Cas20ProxyTicketValidator
 from anz.casclient.validationspecification import Cas20SAMLServiceTicketValidator
+from anz.casclient.validationspecification import Cas30ServiceTicketValidator
+from anz.casclient.validationspecification import Cas30ProxyTicketValidator
 from anz.casclient.exceptions import BaseException
 from anz.casclient.utils import retrieveResponseFromServer
+from anz.casclient.transport import setDeadline, restoreDeadline, \
+     configureTransport
+from anz.casclient.asynctransport import getAsyncTransport
+from anz.casclient.cache import LRUCache, ThreadLocalCache
+from anz.casclient.proxyticketpool import configureProxyTicketPool
+from anz.casclient.circuitbreaker import getCircuitBreaker, \
+     configureCircuitBreaker, CLOSED, OPEN, HALF_OPEN
+from anz.casclient.endpoints import getEndpointGroup, configureEndpointGroup
+from anz.casclient.signedcookie import newSecret, encodeAssertion, \
+     decodeAssertion, dropPgt
+from anz.casclient.storage import getSharedStorage, getPluginKey, \
+     getStorageDirectory, VolatileMapping, FileMapping
+from anz.casclient.responseparser import parseLogoutRequest
+from anz.casclient.singlesignout import getLogoutQueue, getLogoutSpool
+from anz.casclient.metrics import getMetrics
 
 try:
     from Products.CMFPlone.factory import _IMREALLYPLONE4
@@ -66,6 +91,18 @@ class AnzCASClient( BasePlugin, Cacheable ):
     # Session variable use to save assertion
     CAS_ASSERTION = '__cas_assertion'
 
+    # Request variable used to memoize the extracted credentials, suffixed
+    # with the plugin id
+    CAS_CREDENTIALS = 'anz.casclient.credentials.'
+
+    # Request variable used to keep the assertion of the authenticated user,
+    # suffixed with the plugin id
+    CAS_REQUEST_ASSERTION = 'anz.casclient.assertion.'
+
+    # Request variable used to memoize the service URL, suffixed with the
+    # plugin id
+    CAS_SERVICE = 'anz.casclient.service.'
+
     # The start of the CAS server URL
     casServerUrlPrefix = ''
 
@@ -104,9 +141,9 @@ class AnzCASClient( BasePlugin, Cacheable ):
     gateway = False
 
     # Use which CAS protocol to validate ticket
-    # one of ['CAS 1.0','CAS 2.0']
+    # one of ['CAS 1.0','CAS 2.0','CAS 3.0']
     ticketValidationSpecification = 'CAS 1.0'
-    ticketValidationSpecification_values = ['CAS 1.0','CAS 2.0']
+    ticketValidationSpecification_values = ['CAS 1.0','CAS 2.0','CAS 3.0']
 
     # The start of the proxy callback url.
     # You should set it point to an instance of this class with protocol 'https'.
@@ -115,6 +152,17 @@ class AnzCASClient( BasePlugin, Cacheable ):
     # back-end service on behalf of a particular user.
     proxyCallbackUrlPrefix = ''
 
+    # Whether the CAS server calls the @@anz-casclient-proxycallback view
+    # back instead of proxyCallback. The view never writes to the ZODB, with
+    # the 'zodb' storage backend tickets are handed over to the validations
+    # of the other Zope clients through files in pgtHandoverDirectory.
+    slimProxyCallback = False
+
+    # Directory shared by the Zope clients of a cluster the slim proxy
+    # callback hands tickets over through. Default to storageDirectory,
+    # shared by the Zope clients of the host only.
+    pgtHandoverDirectory = ''
+
     # If you provide either the acceptAnyProxy or the allowedProxyChains
     # parameters, a Cas20ProxyTicketValidator will be constructed. Otherwise
     # a Cas20ServiceTicketValidator will be constructed that does not accept
@@ -131,8 +179,132 @@ class AnzCASClient( BasePlugin, Cacheable ):
     # Use SAML validation for service ticket validation on CAS 2.0 flow.
     SAMLValidate = False
 
+    # Format of the CAS 3.0 validation responses, one of ['XML','JSON'].
+    responseFormat = 'XML'
+    responseFormat_values = ['XML', 'JSON']
+
+    # Seconds to wait for a connection to the CAS server to be set up.
+    connectTimeout = 5.0
+
+    # Seconds to wait for each read of a CAS server response.
+    readTimeout = 5.0
+
+    # Connections to the CAS server kept alive for reuse: at most
+    # connectionPoolSize idle ones per host, kept connectionIdleTimeout
+    # seconds, and at most maxConnectionsPerHost open to a host at the same
+    # time. The pools are shared by all the plugins of the Zope client.
+    connectionPoolSize = 10
+    maxConnectionsPerHost = 20
+    connectionIdleTimeout = 30
+
+    # Max seconds spent talking to the CAS server while extracting the
+    # credentials of one request, 0 means no limit.
+    validationDeadline = 10.0
+
+    # Where to keep proxy granting tickets and session mappings.
+    # 'zodb' keeps them persistently on this plugin, 'volatile' in the
+    # memory of each Zope client and 'file' in files shared by all the
+    # Zope clients of the host (see storageDirectory).
+    storageBackend = 'zodb'
+    storageBackend_values = ['zodb', 'volatile', 'file']
+
+    # Directory used by the 'file' storage backend. Default to a directory
+    # in /dev/shm or in the temporary directory.
+    storageDirectory = ''
+
+    # Whether to cache successful proxy ticket validations, so retried or
+    # fanned-out requests carrying the same proxy ticket are not validated
+    # on CAS again. The cache keeps at most proxyTicketCacheSize
+    # validations for proxyTicketCacheTTL seconds each.
+    cacheProxyTicketValidation = False
+    proxyTicketCacheSize = 1000
+    proxyTicketCacheTTL = 5
+
+    # Number of proxy tickets prefetched in the background per proxy
+    # granting ticket and target service, 0 means proxy tickets are
+    # retrieved from CAS when asked for. Prefetched tickets are handed out
+    # only once, and only within proxyTicketMaxAge seconds.
+    proxyTicketPoolSize = 0
+    proxyTicketMaxAge = 5
+
+    # Whether ticket validation requests are sent from a single event loop
+    # thread shared by all the worker threads, instead of each worker
+    # thread using a pooled connection of its own.
+    asyncValidation = False
+
+    # Circuit breaker guarding the CAS server. When at least
+    # circuitBreakerThreshold (0 to 1) of the back-channel requests sent in
+    # the last circuitBreakerWindow seconds failed, and at least
+    # circuitBreakerMinRequests were sent, validations and proxy calls fail
+    # right away and users are not redirected to CAS for
+    # circuitBreakerCoolDown seconds. A threshold of 0 disables it.
+    circuitBreakerThreshold = 0.5
+    circuitBreakerMinRequests = 10
+    circuitBreakerWindow = 30
+    circuitBreakerCoolDown = 30
+
+    # URL prefixes of the CAS server nodes validation and proxy requests
+    # are spread over, each request goes to the healthy node with the
+    # fewest requests in flight and fails over to the others on connection
+    # errors. Nodes are probed every healthCheckInterval seconds. Empty
+    # means the back-channel requests go to casServerUrlPrefix, which is
+    # always used for the browser facing login and logout URLs.
+    casServerBackChannelUrls = []
+    healthCheckInterval = 10
+
+    # Seconds each worker thread remembers the assertion of the browsers it
+    # served, so their next requests do not read it from the session again.
+    # Single sign out and logout are seen after up to this delay by the
+    # other Zope clients of a cluster. 0 disables the cache.
+    assertionCacheTTL = 0
+
+    # Whether to keep the assertion in a cookie signed by this plugin
+    # instead of the session, so authenticated requests are verified
+    # without reading the session. The cookie is named signedCookieName
+    # and expires signedCookieLifetime seconds after the ticket validation.
+    # Single sign out can not revoke such cookies before they expire.
+    useSignedCookie = False
+    signedCookieName = '__cas_assertion'
+    signedCookieLifetime = 28800
+
+    # Secret the assertion cookies are signed with, generated on first use.
+    _cookieSecret = None
+
+    # Latencies saved from the 'Metrics' tab, to compare the current ones
+    # with, e.g. across an upgrade.
+    _metricsBaseline = None
+
+    # Name of the user attribute released by CAS which holds the groups of
+    # the user, empty means this plugin provides no groups. The other
+    # attributes are provided as user properties.
+    groupsAttribute = ''
+
+    # Whether single sign out requests are applied by a background thread,
+    # clearing up to singleSignOutBatchSize sessions per transaction,
+    # instead of committing a transaction per request.
+    asyncSingleSignOut = False
+    singleSignOutBatchSize = 100
+
+    # Directory shared by the Zope clients of a cluster, through which the
+    # client receiving a single sign out request forwards it to the other
+    # ones, since the session may live on any of them. Empty disables
+    # forwarding.
+    sloSpoolDirectory = ''
+
+    # Whether to record call counts, failures and latencies of the hot
+    # paths, see the 'Metrics' tab and the @@anz-casclient-metrics view.
+    # The metrics are shared by all the plugins of the Zope client.
+    collectMetrics = False
+
     security = ClassSecurityInfo()
 
+    manage_options = BasePlugin.manage_options + (
+        { 'label': 'Metrics', 'action': 'manage_metrics' },
+        )
+
+    security.declareProtected( ManageUsers, 'manage_metrics' )
+    manage_metrics = PageTemplateFile( 'www/metrics.pt', globals() )
+
     _properties = (
         {
             'id': 'serviceUrl',
@@ -177,6 +349,18 @@ class AnzCASClient( BasePlugin, Cacheable ):
             'type': 'string',
             'mode': 'w'
             },
+        {
+            'id': 'slimProxyCallback',
+            'label': 'Slim Proxy Callback (no ZODB write)',
+            'type': 'boolean',
+            'mode': 'w'
+            },
+        {
+            'id': 'pgtHandoverDirectory',
+            'label': 'Slim Proxy Callback Handover Directory',
+            'type': 'string',
+            'mode': 'w'
+            },
         {
             'id': 'acceptAnyProxy',
             'lable': 'Accept Any Proxy',
@@ -195,17 +379,228 @@ class AnzCASClient( BasePlugin, Cacheable ):
             'type': 'boolean',
             'mode': 'w'
             },
+        {
+            'id': 'responseFormat',
+            'label': 'CAS 3.0 Response Format',
+            'select_variable': 'responseFormat_values',
+            'type': 'selection',
+            'mode': 'w'
+            },
+        {
+            'id': 'connectTimeout',
+            'label': 'Connect Timeout (seconds)',
+            'type': 'float',
+            'mode': 'w'
+            },
+        {
+            'id': 'readTimeout',
+            'label': 'Read Timeout (seconds)',
+            'type': 'float',
+            'mode': 'w'
+            },
+        {
+            'id': 'connectionPoolSize',
+            'label': 'Idle Connections Kept per Host',
+            'type': 'int',
+            'mode': 'w'
+            },
+        {
+            'id': 'maxConnectionsPerHost',
+            'label': 'Max Connections per Host',
+            'type': 'int',
+            'mode': 'w'
+            },
+        {
+            'id': 'connectionIdleTimeout',
+            'label': 'Connection Idle Timeout (seconds)',
+            'type': 'int',
+            'mode': 'w'
+            },
+        {
+            'id': 'validationDeadline',
+            'label': 'Validation Deadline (seconds)',
+            'type': 'float',
+            'mode': 'w'
+            },
+        {
+            'id': 'storageBackend',
+            'label': 'Ticket and Session Mapping Storage',
+            'select_variable': 'storageBackend_values',
+            'type': 'selection',
+            'mode': 'w'
+            },
+        {
+            'id': 'storageDirectory',
+            'label': 'Storage Directory (file storage only)',
+            'type': 'string',
+            'mode': 'w'
+            },
+        {
+            'id': 'cacheProxyTicketValidation',
+            'label': 'Cache Proxy Ticket Validation',
+            'type': 'boolean',
+            'mode': 'w'
+            },
+        {
+            'id': 'proxyTicketCacheSize',
+            'label': 'Proxy Ticket Cache Size',
+            'type': 'int',
+            'mode': 'w'
+            },
+        {
+            'id': 'proxyTicketCacheTTL',
+            'label': 'Proxy Ticket Cache TTL (seconds)',
+            'type': 'int',
+            'mode': 'w'
+            },
+        {
+            'id': 'proxyTicketPoolSize',
+            'label': 'Prefetched Proxy Tickets per Service',
+            'type': 'int',
+            'mode': 'w'
+            },
+        {
+            'id': 'proxyTicketMaxAge',
+            'label': 'Prefetched Proxy Ticket Max Age (seconds)',
+            'type': 'int',
+            'mode': 'w'
+            },
+        {
+            'id': 'asyncValidation',
+            'label': 'Validate Tickets from an Event Loop',
+            'type': 'boolean',
+            'mode': 'w'
+            },
+        {
+            'id': 'circuitBreakerThreshold',
+            'label': 'Circuit Breaker Failure Rate (0 disables)',
+            'type': 'float',
+            'mode': 'w'
+            },
+        {
+            'id': 'circuitBreakerMinRequests',
+            'label': 'Circuit Breaker Min Requests',
+            'type': 'int',
+            'mode': 'w'
+            },
+        {
+            'id': 'circuitBreakerWindow',
+            'label': 'Circuit Breaker Window (seconds)',
+            'type': 'int',
+            'mode': 'w'
+            },
+        {
+            'id': 'circuitBreakerCoolDown',
+            'label': 'Circuit Breaker Cool-down (seconds)',
+            'type': 'int',
+            'mode': 'w'
+            },
+        {
+            'id': 'casServerBackChannelUrls',
+            'label': 'CAS Server Back-channel URL Prefixes',
+            'type': 'lines',
+            'mode': 'w'
+            },
+        {
+            'id': 'healthCheckInterval',
+            'label': 'Back-channel Health Check Interval (seconds)',
+            'type': 'int',
+            'mode': 'w'
+            },
+        {
+            'id': 'assertionCacheTTL',
+            'label': 'Per-thread Assertion Cache TTL (seconds)',
+            'type': 'int',
+            'mode': 'w'
+            },
+        {
+            'id': 'useSignedCookie',
+            'label': 'Keep Assertion in a Signed Cookie',
+            'type': 'boolean',
+            'mode': 'w'
+            },
+        {
+            'id': 'signedCookieName',
+            'label': 'Signed Cookie Name',
+            'type': 'string',
+            'mode': 'w'
+            },
+        {
+            'id': 'signedCookieLifetime',
+            'label': 'Signed Cookie Lifetime (seconds)',
+            'type': 'int',
+            'mode': 'w'
+            },
+        {
+            'id': 'groupsAttribute',
+            'label': 'Groups Attribute',
+            'type': 'string',
+            'mode': 'w'
+            },
+        {
+            'id': 'asyncSingleSignOut',
+            'label': 'Apply Single Sign Out in the Background',
+            'type': 'boolean',
+            'mode': 'w'
+            },
+        {
+            'id': 'singleSignOutBatchSize',
+            'label': 'Single Sign Out Batch Size',
+            'type': 'int',
+            'mode': 'w'
+            },
+        {
+            'id': 'sloSpoolDirectory',
+            'label': 'Single Sign Out Spool Directory (clusters only)',
+            'type': 'string',
+            'mode': 'w'
+            },
+        {
+            'id': 'collectMetrics',
+            'label': 'Collect Metrics',
+            'type': 'boolean',
+            'mode': 'w'
+            },
         )
 
     def __init__( self, id, title ):
         self._id = self.id = id
         self.title = title
         self._pgtStorage = ProxyGrantingTicketStorage()
-        self._sessionStorage = SessionMappingStorage()
+        self._sessionStorage = PartitionedSessionMappingStorage()
+        self._cookieSecret = newSecret()
 
     security.declarePrivate( 'extractCredentials' )
     def extractCredentials( self, request ):
         ''' Extract credentials from session or 'request'. '''
+        # PAS may extract credentials several times per request, only the
+        # first time does the work.
+        key = self.CAS_CREDENTIALS + self.getId()
+        if key in request.other:
+            return self._copyCredentials( request.other[key] )
+
+        self._ensureBackChannel()
+
+        # Bound the time spent on the CAS server, so a slow CAS server
+        # can not pin the worker thread.
+        previous = setDeadline( self.validationDeadline )
+        try:
+            creds = getMetrics().call( 'extract_credentials',
+                                       self._extractCredentials, request )
+        finally:
+            restoreDeadline( previous )
+
+        request.other[key] = self._copyCredentials( creds )
+        return creds
+
+    def _copyCredentials( self, creds ):
+        # PAS adds its own keys to the credentials it is given
+        if creds is None:
+            return None
+
+        return dict( creds )
+
+    def _extractCredentials( self, request ):
         creds = {}
 
         # Do logout if logout request found
@@ -214,11 +609,25 @@ class AnzCASClient( BasePlugin, Cacheable ):
             self.logoutCallback()
             return creds
 
+        if self.useSignedCookie:
+            return self._extractCredentialsFromCookie( request )
+
         sdm = getattr( self, 'session_data_manager', None )
         assert sdm is not None, 'No session data manager found!'
 
-        session = sdm.getSessionData( create=0 )
-        assertion = self.getAssertion( session )
+        session = None
+        assertion = None
+        cache = self._getAssertionCache()
+        browserId = cache is not None and self._getBrowserId( sdm ) or None
+        if browserId:
+            assertion = cache.get( browserId )
+
+        if not assertion:
+            session = sdm.getSessionData( create=0 )
+            assertion = self.getAssertion( session )
+            if assertion and browserId:
+                cache.set( browserId, assertion )
+
         if not assertion:
             # Not already authenticated. Is there a ticket in the URL?
             ticket = request.form.get( 'ticket', None )
@@ -234,25 +643,11 @@ class AnzCASClient( BasePlugin, Cacheable ):
 
             # Get session token as id, it is more reliable
             sessionId = session.getContainerKey()
-            self._sessionStorage.addSession( ticket, sessionId )
-
-            # Create a session in the default Plone session factory for username
-            # depending on the PLONE version used
-            username = assertion.getPrincipal().getId()
-            if PLONE4:
-                # It's needed to cast username which is an unicode type to an
-                # str as plone.session does a direct concatenation of unicode
-                # username and other string types that leads to an UnicodeDecode
-                # error otherwise. It's needed to address plone.session to do
-                # not so. Meanwhile, casting the username assumes that there are
-                # non ascii chars in it.
-                self.session._setupSession(str(username), request.response)
-            else:
-                # is PLONE3
-                cookie = self.session.source.createIdentifier(username)
-                creds['cookie'] = cookie
-                creds['source'] = 'plone.session'
-                self.session.setupSession(username, request.response)
+            getMetrics().call( 'session_storage',
+                               self._getSessionStorage().addSession,
+                               ticket, sessionId )
+
+            self._setupPloneSession( request, assertion, creds )
 
             # Save assertion into session
             if self.useSession:
@@ -263,9 +658,91 @@ class AnzCASClient( BasePlugin, Cacheable ):
                 session = sdm.getSessionData()
                 session.set( self.CAS_ASSERTION, assertion )
 
+        request.other[self.CAS_REQUEST_ASSERTION + self.getId()] = assertion
+        creds['login'] = assertion.getPrincipal().getId()
+        return creds
+
+    def _extractCredentialsFromCookie( self, request ):
+        ''' Extract credentials from the signed assertion cookie or the
+        ticket in 'request', the session is not used.
+
+        '''
+        creds = {}
+        assertion = None
+        value = request.cookies.get( self.signedCookieName )
+        if value:
+            assertion = decodeAssertion( value, self._getCookieSecret(),
+                                         self.casServerUrlPrefix,
+                                         self.connectTimeout,
+                                         self.readTimeout,
+                                         getPluginKey(self),
+                                         self._getCookiePgtStorage() )
+
+        if assertion is None:
+            ticket = request.form.get( 'ticket', None )
+            if not ticket:
+                return None # No CAS authentification
+
+            service = self.getService()
+            assertion = self.validateServiceTicket( service, ticket )
+            self._setupPloneSession( request, assertion, creds )
+
+            secure = request.get( 'SERVER_URL', '' ).startswith( 'https' )
+            request.response.setCookie(
+                self.signedCookieName,
+                encodeAssertion( assertion, self._getCookieSecret(),
+                                 self.signedCookieLifetime,
+                                 self._getCookiePgtStorage() ),
+                path='/', secure=secure, http_only=True )
+
+        request.other[self.CAS_REQUEST_ASSERTION + self.getId()] = assertion
         creds['login'] = assertion.getPrincipal().getId()
         return creds
 
+    def _setupPloneSession( self, request, assertion, creds ):
+        # Create a session in the default Plone session factory for username
+        # depending on the PLONE version used
+        username = assertion.getPrincipal().getId()
+        if PLONE4:
+            # It's needed to cast username which is an unicode type to an
+            # str as plone.session does a direct concatenation of unicode
+            # username and other string types that leads to an UnicodeDecode
+            # error otherwise. It's needed to address plone.session to do
+            # not so. Meanwhile, casting the username assumes that there are
+            # non ascii chars in it.
+            self.session._setupSession(str(username), request.response)
+        else:
+            # is PLONE3
+            cookie = self.session.source.createIdentifier(username)
+            creds['cookie'] = cookie
+            creds['source'] = 'plone.session'
+            self.session.setupSession(username, request.response)
+
+    def _getCookiePgtStorage( self ):
+        ''' Retrieve the mapping the proxy granting tickets of principals
+        authenticated by signed cookie are kept in, by cookie handle.
+        With the 'volatile' storage backend it lives in the memory of the
+        Zope client, otherwise in files under storageDirectory shared by
+        the Zope clients of the host.
+
+        '''
+        lifetime = self.signedCookieLifetime
+        if self.storageBackend == 'volatile':
+            return getSharedStorage(
+                ('cookiepgt', 'volatile', getPluginKey(self), lifetime),
+                VolatileMapping, lifetime )
+
+        directory = os.path.join( getStorageDirectory(self), 'cookiepgt' )
+        return getSharedStorage( ('cookiepgt', 'file', directory, lifetime),
+                                 FileMapping, directory, lifetime )
+
+    def _getCookieSecret( self ):
+        if not self._cookieSecret:
+            # plugins created before signed cookies were supported
+            self._cookieSecret = newSecret()
+
+        return self._cookieSecret
+
     security.declarePrivate( 'authenticateCredentials' )
     def authenticateCredentials( self, credentials ):
         if credentials['extractor'] != self.getId():
@@ -274,22 +751,74 @@ class AnzCASClient( BasePlugin, Cacheable ):
         login = credentials['login']
         return ( login, login )
 
+    security.declarePrivate( 'getPropertiesForUser' )
+    def getPropertiesForUser( self, user, request=None ):
+        ''' Provide the attributes CAS released for the authenticated user
+        as properties.
+
+        '''
+        assertion = self._getRequestAssertion( user.getId(), request )
+        if assertion is None:
+            return {}
+
+        properties = dict( assertion.getPrincipal().getAttributes() )
+        properties.pop( self.groupsAttribute, None )
+        return properties
+
+    security.declarePrivate( 'getGroupsForPrincipal' )
+    def getGroupsForPrincipal( self, principal, request=None ):
+        ''' Provide the groups CAS released for the authenticated user in
+        the groupsAttribute attribute.
+
+        '''
+        if not self.groupsAttribute:
+            return ()
+
+        assertion = self._getRequestAssertion( principal.getId(), request )
+        if assertion is None:
+            return ()
+
+        groups = assertion.getPrincipal().getAttributes().get(
+            self.groupsAttribute )
+        if not groups:
+            return ()
+
+        if isinstance( groups, basestring ):
+            return ( groups, )
+
+        return tuple( groups )
+
+    def _getRequestAssertion( self, userId, request=None ):
+        ''' Return the assertion credentials were extracted from for the
+        current request if it was issued for userId, None otherwise.
+
+        '''
+        if request is None:
+            request = getattr( self, 'REQUEST', None )
+            if request is None:
+                return None
+
+        assertion = request.other.get( self.CAS_REQUEST_ASSERTION +
+                                       self.getId() )
+        if assertion is None or assertion.getPrincipal().getId() != userId:
+            return None
+
+        return assertion
+
     security.declarePrivate( 'challenge' )
     def challenge( self, request, response, **kw ):
         ''' Challenge the user for credentials. '''
         # Remove current credentials.
-        session = request.SESSION
-        session[self.CAS_ASSERTION] = None
-
-        # Redirect to CAS login URL.
-        if self.casServerUrlPrefix:
-            url = self.getLoginURL() + '?service=' + self.getService()
-            if self.renew:
-                url += '&renew=true'
-            if self.gateway:
-                url += '&gateway=true'
+        if self.useSignedCookie:
+            response.expireCookie( self.signedCookieName, path='/' )
+        else:
+            session = request.SESSION
+            session[self.CAS_ASSERTION] = None
+        self._forgetCredentials( request )
 
-            response.redirect( url, lock=1 )
+        # Redirect to CAS login URL, unless CAS is known to be down.
+        if self.casServerUrlPrefix and not self._isCircuitOpen():
+            response.redirect( self._getLoginRedirectURL(), lock=1 )
             return 1
 
         # Fall through to the standard unauthorized() call.
@@ -298,8 +827,21 @@ class AnzCASClient( BasePlugin, Cacheable ):
     security.declarePrivate( 'resetCredentials' )
     def resetCredentials( self, request, response ):
         ''' Clears credentials and redirects to CAS logout page. '''
-        session = request.SESSION
-        session.clear()
+        if self.useSignedCookie:
+            # the session is not used, do not create one
+            value = request.cookies.get( self.signedCookieName )
+            if value:
+                # only the ticket of this browser, the user may be logged
+                # in elsewhere
+                dropPgt( value, self._getCookieSecret(),
+                         self._getCookiePgtStorage() )
+
+            response.expireCookie( self.signedCookieName, path='/' )
+        else:
+            session = request.SESSION
+            session.clear()
+
+        self._forgetCredentials( request )
 
         if self.casServerUrlPrefix:
             return response.redirect( self.getLogoutURL(), lock=1 )
@@ -307,9 +849,27 @@ class AnzCASClient( BasePlugin, Cacheable ):
     security.declarePublic( 'proxyCallback' )
     def proxyCallback( self, pgtId=None, pgtIou=None ):
         ''' See interfaces.IAnzCASClient. '''
+        return getMetrics().call( 'proxy_callback', self._proxyCallback,
+                                  pgtId, pgtIou )
+
+    def _proxyCallback( self, pgtId, pgtIou, persistent=True ):
+        ''' Record the pgt of pgtIou.
+
+        @param persistent
+        whether the pgt may be written to the 'zodb' storage backend, if
+        not it is only handed over through the rendezvous.
+
+        '''
         ret = 'success'
         if pgtId and pgtIou:
-            self._pgtStorage.add( pgtIou, pgtId )
+            storage = self._getPgtStorage()
+            if persistent or getattr( storage, '_p_jar', None ) is None:
+                storage.add( pgtIou, pgtId )
+            else:
+                # the validation may run on another Zope client
+                getPgtHandover( self ).set( pgtIou, pgtId )
+            # wake up the validation waiting for it in this process
+            getPgtRendezvous().publish( pgtIou, pgtId )
             ret = '<?xml version=\"1.0\"?>'
             ret += '<casClient:proxySuccess xmlns:casClient="http://www.yale.edu/tp/casClient" />'
 
@@ -318,23 +878,34 @@ class AnzCASClient( BasePlugin, Cacheable ):
     security.declarePublic( 'logoutCallback' )
     def logoutCallback( self ):
         ''' See interfaces.IAnzCASClient. '''
-        msg = 'No session id found.'
-        dom = minidom.parseString( self.REQUEST.form.get('logoutRequest','') )
-        SAMLP_NS = 'urn:oasis:names:tc:SAML:2.0:protocol'
-        elements = dom.getElementsByTagNameNS( SAMLP_NS,
-                                               'SessionIndex' )
-        if elements:
-            mappingId = elements[0].firstChild.data
-            sessionId = self._sessionStorage.getSessionId( mappingId )
-            self._sessionStorage.removeByMappingId( mappingId )
-
-            sdm = getattr( self, 'session_data_manager', None )
-            assert sdm is not None, 'No session data manager found!'
-
-            session = sdm.getSessionDataByKey( sessionId )
-            if session:
-                session.clear()
+        return getMetrics().call( 'logout_callback', self._logoutCallback )
 
+    def _logoutCallback( self ):
+        self._ensureBackChannel()
+        msg = 'No session id found.'
+        mappingId = parseLogoutRequest(
+            self.REQUEST.form.get('logoutRequest','') )
+        if mappingId:
+            if self.sloSpoolDirectory:
+                # The session may live on another Zope client, tell them.
+                # A broken spool must not keep the local session alive.
+                sessionId = self._getSessionStorage().getSessionId(
+                    mappingId )
+                try:
+                    getLogoutSpool( self.sloSpoolDirectory ).broadcast(
+                        self.getPhysicalPath(), mappingId, sessionId )
+                except ( IOError, OSError ), e:
+                    LOG.warning( 'Can not forward the logout through the '
+                                 'spool %s: %s' % ( self.sloSpoolDirectory,
+                                                    e) )
+
+            if self.asyncSingleSignOut:
+                if getLogoutQueue().put( self.getPhysicalPath(), mappingId ):
+                    return 'Logout queued.'
+
+                # the queue is full, apply it right away
+
+            if self._logoutSessions( [mappingId] ):
                 # We must commit here to make sure the session will be cleared.
                 transaction.commit()
 
@@ -342,18 +913,112 @@ class AnzCASClient( BasePlugin, Cacheable ):
 
         return msg
 
+    def _logoutSessions( self, mappingIds, sessionIds=None ):
+        ''' Clear the sessions mapped to mappingIds, the transaction is left
+        to the caller.
+
+        @param sessionIds
+        ids of the sessions to clear, mapping id as key, sessions not found
+        in it are looked up in the session mapping storage
+
+        @return
+        the number of sessions cleared.
+
+        '''
+        sessionStorage = self._getSessionStorage()
+        sdm = getattr( self, 'session_data_manager', None )
+        assert sdm is not None, 'No session data manager found!'
+
+        cleared = 0
+        for mappingId in mappingIds:
+            sessionId = ( sessionIds or {} ).get( mappingId ) or \
+                        sessionStorage.getSessionId( mappingId )
+            sessionStorage.removeByMappingId( mappingId )
+            if sessionId is None:
+                continue
+
+            session = sdm.getSessionDataByKey( sessionId )
+            if session:
+                session.clear()
+                cleared += 1
+
+        if cleared:
+            self._invalidateAssertionCache()
+
+        return cleared
+
+    security.declareProtected( ManageUsers, 'getMetricsSnapshot' )
+    def getMetricsSnapshot( self ):
+        ''' Return the call count, failures, requests in flight, rate,
+        latencies and saved baseline of each instrumented operation, sorted
+        by name.
+
+        '''
+        snapshot = getMetrics().getSnapshot()
+        baseline = self._metricsBaseline or {}
+        ret = []
+        for name in sorted( snapshot ):
+            data = snapshot[name]
+            data['name'] = name
+            data['average'] = data['count'] and \
+                              data['sum'] / data['count'] or 0.0
+            data['baseline'] = baseline.get( name )
+            ret.append( data )
+
+        return ret
+
+    security.declareProtected( ManageUsers, 'manage_saveMetricsBaseline' )
+    def manage_saveMetricsBaseline( self, REQUEST=None ):
+        ''' Save the current rate and p50, p90, p99 latencies of each
+        operation as the baseline shown next to them.
+
+        '''
+        baseline = {}
+        for data in self.getMetricsSnapshot():
+            if data['count']:
+                baseline[data['name']] = dict(
+                    [ (key, data[key]) for key in
+                      ('rate', 'p50', 'p90', 'p99', 'count') ] )
+
+        self._metricsBaseline = baseline
+
+        if REQUEST is not None:
+            REQUEST['RESPONSE'].redirect(
+                '%s/manage_metrics'
+                '?manage_tabs_message='
+                'Baseline+saved.'
+                % self.absolute_url()
+                )
+
+    security.declareProtected( ManageUsers, 'getSingleSignOutStats' )
+    def getSingleSignOutStats( self ):
+        ''' Return the depth, processed and failed counts and the rate (per
+        second) of the background single sign out queue.
+
+        '''
+        stats = getLogoutQueue().getStats()
+        if self.sloSpoolDirectory:
+            stats['spool'] = getLogoutSpool( self.sloSpoolDirectory ).getStats()
+
+        return stats
+
     security.declarePublic( 'validateProxyTicket' )
     def validateProxyTicket( self, ticket ):
         ''' See interfaces.IAnzCASClient. '''
-        validator = Cas20ProxyTicketValidator(
-            self.casServerUrlPrefix,
-            self._pgtStorage,
-            acceptAnyProxy=self.acceptAnyProxy,
-            allowedProxyChains=self.allowedProxyChains,
-            renew=self.renew )
+        service = self.getService()
 
+        cache = self._getProxyTicketCache()
+        if cache is not None:
+            assertion = cache.get( (ticket, service) )
+            if assertion is not None:
+                return True, assertion
+
+        self._ensureBackChannel()
+        validator = self._getValidator( 'proxy' )
         try:
-            assertion = validator.validate( ticket, self.getService() )
+            assertion = getMetrics().call( 'validate_proxy_ticket',
+                                           validator.validate,
+                                           ticket, service )
         except BaseException, e:
             LOG.warning( e )
             return False, None
@@ -361,46 +1026,250 @@ class AnzCASClient( BasePlugin, Cacheable ):
             LOG.warning( e )
             return False, None
         else:
+            if cache is not None:
+                cache.set( (ticket, service), assertion )
+
             return True, assertion
 
+    security.declareProtected( ManageUsers, 'getCircuitBreakerState' )
+    def getCircuitBreakerState( self ):
+        ''' Return the state ('closed', 'open' or 'half-open') and counters
+        of the circuit breaker guarding the CAS server or None if it is
+        disabled.
+
+        '''
+        breaker = self._configureCircuitBreaker()
+        return breaker is not None and breaker.getState() or None
+
+    security.declareProtected( ManageUsers, 'getBackChannelState' )
+    def getBackChannelState( self ):
+        ''' Return a list of dicts describing the health, circuit breaker
+        state and requests in flight of each back-channel CAS server node
+        or None if casServerBackChannelUrls is not set.
+
+        '''
+        group = self._configureEndpointGroup()
+        return group is not None and group.getState() or None
+
+    security.declareProtected( ManageUsers, 'getProxyTicketCacheStats' )
+    def getProxyTicketCacheStats( self ):
+        ''' Return the size, limits, hits, misses and evictions of the
+        proxy ticket validation cache or None if it is disabled.
+
+        '''
+        cache = self._getProxyTicketCache()
+        return cache is not None and cache.getStats() or None
+
+    security.declareProtected( ManageUsers, 'getStateSamples' )
+    def getStateSamples( self ):
+        ''' Return the state of the circuit breaker, back-channel nodes,
+        proxy ticket cache and single sign out queue as ( name, type,
+        labels, value ) samples, see metrics.renderSamples.
+
+        '''
+        samples = []
+        breaker = self.getCircuitBreakerState()
+        if breaker is not None:
+            for state in ( CLOSED, OPEN, HALF_OPEN ):
+                samples.append( ('circuit_state', 'gauge', {'state': state},
+                                 breaker['state'] == state) )
+            samples.extend( [
+                ('circuit_requests', 'gauge', None, breaker['requests']),
+                ('circuit_failures', 'gauge', None, breaker['failures']),
+                ('circuit_opened_total', 'counter', None,
+                 breaker['opened']),
+                ('circuit_rejected_total', 'counter', None,
+                 breaker['rejected']) ] )
+
+        nodes = self.getBackChannelState() or []
+        for name, kind, key in (
+            ('backchannel_node_healthy', 'gauge', 'healthy'),
+            ('backchannel_node_available', 'gauge', 'available'),
+            ('backchannel_node_in_flight', 'gauge', 'outstanding'),
+            ('backchannel_node_failures_total', 'counter', 'failures') ):
+            for node in nodes:
+                samples.append( (name, kind, {'url': node['url']},
+                                 node[key]) )
+
+        cache = self.getProxyTicketCacheStats()
+        if cache is not None:
+            samples.extend( [
+                ('proxy_ticket_cache_size', 'gauge', None, cache['size']),
+                ('proxy_ticket_cache_hits_total', 'counter', None,
+                 cache['hits']),
+                ('proxy_ticket_cache_misses_total', 'counter', None,
+                 cache['misses']),
+                ('proxy_ticket_cache_evictions_total', 'counter', None,
+                 cache['evictions']) ] )
+
+        slo = self.getSingleSignOutStats()
+        samples.extend( [
+            ('slo_queue_depth', 'gauge', None, slo['depth']),
+            ('slo_processed_total', 'counter', None, slo['processed']),
+            ('slo_failed_total', 'counter', None, slo['failed']),
+            ('slo_batches_total', 'counter', None, slo['batches']) ] )
+        spool = slo.get( 'spool' )
+        if spool is not None:
+            samples.extend( [
+                ('slo_spool_peers', 'gauge', None, spool['peers']),
+                ('slo_spool_sent_total', 'counter', None, spool['sent']),
+                ('slo_spool_received_total', 'counter', None,
+                 spool['received']) ] )
+
+        return samples
+
+    def _getProxyTicketCache( self ):
+        ''' Retrieve the proxy ticket validation cache of this plugin,
+        shared by all the threads of the process, or None if disabled.
+
+        '''
+        if not self.cacheProxyTicketValidation:
+            return None
+
+        cache = getSharedStorage( ('ptcache', getPluginKey(self)), LRUCache,
+                                  self.proxyTicketCacheSize,
+                                  self.proxyTicketCacheTTL )
+        if cache.maxSize != self.proxyTicketCacheSize or \
+           cache.ttl != self.proxyTicketCacheTTL:
+            cache.configure( self.proxyTicketCacheSize,
+                             self.proxyTicketCacheTTL )
+
+        return cache
+
+    def _getAssertionCache( self ):
+        ''' Retrieve the per-thread assertion cache of this plugin, keyed
+        by browser id, or None if disabled.
+
+        '''
+        if not self.assertionCacheTTL:
+            return None
+
+        cache = getSharedStorage( ('assertions', getPluginKey(self)),
+                                  ThreadLocalCache, 100,
+                                  self.assertionCacheTTL )
+        cache.ttl = self.assertionCacheTTL
+        return cache
+
+    def _invalidateAssertionCache( self ):
+        cache = self._getAssertionCache()
+        if cache is not None:
+            cache.invalidate()
+
+    def _forgetCredentials( self, request ):
+        ''' Drop the credentials memoized for request, and the cached
+        assertions if the request was authenticated.
+
+        '''
+        creds = request.other.pop( self.CAS_CREDENTIALS + self.getId(), None )
+        request.other.pop( self.CAS_REQUEST_ASSERTION + self.getId(), None )
+        if creds:
+            self._invalidateAssertionCache()
+
+    def _getBrowserId( self, sdm ):
+        ''' Return the browser id of the current request without creating
+        one, or None.
+
+        '''
+        try:
+            return sdm.getBrowserIdManager().getBrowserId( create=0 )
+        except Exception, e:
+            LOG.warning( e )
+            return None
+
     def getLoginURL( self ):
         ''' See interfaces.IAnzCASClient. '''
         return self.casServerUrlPrefix + '/login'
 
     def getLogoutURL( self ):
         ''' See interfaces.IAnzCASClient. '''
-        return self.casServerUrlPrefix + '/logout?url=%s' % self.getService()
+        urls = self._getFixedURLs()
+        if urls is not None:
+            return urls['logout']
+
+        return self._buildLogoutURL( self.getService() )
 
     def getService( self ):
         ''' See interfaces.IAnzCASClient. '''
-        serviceUrl = ''
-
-        if self.serviceUrl:
+        urls = self._getFixedURLs()
+        if urls is not None:
             # use explicitly setted service url
-            serviceUrl = self.serviceUrl
-        else:
-            # extract service URL from REQUEST and remove the ticket parameters.
-            request = self.REQUEST
+            return urls['service']
 
-            # get query string but strip ticket parameter
-            query_string = request.get( 'QUERY_STRING', '' )
-            parts = [ p for p in query_string.split('&') if \
-                      (p and p.find( 'ticket=' )!=0) ]
+        # extract service URL from REQUEST, once per request
+        request = self.REQUEST
+        key = self.CAS_SERVICE + self.getId()
+        service = request.other.get( key )
+        if service is None:
+            service = request.other[key] = quote( self._getRequestURL(request) )
 
-            url = request.get( 'ACTUAL_URL', request['URL'] )
+        return service
 
-            serviceUrl = '%s?%s' % ( url, '&'.join(parts) )
+    def _getRequestURL( self, request ):
+        ''' Return the URL of request without its ticket parameters. '''
+        url = request.get( 'ACTUAL_URL', request['URL'] )
 
-        return quote( serviceUrl )
+        # strip the ticket parameters, but keep the others as they came
+        parts = []
+        for part in request.get( 'QUERY_STRING', '' ).split( '&' ):
+            name = unquote_plus( part.split('=', 1)[0] )
+            if name and name != 'ticket':
+                parts.append( part )
+
+        return '%s?%s' % ( url, '&'.join(parts) )
+
+    def _getFixedURLs( self ):
+        ''' Return a dict of the service, login and logout URLs built once
+        from serviceUrl, or None if the service is the requested URL.
+
+        '''
+        if not self.serviceUrl:
+            return None
+
+        urls = getattr( aq_base(self), '_v_urls', None )
+        if urls is None:
+            service = quote( self.serviceUrl )
+            urls = self._v_urls = {
+                'service': service,
+                'login': self._buildLoginRedirectURL( service ),
+                'logout': self._buildLogoutURL( service ) }
+
+        return urls
+
+    def _getLoginRedirectURL( self ):
+        ''' Return the URL of the CAS login page users are redirected to. '''
+        urls = self._getFixedURLs()
+        if urls is not None:
+            return urls['login']
+
+        return self._buildLoginRedirectURL( self.getService() )
+
+    def _buildLoginRedirectURL( self, service ):
+        url = self.getLoginURL() + '?service=' + service
+        if self.renew:
+            url += '&renew=true'
+        if self.gateway:
+            url += '&gateway=true'
+
+        return url
+
+    def _buildLogoutURL( self, service ):
+        return self.casServerUrlPrefix + '/logout?url=%s' % service
 
     def getProxyCallbackUrl( self ):
         ''' See interfaces.IAnzCASClient. '''
-        return self.proxyCallbackUrlPrefix and \
-               '%s/proxyCallback' % self.proxyCallbackUrlPrefix or ''
+        if not self.proxyCallbackUrlPrefix:
+            return ''
+
+        if self.slimProxyCallback:
+            return '%s/@@anz-casclient-proxycallback' % \
+                   self.proxyCallbackUrlPrefix
+
+        return '%s/proxyCallback' % self.proxyCallbackUrlPrefix
 
     def getAssertion( self, session ):
         ''' See interfaces.IAnzCASClient. '''
         assertion = None
+        self._ensureBackChannel()
 
         if self.useSession and session:
             sessionValue = session.get( self.CAS_ASSERTION )
@@ -409,34 +1278,246 @@ class AnzCASClient( BasePlugin, Cacheable ):
 
         return assertion
 
-    def validateServiceTicket( self, service, ticket ):
-        ''' See interfaces.IAnzCASClient. '''
+    def _getPgtStorage( self ):
+        ''' Retrieve the proxy granting ticket storage of the configured
+        storage backend.
+
+        '''
+        storage = queryAdapter( self, IProxyGrantingTicketStorage,
+                                name=self.storageBackend )
+        if storage is None:
+            # zcml not loaded, fall back to the storage in the ZODB.
+            storage = self._pgtStorage
+
+        return storage
+
+    def _getSessionStorage( self ):
+        ''' Retrieve the session mapping storage of the configured storage
+        backend.
+
+        '''
+        storage = queryAdapter( self, ISessionMappingStorage,
+                                name=self.storageBackend )
+        if storage is None:
+            storage = self._sessionStorage
+
+        return storage
+
+    def _ensureBackChannel( self ):
+        ''' Apply the settings of this plugin to the process wide helpers
+        once, and again after a property was changed.
+
+        '''
+        if not getattr( aq_base(self), '_v_backChannel', False ):
+            self._configureBackChannel()
+            self._v_backChannel = True
+
+    def _configureBackChannel( self ):
+        ''' Apply the settings of this plugin to the process wide helpers
+        used to talk to the CAS server and to the other Zope clients.
+
+        '''
+        configureTransport( self.connectionPoolSize,
+                            self.maxConnectionsPerHost,
+                            self.connectionIdleTimeout )
+        getAsyncTransport().configure( self.connectionPoolSize,
+                                       self.connectionIdleTimeout )
+        self._configureProxyTicketPool()
+        self._configureCircuitBreaker()
+        self._configureEndpointGroup()
+        getMetrics().setEnabled( getPluginKey(self),
+                                 bool(self.collectMetrics) )
+        if self.asyncSingleSignOut:
+            getLogoutQueue().batchSize = self.singleSignOutBatchSize
+
+        if self.sloSpoolDirectory:
+            # start polling for logout requests forwarded by other clients,
+            # a broken spool must not break authentication
+            try:
+                getLogoutSpool( self.sloSpoolDirectory )
+            except ( IOError, OSError ), e:
+                LOG.warning( 'Can not use the logout spool %s: %s' % (
+                    self.sloSpoolDirectory, e) )
+
+    def _configureProxyTicketPool( self ):
+        ''' Make sure principals validated by this plugin retrieve their
+        proxy tickets through a pool of their own if one is configured.
+
+        '''
+        configureProxyTicketPool( getPluginKey(self),
+                                  self.proxyTicketPoolSize,
+                                  self.proxyTicketMaxAge )
+
+    def _configureCircuitBreaker( self ):
+        ''' Make sure back-channel requests to the CAS server are guarded
+        by a circuit breaker with the settings of this plugin.
+
+        @return
+        the circuit breaker or None if disabled.
+
+        '''
+        if not self.casServerUrlPrefix:
+            return None
+
+        # each back-channel node gets a breaker of its own
+        for url in self.casServerBackChannelUrls:
+            if url.strip():
+                configureCircuitBreaker( url.strip(),
+                                         self.circuitBreakerThreshold,
+                                         self.circuitBreakerMinRequests,
+                                         self.circuitBreakerWindow,
+                                         self.circuitBreakerCoolDown )
+
+        return configureCircuitBreaker( self.casServerUrlPrefix,
+                                        self.circuitBreakerThreshold,
+                                        self.circuitBreakerMinRequests,
+                                        self.circuitBreakerWindow,
+                                        self.circuitBreakerCoolDown )
+
+    def _configureEndpointGroup( self ):
+        ''' Make sure back-channel requests are spread over the nodes of
+        casServerBackChannelUrls.
+
+        @return
+        the endpoint group or None if no back-channel node is set.
+
+        '''
+        if not self.casServerUrlPrefix:
+            return None
+
+        return configureEndpointGroup( self.casServerUrlPrefix,
+                                       self.casServerBackChannelUrls,
+                                       self.healthCheckInterval )
+
+    def _isCircuitOpen( self ):
+        ''' Return whether the CAS server is known to be down. '''
+        group = getEndpointGroup( self.casServerUrlPrefix )
+        if group is not None:
+            for endpoint in group.endpoints:
+                if endpoint.isAvailable():
+                    return False
+
+            return True
+
+        breaker = getCircuitBreaker( self.casServerUrlPrefix )
+        return breaker is not None and breaker.isOpen()
+
+    def _updateProperty( self, id, value ):
+        ''' Drop the validators and URLs built from the previous settings,
+        and apply the new ones to the back-channel helpers on next use.
+        '''
+        BasePlugin._updateProperty( self, id, value )
+        self._v_validators = {}
+        self._v_urls = None
+        self._v_backChannel = False
+
+    def _getValidator( self, kind ):
+        ''' Retrieve the validator of kind 'service' or 'proxy', validators
+        are built once and reused until a property is changed.
+
+        '''
+        validators = getattr( aq_base(self), '_v_validators', None )
+        if validators is None:
+            validators = self._v_validators = {}
+
+        validator = validators.get( kind )
+        if validator is None:
+            if kind == 'proxy':
+                validator = self._createProxyTicketValidator()
+            else:
+                validator = self._createServiceTicketValidator()
+
+            validator.poolKey = getPluginKey( self )
+            if self.slimProxyCallback:
+                validator.pgtHandover = getPgtHandover( self )
+
+            validators[kind] = validator
+
+        return validator
+
+    def _getTransport( self ):
+        ''' Retrieve the transport validators send their requests with,
+        None means the shared pooled transport.
+
+        '''
+        return self.asyncValidation and getAsyncTransport() or None
+
+    def _createProxyTicketValidator( self ):
+        if self.ticketValidationSpecification == 'CAS 3.0':
+            return Cas30ProxyTicketValidator(
+                self.casServerUrlPrefix,
+                self._getPgtStorage(),
+                acceptAnyProxy=self.acceptAnyProxy,
+                allowedProxyChains=self.allowedProxyChains,
+                renew=self.renew,
+                connectTimeout=self.connectTimeout,
+                readTimeout=self.readTimeout,
+                transport=self._getTransport(),
+                responseFormat=self.responseFormat )
+
+        return Cas20ProxyTicketValidator(
+            self.casServerUrlPrefix,
+            self._getPgtStorage(),
+            acceptAnyProxy=self.acceptAnyProxy,
+            allowedProxyChains=self.allowedProxyChains,
+            renew=self.renew,
+            connectTimeout=self.connectTimeout,
+            readTimeout=self.readTimeout,
+            transport=self._getTransport() )
+
+    def _createServiceTicketValidator( self ):
+        pgtStorage = self._getPgtStorage()
+        transport = self._getTransport()
         if self.ticketValidationSpecification == 'CAS 1.0':
             validator = Cas10TicketValidator(
-                self.casServerUrlPrefix, self.renew )
+                self.casServerUrlPrefix, self.renew,
+                self.connectTimeout, self.readTimeout, transport )
+        elif self.ticketValidationSpecification == 'CAS 3.0':
+            # CAS 3.0 releases attributes itself, no need for SAML
+            if self.acceptAnyProxy or self.allowedProxyChains:
+                validator = self._createProxyTicketValidator()
+            else:
+                validator = Cas30ServiceTicketValidator(
+                    self.casServerUrlPrefix, pgtStorage, self.renew,
+                    self.connectTimeout, self.readTimeout, transport,
+                    self.responseFormat )
         else:
             if self.acceptAnyProxy or self.allowedProxyChains:
                 validator = Cas20ProxyTicketValidator(
                     self.casServerUrlPrefix,
-                    self._pgtStorage,
+                    pgtStorage,
                     acceptAnyProxy=self.acceptAnyProxy,
                     allowedProxyChains=self.allowedProxyChains,
-                    renew=self.renew )
+                    renew=self.renew,
+                    connectTimeout=self.connectTimeout,
+                    readTimeout=self.readTimeout,
+                    transport=transport )
             else:
                 if self.SAMLValidate:
                     validator = Cas20SAMLServiceTicketValidator(
-                        self.casServerUrlPrefix, self._pgtStorage, self.renew)
+                        self.casServerUrlPrefix, pgtStorage, self.renew,
+                        self.connectTimeout, self.readTimeout, transport )
                 else:
                     validator = Cas20ServiceTicketValidator(
-                        self.casServerUrlPrefix, self._pgtStorage, self.renew )
+                        self.casServerUrlPrefix, pgtStorage, self.renew,
+                        self.connectTimeout, self.readTimeout, transport )
 
-        return validator.validate(
+        return validator
+
+    def validateServiceTicket( self, service, ticket ):
+        ''' See interfaces.IAnzCASClient. '''
+        self._ensureBackChannel()
+        validator = self._getValidator( 'service' )
+        return getMetrics().call(
+            'validate_service_ticket', validator.validate,
             ticket, service, self.getProxyCallbackUrl() )
 
 classImplements( AnzCASClient,
                  IExtractionPlugin,
                  IChallengePlugin,
                  ICredentialsResetPlugin,
-                 IAuthenticationPlugin )
+                 IAuthenticationPlugin,
+                 IPropertiesPlugin,
+                 IGroupsPlugin )
 
 InitializeClass( AnzCASClient )
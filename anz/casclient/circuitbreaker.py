@@ -0,0 +1,226 @@
+
+# python
+import threading
+import time
+from collections import deque
+from urlparse import urlsplit
+from logging import getLogger
+
+from anz.casclient.exceptions import DeadlineExceededException, \
+     HTTPErrorException
+
+LOG = getLogger( 'anz.casclient' )
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+class CircuitBreaker( object ):
+    ''' Tracks the outcome of the requests sent to one CAS server and stops
+    sending them while it is unhealthy.
+
+    The breaker opens when at least failureThreshold of the requests sent
+    in the last window seconds failed (and at least minRequests were
+    sent). While open, requests are refused right away. After coolDown
+    seconds one probe request is let through (half-open), its success
+    closes the breaker again, its failure opens it for another coolDown.
+
+    '''
+
+    def __init__( self, failureThreshold=0.5, minRequests=10, window=30,
+                  coolDown=30 ):
+        ''' Construct a circuit breaker.
+
+        @param failureThreshold
+        rate of failed requests (0 to 1) opening the breaker
+
+        @param minRequests
+        min number of requests in the window before the breaker may open
+
+        @param window
+        seconds the outcome of a request is taken into account for
+
+        @param coolDown
+        seconds the breaker stays open before a probe is let through
+
+        '''
+        self.failureThreshold = failureThreshold
+        self.minRequests = minRequests
+        self.window = window
+        self.coolDown = coolDown
+
+        self.state = CLOSED
+        self.openedAt = None
+        self.opened = 0
+        self.rejected = 0
+
+        # ( time, failed ) of the requests in the window
+        self._outcomes = deque()
+        self._failures = 0
+        self._probeStarted = None
+        self._lock = threading.Lock()
+
+    def allow( self ):
+        ''' Return whether a request may be sent now. '''
+        now = time.time()
+        self._lock.acquire()
+        try:
+            if self.state == CLOSED:
+                return True
+
+            if self.state == OPEN:
+                if now - self.openedAt < self.coolDown:
+                    self.rejected += 1
+                    return False
+
+                self.state = HALF_OPEN
+                LOG.info( 'Circuit breaker half-open, probing CAS server.' )
+            elif self._probeStarted is not None and \
+                 now - self._probeStarted < self.coolDown:
+                # a probe is in flight already
+                self.rejected += 1
+                return False
+
+            self._probeStarted = now
+            return True
+        finally:
+            self._lock.release()
+
+    def isOpen( self ):
+        ''' Return whether requests are currently refused. '''
+        return self.state == OPEN and \
+               time.time() - self.openedAt < self.coolDown
+
+    def recordSuccess( self ):
+        self._record( False )
+
+    def recordFailure( self ):
+        self._record( True )
+
+    def reset( self ):
+        ''' Close the breaker and forget the recorded outcomes. '''
+        self._lock.acquire()
+        try:
+            self._close()
+        finally:
+            self._lock.release()
+
+    def getState( self ):
+        ''' Return a dict of the state and counters of the breaker. '''
+        self._lock.acquire()
+        try:
+            self._prune( time.time() )
+            return { 'state': self.state,
+                     'openedAt': self.openedAt,
+                     'requests': len( self._outcomes ),
+                     'failures': self._failures,
+                     'opened': self.opened,
+                     'rejected': self.rejected }
+        finally:
+            self._lock.release()
+
+    def _record( self, failed ):
+        now = time.time()
+        self._lock.acquire()
+        try:
+            if self.state == HALF_OPEN:
+                self._probeStarted = None
+                if failed:
+                    self._open( now )
+                else:
+                    LOG.info( 'Circuit breaker closed, CAS server is back.' )
+                    self._close()
+                return
+
+            if self.state == OPEN:
+                # sent before the breaker opened
+                return
+
+            self._outcomes.append( (now, failed) )
+            if failed:
+                self._failures += 1
+
+            self._prune( now )
+            total = len( self._outcomes )
+            if failed and total >= self.minRequests and \
+               self._failures >= total * self.failureThreshold:
+                LOG.warning( 'Circuit breaker opened, %d of the last %d '
+                             'requests to CAS server failed.' % \
+                             ( self._failures, total ) )
+                self._open( now )
+        finally:
+            self._lock.release()
+
+    def _open( self, now ):
+        self.state = OPEN
+        self.openedAt = now
+        self.opened += 1
+
+    def _close( self ):
+        self.state = CLOSED
+        self.openedAt = None
+        self._probeStarted = None
+        self._outcomes.clear()
+        self._failures = 0
+
+    def _prune( self, now ):
+        expired = now - self.window
+        while self._outcomes and self._outcomes[0][0] < expired:
+            if self._outcomes.popleft()[1]:
+                self._failures -= 1
+
+def isFailure( error ):
+    ''' Return whether a ConnectionException tells the CAS server is
+    unhealthy: connect errors, read timeouts and 5xx responses are, a 4xx
+    response or the deadline of the request running out are not.
+
+    '''
+    if isinstance( error, DeadlineExceededException ):
+        return False
+
+    if isinstance( error, HTTPErrorException ):
+        return error.status >= 500
+
+    return True
+
+_breakers = {}
+_lock = threading.Lock()
+
+def _endpoint( url ):
+    parts = urlsplit( url )
+    return '%s://%s' % ( parts.scheme or 'http', parts.netloc.lower() )
+
+def getCircuitBreaker( url ):
+    ''' Retrieve the circuit breaker guarding the CAS server url belongs to
+    or None if requests to it are not guarded.
+
+    '''
+    return _breakers.get( _endpoint(url) )
+
+def configureCircuitBreaker( url, failureThreshold, minRequests, window,
+                             coolDown ):
+    ''' Guard requests to the CAS server url belongs to with a circuit
+    breaker, a failureThreshold of 0 removes the breaker. The state of an
+    existing breaker is kept when its settings change.
+
+    '''
+    endpoint = _endpoint( url )
+    _lock.acquire()
+    try:
+        if not failureThreshold:
+            _breakers.pop( endpoint, None )
+            return None
+
+        breaker = _breakers.get( endpoint )
+        if breaker is None:
+            breaker = _breakers[endpoint] = CircuitBreaker(
+                failureThreshold, minRequests, window, coolDown )
+        else:
+            breaker.failureThreshold = failureThreshold
+            breaker.minRequests = minRequests
+            breaker.window = window
+            breaker.coolDown = coolDown
+    finally:
+        _lock.release()
+
+    return breaker
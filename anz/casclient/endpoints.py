@@ -0,0 +1,242 @@
+
+# python
+import random
+import threading
+import time
+from logging import getLogger
+
+from anz.casclient.exceptions import ConnectionException
+from anz.casclient.transport import getTransport
+from anz.casclient.circuitbreaker import getCircuitBreaker, isFailure
+
+LOG = getLogger( 'anz.casclient' )
+
+class Endpoint( object ):
+    ''' One CAS server node of an EndpointGroup. '''
+
+    def __init__( self, url ):
+        self.url = url
+        self.healthy = True
+        self.outstanding = 0
+        self.failures = 0
+        self.lastChecked = None
+
+    def isAvailable( self ):
+        breaker = getCircuitBreaker( self.url )
+        return self.healthy and ( breaker is None or not breaker.isOpen() )
+
+    def getCircuitState( self ):
+        breaker = getCircuitBreaker( self.url )
+        return breaker is not None and breaker.state or None
+
+class EndpointGroup( object ):
+    ''' Spreads the back-channel requests meant for one CAS server over
+    several nodes.
+
+    Requests go to the available node with the fewest requests in flight.
+    A node failing a request is taken out of rotation and the request is
+    retried on the next node, a background thread probes the nodes every
+    probeInterval seconds and puts recovered ones back.
+
+    '''
+
+    def __init__( self, canonicalUrl, urls, probeInterval=10,
+                  probePath='/login', probeTimeout=2 ):
+        ''' Construct an endpoint group.
+
+        @param canonicalUrl
+        the CAS server url prefix the requests are built with
+
+        @param urls
+        url prefixes of the CAS server nodes
+
+        @param probeInterval
+        seconds between two health probes of the nodes, 0 disables probing
+
+        @param probePath
+        path requested on each node to check its health
+
+        @param probeTimeout
+        connect and read timeout of a health probe
+
+        '''
+        self.canonicalUrl = canonicalUrl.rstrip( '/' )
+        self.endpoints = [ Endpoint(url.rstrip('/')) for url in urls ]
+        self.probeInterval = probeInterval
+        self.probePath = probePath
+        self.probeTimeout = probeTimeout
+
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._prober = None
+        if probeInterval:
+            self._prober = threading.Thread(
+                target=self._probeLoop, name='anz.casclient health probe' )
+            self._prober.setDaemon( True )
+            self._prober.start()
+
+    def matches( self, url ):
+        return url == self.canonicalUrl or \
+               url.startswith( self.canonicalUrl + '/' )
+
+    def request( self, send, url ):
+        ''' Send a request meant for the canonical CAS server to one of
+        the nodes, failing over to the others on connection errors.
+
+        @param send
+        a callable taking the url to request and returning the response
+
+        @param url
+        the url built with the canonical CAS server url prefix
+
+        @return
+        the response of the first node answering.
+
+        '''
+        path = url[len( self.canonicalUrl ):]
+        tried = []
+        error = None
+        while True:
+            endpoint = self._choose( tried )
+            if endpoint is None:
+                raise error or ConnectionException( 'No CAS server node.' )
+
+            tried.append( endpoint )
+            try:
+                response = send( endpoint.url + path )
+            except ConnectionException, e:
+                if not isFailure( e ):
+                    # another node would not do better
+                    self._release( endpoint, failed=None )
+                    raise
+
+                self._release( endpoint, failed=True )
+                LOG.warning( 'CAS server node %s failed, %s' % \
+                             ( endpoint.url, e ) )
+                error = e
+                continue
+
+            self._release( endpoint, failed=False )
+            return response
+
+    def getState( self ):
+        ''' Return a list of dicts describing the state of each node. '''
+        return [ { 'url': e.url,
+                   'healthy': e.healthy,
+                   'available': e.isAvailable(),
+                   'circuit': e.getCircuitState(),
+                   'outstanding': e.outstanding,
+                   'failures': e.failures,
+                   'lastChecked': e.lastChecked }
+                 for e in self.endpoints ]
+
+    def close( self ):
+        ''' Stop probing the nodes. '''
+        self._stopped.set()
+
+    def _choose( self, tried ):
+        self._lock.acquire()
+        try:
+            candidates = [ e for e in self.endpoints if e not in tried ]
+            if not candidates:
+                return None
+
+            # Fall back to the unavailable nodes when all are down, one
+            # of them may be back already.
+            available = [ e for e in candidates if e.isAvailable() ] or \
+                        candidates
+            least = min( [ e.outstanding for e in available ] )
+            endpoint = random.choice(
+                [ e for e in available if e.outstanding == least ] )
+            endpoint.outstanding += 1
+            return endpoint
+        finally:
+            self._lock.release()
+
+    def _release( self, endpoint, failed ):
+        # failed is None when the outcome says nothing about the node
+        self._lock.acquire()
+        try:
+            endpoint.outstanding -= 1
+            if failed:
+                endpoint.failures += 1
+                endpoint.healthy = False
+            elif failed is not None:
+                endpoint.healthy = True
+        finally:
+            self._lock.release()
+
+    def _probeLoop( self ):
+        while not self._stopped.isSet():
+            self._stopped.wait( self.probeInterval )
+            if self._stopped.isSet():
+                return
+
+            for endpoint in self.endpoints:
+                try:
+                    getTransport().request( endpoint.url + self.probePath,
+                                            connectTimeout=self.probeTimeout,
+                                            readTimeout=self.probeTimeout )
+                except ConnectionException, e:
+                    if endpoint.healthy:
+                        LOG.warning( 'CAS server node %s is down, %s' % \
+                                     ( endpoint.url, e ) )
+                    healthy = False
+                except Exception, e:
+                    LOG.warning( e )
+                    healthy = False
+                else:
+                    if not endpoint.healthy:
+                        LOG.info( 'CAS server node %s is back.' % \
+                                  endpoint.url )
+                    healthy = True
+
+                endpoint.healthy = healthy
+                endpoint.lastChecked = time.time()
+
+_groups = {}
+_lock = threading.Lock()
+
+def getEndpointGroup( url ):
+    ''' Retrieve the endpoint group requests to url are spread over or
+    None if url is not served by a group.
+
+    '''
+    for group in _groups.values():
+        if group.matches( url ):
+            return group
+
+    return None
+
+def configureEndpointGroup( canonicalUrl, urls, probeInterval=10 ):
+    ''' Spread requests built with the canonical CAS server url prefix
+    over the nodes at urls, no urls removes the group.
+
+    @return
+    the endpoint group or None.
+
+    '''
+    key = canonicalUrl.rstrip( '/' )
+    urls = [ url.strip().rstrip('/') for url in urls if url.strip() ]
+    _lock.acquire()
+    try:
+        group = _groups.get( key )
+        if group is not None and \
+           [ e.url for e in group.endpoints ] == urls and \
+           bool( group.probeInterval ) == bool( probeInterval ):
+            # keep the health of the nodes and the running prober
+            group.probeInterval = probeInterval
+            return group
+
+        if group is not None:
+            group.close()
+            del _groups[key]
+
+        if not urls:
+            return None
+
+        group = _groups[key] = EndpointGroup( key, urls, probeInterval )
+    finally:
+        _lock.release()
+
+    return group
@@ -15,6 +15,31 @@ class ConnectionException( BaseException ):
     ''' '''
     ERROR_CODE = 'CONNECTION_ERROR'
 
+class DeadlineExceededException( ConnectionException ):
+    ''' Exception to be thrown when a request is given up because the
+    deadline of the current request (see transport.setDeadline) passed.
+
+    '''
+    ERROR_CODE = 'DEADLINE_EXCEEDED'
+
+class HTTPErrorException( ConnectionException ):
+    ''' Exception to be thrown when the CAS server answers with an HTTP
+    error status.
+
+    '''
+    ERROR_CODE = 'HTTP_ERROR'
+
+    def __init__( self, status ):
+        ConnectionException.__init__( self, 'Error code: %s' % status )
+        self.status = status
+
+class CircuitOpenException( ConnectionException ):
+    ''' Exception to be thrown when a request is refused because the CAS
+    server is considered unhealthy.
+
+    '''
+    ERROR_CODE = 'CIRCUIT_OPEN'
+
 class InvalidProxyChainException( BaseException ):
     ''' '''
     ERROR_CODE = 'INVALID_PROXY_CHAIN'
@@ -163,6 +163,15 @@ class IPrincipal( Interface ):
 
         '''
 
+    def getAttributes():
+        ''' Returns the attributes CAS released for the Principal.
+
+        @return
+        a dict with attribute name as key, the value is a string or a
+        list of strings for multi-valued attributes.
+
+        '''
+
     def getProxyTicketFor( service ):
         ''' Retrieves a CAS proxy ticket for this specific principal.
 
@@ -174,6 +183,23 @@ class IPrincipal( Interface ):
 
         '''
 
+    def getProxyTicketsFor( services, maxWorkers=4 ):
+        ''' Retrieves CAS proxy tickets for several services at once, the
+        tickets are retrieved concurrently.
+
+        @param services
+        the services we wish to proxy this user to.
+
+        @param maxWorkers
+        max number of tickets retrieved at the same time.
+
+        @return
+        a ( tickets, errors ) pair of dicts keyed on service, tickets holds
+        the proxy ticket (or None) of each service retrieved without error,
+        errors holds the exception raised for the others.
+
+        '''
+
 class IAssertion( Interface ):
     ''' Represents a response to a validation request.
     '''
@@ -186,6 +212,34 @@ class IAssertion( Interface ):
 
         '''
 
+    def getValidFromDate():
+        ''' The date from which the assertion is valid from.
+
+        @return
+        a naive UTC datetime or None if unknown.
+
+        '''
+
+    def getValidUntilDate():
+        ''' The date which the assertion is valid until.
+
+        @return
+        a naive UTC datetime or None if the assertion does not expire.
+
+        '''
+
+    def getAttributes():
+        ''' The key/value pairs associated with this assertion, such as
+        the authentication method.
+
+        @return
+        a dict, attribute name as key.
+
+        '''
+
+    def isValid():
+        ''' Whether the assertion is valid at this moment. '''
+
 class IProxyRetriever( Interface ):
     ''' Interface to abstract the retrieval of a proxy ticket to make the
     implementation a black box to the client.
@@ -206,6 +260,27 @@ class IProxyRetriever( Interface ):
 
         '''
 
+    def getProxyTicketIdsFor( pgtId, targetServices, maxWorkers=4 ):
+        ''' Retrieves proxy tickets for several targetServices at once, the
+        tickets are retrieved concurrently.
+
+        @param pgtId
+        the Proxy Granting Ticket Id
+
+        @param targetServices
+        the services we want to proxy.
+
+        @param maxWorkers
+        max number of tickets retrieved at the same time.
+
+        @return
+        a ( tickets, errors ) pair of dicts keyed on target service,
+        tickets holds the ProxyTicket Id (or None if not granted) of each
+        service retrieved without error, errors holds the exception raised
+        for the others.
+
+        '''
+
 class ITicketValidator( Interface ):
     ''' Interface of ticket validator.
 
@@ -0,0 +1,258 @@
+
+# python
+import threading
+import time
+
+# Upper bounds (seconds) of the latency histogram buckets.
+DEFAULT_BUCKETS = ( 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5,
+                    5.0, 10.0 )
+
+PREFIX = 'anz_casclient_'
+
+class Histogram( object ):
+    ''' Latency histogram of one operation, with its call, failure and
+    in-flight counts.
+
+    '''
+
+    def __init__( self, buckets=DEFAULT_BUCKETS ):
+        self.buckets = buckets
+        self.counts = [ 0 ] * ( len(buckets) + 1 )
+        self.sum = 0.0
+        self.count = 0
+        self.failures = 0
+        self.inFlight = 0
+
+    def observe( self, seconds ):
+        index = 0
+        for bound in self.buckets:
+            if seconds <= bound:
+                break
+
+            index += 1
+
+        self.counts[index] += 1
+        self.sum += seconds
+        self.count += 1
+
+    def quantile( self, q ):
+        ''' Estimate the q quantile (0 to 1) of the latencies, interpolating
+        linearly within the bucket it falls in.
+
+        '''
+        if not self.count:
+            return 0.0
+
+        rank = q * self.count
+        cumulative = 0
+        lower = 0.0
+        for bound, count in zip( self.buckets, self.counts ):
+            if count and cumulative + count >= rank:
+                return lower + ( bound - lower ) * \
+                       ( rank - cumulative ) / count
+
+            cumulative += count
+            lower = bound
+
+        # in the +Inf bucket, the largest bound is the best we know
+        return lower
+
+class Metrics( object ):
+    ''' Registry of the latency histograms of the hot paths.
+
+    Operations are timed with begin() and end(), or call(). While disabled
+    nothing is recorded and begin() returns None right away. Metrics are
+    enabled while at least one owner (see setEnabled) asks for them.
+
+    '''
+
+    def __init__( self, buckets=DEFAULT_BUCKETS ):
+        self.enabled = False
+        self.buckets = buckets
+
+        self._owners = set()
+        self._histograms = {}
+        self._since = time.time()
+        self._lock = threading.Lock()
+
+    def setEnabled( self, owner, enabled ):
+        ''' Record whether owner wants metrics to be collected.
+
+        @param owner
+        a hashable identifying who asks, e.g. the key of a plugin
+
+        @param enabled
+        whether owner wants metrics to be collected
+
+        '''
+        self._lock.acquire()
+        try:
+            if enabled:
+                self._owners.add( owner )
+            else:
+                self._owners.discard( owner )
+
+            self.enabled = bool( self._owners )
+        finally:
+            self._lock.release()
+
+    def begin( self, name ):
+        ''' Mark the start of an operation.
+
+        @return
+        a token to give back to end(), None if disabled.
+
+        '''
+        if not self.enabled:
+            return None
+
+        self._lock.acquire()
+        try:
+            self._get( name ).inFlight += 1
+        finally:
+            self._lock.release()
+
+        return time.time()
+
+    def end( self, name, started, failed=False ):
+        ''' Record the end of an operation started with begin(). '''
+        if started is None:
+            return
+
+        seconds = time.time() - started
+        self._lock.acquire()
+        try:
+            histogram = self._get( name )
+            histogram.inFlight -= 1
+            histogram.observe( seconds )
+            if failed:
+                histogram.failures += 1
+        finally:
+            self._lock.release()
+
+    def call( self, name, func, *args, **kw ):
+        ''' Call func with args and time it as operation name, an exception
+        counts as a failure.
+
+        '''
+        if not self.enabled:
+            return func( *args, **kw )
+
+        started = self.begin( name )
+        try:
+            result = func( *args, **kw )
+        except:
+            self.end( name, started, failed=True )
+            raise
+
+        self.end( name, started )
+        return result
+
+    def getSnapshot( self ):
+        ''' Return a dict with a dict of count, sum, failures, inFlight,
+        rate (calls per second since the last reset), estimated p50, p90 and
+        p99 latencies and buckets (list of ( upper bound, cumulative
+        count )) per operation.
+
+        '''
+        self._lock.acquire()
+        try:
+            elapsed = max( time.time() - self._since, 1e-6 )
+            snapshot = {}
+            for name, histogram in self._histograms.items():
+                cumulative = 0
+                buckets = []
+                for bound, count in zip( list(self.buckets) + ['+Inf'],
+                                         histogram.counts ):
+                    cumulative += count
+                    buckets.append( (bound, cumulative) )
+
+                snapshot[name] = { 'count': histogram.count,
+                                   'sum': histogram.sum,
+                                   'failures': histogram.failures,
+                                   'inFlight': histogram.inFlight,
+                                   'rate': histogram.count / elapsed,
+                                   'p50': histogram.quantile( 0.5 ),
+                                   'p90': histogram.quantile( 0.9 ),
+                                   'p99': histogram.quantile( 0.99 ),
+                                   'buckets': buckets }
+        finally:
+            self._lock.release()
+
+        return snapshot
+
+    def render( self ):
+        ''' Render the metrics in the Prometheus text exposition format. '''
+        lines = []
+        snapshot = self.getSnapshot()
+        for name in sorted( snapshot ):
+            data = snapshot[name]
+            metric = PREFIX + name
+            lines.append( '# TYPE %s_seconds histogram' % metric )
+            for bound, count in data['buckets']:
+                lines.append( '%s_seconds_bucket{le="%s"} %d' % \
+                              ( metric, bound, count ) )
+            lines.append( '%s_seconds_sum %f' % ( metric, data['sum'] ) )
+            lines.append( '%s_seconds_count %d' % ( metric, data['count'] ) )
+            lines.append( '# TYPE %s_failures_total counter' % metric )
+            lines.append( '%s_failures_total %d' % \
+                          ( metric, data['failures'] ) )
+            lines.append( '# TYPE %s_in_flight gauge' % metric )
+            lines.append( '%s_in_flight %d' % ( metric, data['inFlight'] ) )
+
+        return '\n'.join( lines ) + '\n'
+
+    def reset( self ):
+        ''' Forget everything recorded so far. '''
+        self._lock.acquire()
+        try:
+            self._histograms = {}
+            self._since = time.time()
+        finally:
+            self._lock.release()
+
+    def _get( self, name ):
+        histogram = self._histograms.get( name )
+        if histogram is None:
+            histogram = self._histograms[name] = Histogram( self.buckets )
+
+        return histogram
+
+def renderSamples( samples ):
+    ''' Render samples in the Prometheus text exposition format.
+
+    @param samples
+    ( name, type, labels, value ) tuples, name without PREFIX, labels a
+    dict or None. The samples of a metric follow each other.
+
+    '''
+    lines = []
+    last = None
+    for name, kind, labels, value in samples:
+        metric = PREFIX + name
+        if metric != last:
+            lines.append( '# TYPE %s %s' % (metric, kind) )
+            last = metric
+
+        if labels:
+            metric += '{%s}' % ','.join(
+                [ '%s="%s"' % (key, _escape(labels[key]))
+                  for key in sorted(labels) ] )
+
+        if isinstance( value, float ):
+            lines.append( '%s %f' % (metric, value) )
+        else:
+            lines.append( '%s %d' % (metric, value) )
+
+    return ''.join( [line + '\n' for line in lines] )
+
+def _escape( value ):
+    # label values quote backslashes, double quotes and line feeds
+    return str( value ).replace( '\\', '\\\\' ).replace(
+        '"', '\\"' ).replace( '\n', '\\n' )
+
+_metrics = Metrics()
+
+def getMetrics():
+    ''' Retrieve the metrics registry shared by the whole process. '''
+    return _metrics
@@ -0,0 +1,18 @@
+
+# zope
+from Products.Five import BrowserView
+
+from anz.casclient.metrics import getMetrics, renderSamples
+
+class MetricsView( BrowserView ):
+    ''' Render the metrics of the CAS client in the Prometheus text
+    exposition format, followed by the state of the back-channel helpers
+    of the plugin.
+
+    '''
+
+    def __call__( self ):
+        self.request.response.setHeader( 'Content-Type',
+                                         'text/plain; version=0.0.4' )
+        return getMetrics().render() + \
+               renderSamples( self.context.getStateSamples() )
@@ -3,13 +3,22 @@
 from zope.interface import implements
 
 from anz.casclient.interfaces import IPrincipal
+from anz.casclient.proxyticketpool import getProxyTicketPool
+from anz.casclient.proxyretriever import Cas20ProxyRetriever, \
+     collectProxyTickets
+from anz.casclient.utils import mapConcurrently
+from anz.casclient.metrics import getMetrics
 
 class Principal( object ):
     ''' See interfaces.IPrincipal. '''
     
     implements( IPrincipal )
     
-    def __init__( self, id, pgt=None, proxyRetriever=None ):
+    # Principals are kept in the session of each user, no __dict__ keeps
+    # them small in memory.
+    __slots__ = ( 'id', 'pgt', 'proxyRetriever', 'attributes' )
+    
+    def __init__( self, id, pgt=None, proxyRetriever=None, attributes=None ):
         ''' Construct an principal object.
         
         @param id
@@ -21,19 +30,76 @@ class Principal( object ):
         @param proxyRetriever
         used to retrieve a proxy ticket from a CAS server
         
+        @param attributes
+        user attributes released by CAS, attribute name as key
+        
         '''
         self.id = id
         self.pgt = pgt
         self.proxyRetriever = proxyRetriever
+        self.attributes = attributes or {}
+    
+    def __reduce__( self ):
+        ''' Pickle only the id, pgt, attributes and the arguments of the
+        proxy retriever, instead of the whole object graph.
+        
+        '''
+        retriever = self.proxyRetriever
+        if type( retriever ) is Cas20ProxyRetriever:
+            retriever = ( retriever.casServerUrl, retriever.connectTimeout,
+                          retriever.readTimeout, retriever.poolKey )
+        
+        attributes = self.attributes and \
+                     tuple( self.attributes.items() ) or None
+        return ( _restorePrincipal,
+                 (self.id, self.pgt, retriever, attributes) )
+    
+    def __setstate__( self, state ):
+        # principals pickled before __slots__ were used
+        self.id = state.get( 'id' )
+        self.pgt = state.get( 'pgt' )
+        self.proxyRetriever = state.get( 'proxyRetriever' )
+        self.attributes = state.get( 'attributes' ) or {}
     
     def getId( self ):
         ''' See interfaces.IPrincipal. '''
         return self.id
     
+    def getAttributes( self ):
+        ''' See interfaces.IPrincipal. '''
+        return self.attributes
+    
     def getProxyTicketFor( self, service ):
         ''' See interfaces.IPrincipal. '''
+        return getMetrics().call( 'get_proxy_ticket',
+                                  self._getProxyTicketFor, service )
+    
+    def _getProxyTicketFor( self, service ):
         ret = None
         if self.pgt:
-            ret = self.proxyRetriever.getProxyTicketIdFor( self.pgt, service )
+            pool = getProxyTicketPool(
+                getattr(self.proxyRetriever, 'poolKey', None) )
+            if pool is not None:
+                ret = pool.getProxyTicketFor( self.proxyRetriever,
+                                              self.pgt, service )
+            else:
+                ret = self.proxyRetriever.getProxyTicketIdFor( self.pgt,
+                                                               service )
         
         return ret
+    
+    def getProxyTicketsFor( self, services, maxWorkers=4 ):
+        ''' See interfaces.IPrincipal. '''
+        services = list( services )
+        if not self.pgt:
+            return dict( [(s, None) for s in services] ), {}
+        
+        return collectProxyTickets( services, mapConcurrently(
+            self.getProxyTicketFor, services, maxWorkers ) )
+
+def _restorePrincipal( id, pgt, retriever, attributes ):
+    ''' Unpickle a principal pickled by Principal.__reduce__. '''
+    if type( retriever ) is tuple:
+        retriever = Cas20ProxyRetriever( *retriever )
+    
+    return Principal( id, pgt, retriever, dict(attributes or ()) )
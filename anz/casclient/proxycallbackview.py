@@ -0,0 +1,20 @@
+
+# zope
+from Products.Five import BrowserView
+
+from anz.casclient.metrics import getMetrics
+
+class ProxyCallbackView( BrowserView ):
+    ''' Proxy callback of the CAS server, lighter than
+    AnzCASClient.proxyCallback: the pgt is kept out of the ZODB, so
+    answering the CAS server costs no commit. See slimProxyCallback.
+
+    '''
+
+    def __call__( self ):
+        form = self.request.form
+        self.request.response.setHeader( 'Content-Type', 'text/xml' )
+        return getMetrics().call( 'proxy_callback',
+                                  self.context._proxyCallback,
+                                  form.get( 'pgtId' ), form.get( 'pgtIou' ),
+                                  False )
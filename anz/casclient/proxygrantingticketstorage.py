@@ -1,6 +1,10 @@
 
 # python
 import datetime
+import os
+import threading
+import time
+from hashlib import sha1
 
 # zope
 from Persistence import Persistent
@@ -9,6 +13,8 @@ from zope.bforest.periodic import OOBForest
 import transaction
 
 from anz.casclient.interfaces import IProxyGrantingTicketStorage
+from anz.casclient.storage import VolatileMapping, FileMapping, \
+     getSharedStorage, getPluginKey, getStorageDirectory
 
 class ProxyGrantingTicketStorage( Persistent ):
     ''' See interfaces.IProxyGrantingTicketStorage. '''
@@ -34,4 +40,199 @@ class ProxyGrantingTicketStorage( Persistent ):
     
     def retrieve( self, pgtIou ):
         ''' See interfaces.IProxyGrantingTicketStorage. '''
-        return pgtIou in self._mapping.keys() and self._mapping[pgtIou] or None
+        # Look the key up in each tree of the forest directly, building
+        # the key set of the whole forest would be linear in its size.
+        return self._mapping.get( pgtIou ) or None
+
+class VolatileProxyGrantingTicketStorage( object ):
+    ''' See interfaces.IProxyGrantingTicketStorage.
+    Keeps proxy granting tickets in the memory of the current process.
+    
+    '''
+    
+    implements( IProxyGrantingTicketStorage )
+    
+    TIME_OUT = ProxyGrantingTicketStorage.TIME_OUT
+    
+    def __init__( self ):
+        ''' Creates a proxy granting ticket storage. '''
+        self._mapping = VolatileMapping( self.TIME_OUT )
+    
+    def add( self, pgtIou, pgt ):
+        ''' See interfaces.IProxyGrantingTicketStorage. '''
+        self._mapping.set( pgtIou, pgt )
+    
+    def retrieve( self, pgtIou ):
+        ''' See interfaces.IProxyGrantingTicketStorage. '''
+        return self._mapping.get( pgtIou )
+
+class FileProxyGrantingTicketStorage( VolatileProxyGrantingTicketStorage ):
+    ''' See interfaces.IProxyGrantingTicketStorage.
+    Keeps proxy granting tickets in files, shared by all the Zope clients
+    of the host.
+    
+    '''
+    
+    def __init__( self, directory ):
+        ''' Creates a proxy granting ticket storage.
+        
+        @param directory
+        the directory to keep the tickets in
+        
+        '''
+        self._mapping = FileMapping( directory, self.TIME_OUT )
+
+class PgtRendezvous( object ):
+    ''' Hands proxy granting tickets over from the proxy callback to the
+    ticket validation waiting for them in the same process.
+
+    The CAS server calls the proxy callback before it answers the
+    validation request, but the callback may still be running in another
+    thread when the answer is parsed. wait() blocks on an event per pgtIou
+    until publish() is called, instead of failing right away.
+
+    '''
+
+    TIME_OUT = ProxyGrantingTicketStorage.TIME_OUT
+
+    def __init__( self, timeout=TIME_OUT ):
+        ''' Construct a rendezvous.
+
+        @param timeout
+        seconds a published ticket is kept for
+
+        '''
+        self.timeout = timeout
+
+        # [ event, pgt, expiry time ] per pgtIou
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._nextPurge = time.time() + timeout
+
+    def publish( self, pgtIou, pgt ):
+        ''' Publish the proxy granting ticket of pgtIou and wake up the
+        validations waiting for it.
+
+        '''
+        entry = self._getEntry( pgtIou )
+        entry[1] = pgt
+        entry[2] = time.time() + self.timeout
+        entry[0].set()
+
+    def get( self, pgtIou ):
+        ''' Return the published proxy granting ticket of pgtIou right
+        away, None if not published yet.
+
+        '''
+        entry = self._entries.get( pgtIou )
+        if entry is None or not entry[0].isSet() or entry[2] < time.time():
+            return None
+
+        self._entries.pop( pgtIou, None )
+        return entry[1]
+
+    def wait( self, pgtIou, timeout, lookup=None, pollInterval=0.05 ):
+        ''' Wait for the proxy granting ticket of pgtIou.
+
+        @param timeout
+        max seconds to wait
+
+        @param lookup
+        a callable taking the pgtIou and returning its proxy granting
+        ticket or None, called every pollInterval seconds to find tickets
+        received by other processes
+
+        @return
+        the proxy granting ticket or None if it did not come in time.
+
+        '''
+        entry = self._getEntry( pgtIou )
+        deadline = time.time() + timeout
+        while True:
+            if entry[0].isSet():
+                self._entries.pop( pgtIou, None )
+                return entry[1]
+
+            if lookup is not None:
+                pgt = lookup( pgtIou )
+                if pgt:
+                    return pgt
+
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return None
+
+            if lookup is not None:
+                remaining = min( remaining, pollInterval )
+
+            entry[0].wait( remaining )
+
+    def _getEntry( self, pgtIou ):
+        now = time.time()
+        self._lock.acquire()
+        try:
+            entry = self._entries.get( pgtIou )
+            if entry is None:
+                entry = self._entries[pgtIou] = [ threading.Event(), None,
+                                                  now + self.timeout ]
+
+            if now > self._nextPurge:
+                self._purge( now )
+        finally:
+            self._lock.release()
+
+        return entry
+
+    def _purge( self, now ):
+        # drop tickets never picked up, e.g. when the validation ran in
+        # another process
+        for pgtIou, entry in self._entries.items():
+            if entry[2] < now:
+                del self._entries[pgtIou]
+
+        self._nextPurge = now + self.timeout
+
+_rendezvous = PgtRendezvous()
+
+def getPgtRendezvous():
+    ''' Retrieve the proxy granting ticket rendezvous shared by the whole
+    process.
+
+    '''
+    return _rendezvous
+
+def zodbProxyGrantingTicketStorage( plugin ):
+    ''' Adapt a plugin to the proxy granting ticket storage persisted on
+    it in the ZODB.
+    
+    '''
+    return plugin._pgtStorage
+
+def volatileProxyGrantingTicketStorage( plugin ):
+    ''' Adapt a plugin to its in-process proxy granting ticket storage. '''
+    return getSharedStorage( ('pgt', 'volatile', getPluginKey(plugin)),
+                             VolatileProxyGrantingTicketStorage )
+
+def fileProxyGrantingTicketStorage( plugin ):
+    ''' Adapt a plugin to its file based proxy granting ticket storage. '''
+    directory = os.path.join( getStorageDirectory(plugin), 'pgt' )
+    return getSharedStorage( ('pgt', 'file', directory),
+                             FileProxyGrantingTicketStorage, directory )
+
+def getPgtHandover( plugin ):
+    ''' Retrieve the mapping the slim proxy callback hands proxy granting
+    tickets over through, pgtIou as key, when they are not written to the
+    ZODB. It is kept in files under pgtHandoverDirectory when set, so all
+    the Zope clients of a cluster read it, under storageDirectory
+    otherwise.
+
+    '''
+    base = getattr( plugin, 'pgtHandoverDirectory', '' )
+    if base:
+        directory = os.path.join( base,
+                                  sha1(getPluginKey( plugin )).hexdigest() )
+    else:
+        directory = os.path.join( getStorageDirectory(plugin), 'handover' )
+
+    return getSharedStorage( ('pgt', 'handover', directory), FileMapping,
+                             directory, ProxyGrantingTicketStorage.TIME_OUT )
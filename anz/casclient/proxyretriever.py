@@ -1,13 +1,13 @@
 
 # python
 from urllib import quote
-from xml.dom import minidom as minidom
 
 # zope
 from zope.interface import implements
 
 from anz.casclient.interfaces import IProxyRetriever
-from anz.casclient.utils import retrieveResponseFromServer
+from anz.casclient.utils import retrieveResponseFromServer, mapConcurrently
+from anz.casclient.responseparser import parseCas20Response
 
 class Cas20ProxyRetriever( object ):
     ''' Implementation of a ProxyRetriever that follows the CAS 2.0.
@@ -20,30 +20,56 @@ class Cas20ProxyRetriever( object ):
     
     CAS_NS = 'http://www.yale.edu/tp/cas'
     
-    def __init__( self, casServerUrl ):
+    # Default for retrievers pickled before timeouts were configurable.
+    connectTimeout = None
+    readTimeout = None
+    
+    # Default for retrievers pickled before proxy ticket pools were kept
+    # per plugin.
+    poolKey = None
+    
+    def __init__( self, casServerUrl, connectTimeout=None,
+                  readTimeout=None, poolKey=None ):
         ''' Construct a proxy retriever object.
         
         @param casServerUrl
         the URL to the CAS server
         
+        @param connectTimeout
+        seconds to wait for the connection to the CAS server
+        
+        @param readTimeout
+        seconds to wait for each read of the CAS server response
+        
+        @param poolKey
+        key of the proxy ticket pool (see proxyticketpool) tickets are
+        handed out from, None if not pooled
+        
         '''
         self.casServerUrl = casServerUrl
+        self.connectTimeout = connectTimeout
+        self.readTimeout = readTimeout
+        self.poolKey = poolKey
     
     def getProxyTicketIdFor( self, pgtId, targetService ):
         ''' See interfaces.IProxyRetriever. '''
-        ret = None
-        
         url = self._constructUrl( pgtId, targetService )
-        response = retrieveResponseFromServer( url )
-        dom = minidom.parseString( response )
-        elements = dom.getElementsByTagNameNS( self.CAS_NS,
-                                               'proxyFailure' )
-        if not elements:
-            elements = dom.getElementsByTagNameNS( self.CAS_NS,
-                                                   'proxyTicket' )
-            ret = elements[0].firstChild.data
+        response = retrieveResponseFromServer(
+            url, connectTimeout=self.connectTimeout,
+            readTimeout=self.readTimeout )
+        
+        result = parseCas20Response( response )
+        if result.proxyFailureCode or result.proxyFailureMessage:
+            return None
         
-        return ret
+        return result.proxyTicket
+    
+    def getProxyTicketIdsFor( self, pgtId, targetServices, maxWorkers=4 ):
+        ''' See interfaces.IProxyRetriever. '''
+        targetServices = list( targetServices )
+        return collectProxyTickets( targetServices, mapConcurrently(
+            lambda s: self.getProxyTicketIdFor( pgtId, s ),
+            targetServices, maxWorkers ) )
     
     def _constructUrl( self, pgtId, targetService ):
         url = []
@@ -56,3 +82,18 @@ class Cas20ProxyRetriever( object ):
         url.append( 'targetService=%s' % quote(targetService) )
         
         return ''.join( url )
+
+def collectProxyTickets( targetServices, results ):
+    ''' Split the results of mapConcurrently into a ticket and an error
+    mapping, both keyed on target service.
+    
+    '''
+    tickets = {}
+    errors = {}
+    for targetService, ( ticket, error ) in zip( targetServices, results ):
+        if error is not None:
+            errors[targetService] = error
+        else:
+            tickets[targetService] = ticket
+    
+    return tickets, errors
@@ -0,0 +1,189 @@
+
+# python
+import threading
+import time
+from Queue import Queue
+from logging import getLogger
+
+LOG = getLogger( 'anz.casclient' )
+
+class ProxyTicketPool( object ):
+    ''' Prefetches proxy tickets per (proxy granting ticket, target service)
+    in a background thread, so asking for a proxy ticket does not wait for
+    the CAS server.
+
+    Proxy tickets are single use, each prefetched ticket is handed out only
+    once. They are also short lived on CAS, so tickets older than maxAge
+    seconds are dropped instead of handed out.
+
+    '''
+
+    def __init__( self, size=2, maxAge=5 ):
+        ''' Construct a proxy ticket pool.
+
+        @param size
+        number of tickets kept ready per (pgt, target service)
+
+        @param maxAge
+        seconds a prefetched ticket may be handed out for
+
+        '''
+        self.size = size
+        self.maxAge = maxAge
+
+        # ( pgt, targetService ) as key, list of ( ticket, time ) as value
+        self._tickets = {}
+
+        # keys waiting for a refill, mapped to the retriever to use
+        self._pending = {}
+
+        self._lock = threading.Lock()
+        self._queue = Queue()
+        self._worker = None
+
+    def getProxyTicketFor( self, proxyRetriever, pgt, targetService ):
+        ''' Hand out a prefetched proxy ticket, retrieve one from CAS if
+        none is ready. The pool of the service is refilled afterwards in
+        the background.
+
+        @param proxyRetriever
+        the IProxyRetriever to retrieve tickets with
+
+        @param pgt
+        the proxy granting ticket id
+
+        @param targetService
+        the service we want to proxy
+
+        @return
+        the proxy ticket id or None.
+
+        '''
+        key = ( pgt, targetService )
+        ticket = self._take( key )
+        if ticket is None:
+            ticket = proxyRetriever.getProxyTicketIdFor( pgt, targetService )
+
+        self._scheduleRefill( key, proxyRetriever )
+        return ticket
+
+    def close( self ):
+        ''' Stop the background thread. '''
+        self._queue.put( None )
+
+    def _take( self, key ):
+        expired = time.time() - self.maxAge
+        self._lock.acquire()
+        try:
+            tickets = self._tickets.get( key, [] )
+            while tickets:
+                ticket, retrieved = tickets.pop( 0 )
+                if retrieved > expired:
+                    return ticket
+
+            self._tickets.pop( key, None )
+            return None
+        finally:
+            self._lock.release()
+
+    def _scheduleRefill( self, key, proxyRetriever ):
+        self._lock.acquire()
+        try:
+            if key in self._pending:
+                return
+
+            self._pending[key] = proxyRetriever
+            if self._worker is None or not self._worker.isAlive():
+                self._worker = threading.Thread(
+                    target=self._run, name='anz.casclient proxy tickets' )
+                self._worker.setDaemon( True )
+                self._worker.start()
+        finally:
+            self._lock.release()
+
+        self._queue.put( key )
+
+    def _run( self ):
+        while True:
+            key = self._queue.get()
+            if key is None:
+                return
+
+            self._lock.acquire()
+            try:
+                proxyRetriever = self._pending.pop( key, None )
+                self._purge()
+            finally:
+                self._lock.release()
+
+            if proxyRetriever is not None:
+                self._refill( key, proxyRetriever )
+
+    def _refill( self, key, proxyRetriever ):
+        pgt, targetService = key
+        while True:
+            self._lock.acquire()
+            try:
+                missing = self.size - len( self._tickets.get(key, []) )
+            finally:
+                self._lock.release()
+
+            if missing <= 0:
+                return
+
+            try:
+                ticket = proxyRetriever.getProxyTicketIdFor( pgt,
+                                                             targetService )
+            except Exception, e:
+                LOG.warning( 'Fail to prefetch proxy ticket for %s: %s' % \
+                             ( targetService, e ) )
+                return
+
+            if not ticket:
+                # the pgt has expired or was refused
+                return
+
+            self._lock.acquire()
+            try:
+                self._tickets.setdefault( key, [] ).append(
+                    (ticket, time.time()) )
+            finally:
+                self._lock.release()
+
+    def _purge( self ):
+        # Drop expired tickets, so pools of principals that stopped
+        # proxying don't stay around.
+        expired = time.time() - self.maxAge
+        for key, tickets in self._tickets.items():
+            tickets = [ t for t in tickets if t[1] > expired ]
+            if tickets:
+                self._tickets[key] = tickets
+            else:
+                del self._tickets[key]
+
+_pools = {}
+
+def getProxyTicketPool( key ):
+    ''' Retrieve the proxy ticket pool registered under key (the key of the
+    plugin, see storage.getPluginKey) or None if proxy tickets are not
+    pooled for it.
+
+    '''
+    return _pools.get( key )
+
+def configureProxyTicketPool( key, size, maxAge ):
+    ''' Pool the proxy tickets of the principals of the plugin of key, size
+    of 0 disables pooling.
+
+    '''
+    pool = _pools.get( key )
+    if pool is not None and pool.size == size and pool.maxAge == maxAge:
+        return
+
+    if size:
+        _pools[key] = ProxyTicketPool( size, maxAge )
+    else:
+        _pools.pop( key, None )
+
+    if pool is not None:
+        pool.close()
@@ -0,0 +1,159 @@
+
+# python
+import json
+from cStringIO import StringIO
+from xml.etree.cElementTree import iterparse
+
+class Cas20Response( object ):
+    ''' Everything a CAS 2.0 validation or proxy response carries. '''
+
+    def __init__( self ):
+        # id of the authenticated user
+        self.user = None
+
+        # user attributes, attribute name as key, list of values as value
+        self.attributes = {}
+
+        # proxy granting ticket IOU
+        self.pgtIou = None
+
+        # proxy callback urls of the proxy chain, most recent proxier first
+        self.proxies = []
+
+        # code and message of <cas:authenticationFailure>
+        self.failureCode = None
+        self.failureMessage = None
+
+        # proxy ticket granted by /proxy
+        self.proxyTicket = None
+
+        # code and message of <cas:proxyFailure>
+        self.proxyFailureCode = None
+        self.proxyFailureMessage = None
+
+    def addAttribute( self, name, value ):
+        self.attributes.setdefault( name, [] ).append( value )
+
+    def getAttributes( self ):
+        ''' Return the attributes, single values unwrapped from their list.
+        '''
+        ret = {}
+        for name, values in self.attributes.items():
+            if len( values ) == 1:
+                ret[name] = values[0]
+            else:
+                ret[name] = list( values )
+
+        return ret
+
+def _localName( tag ):
+    if tag[0] == '{':
+        return tag[tag.index( '}' )+1:]
+
+    return tag
+
+def parseCas20Response( response ):
+    ''' Parse a CAS 2.0 response in a single pass.
+
+    Elements are handled as soon as they are closed and dropped afterwards,
+    so no document tree is built.
+
+    @param response
+    the response from the CAS server.
+
+    @return
+    a Cas20Response object.
+
+    '''
+    result = Cas20Response()
+
+    # local names of the currently open elements
+    stack = []
+    for event, elem in iterparse( StringIO(response), ('start', 'end') ):
+        name = _localName( elem.tag )
+        if event == 'start':
+            stack.append( name )
+            continue
+
+        stack.pop()
+        parent = stack and stack[-1] or None
+        text = ( elem.text or '' ).strip()
+
+        if parent == 'attributes':
+            if name == 'attribute' and elem.get( 'name' ):
+                # <cas:attribute name="..." value="..."/> style
+                result.addAttribute( elem.get('name'), elem.get('value') )
+            else:
+                result.addAttribute( name, text )
+        elif name == 'user':
+            result.user = text
+        elif name == 'proxyGrantingTicket':
+            result.pgtIou = text
+        elif name == 'proxy':
+            result.proxies.append( text )
+        elif name == 'authenticationFailure':
+            result.failureCode = elem.get( 'code' )
+            result.failureMessage = text
+        elif name == 'proxyTicket':
+            result.proxyTicket = text
+        elif name == 'proxyFailure':
+            result.proxyFailureCode = elem.get( 'code' )
+            result.proxyFailureMessage = text
+
+        elem.clear()
+
+    return result
+
+def parseCas30JsonResponse( response ):
+    ''' Parse a CAS 3.0 response in the JSON format (format=JSON).
+
+    @param response
+    the response from the CAS server.
+
+    @return
+    a Cas20Response object.
+
+    '''
+    result = Cas20Response()
+    serviceResponse = json.loads( response )['serviceResponse']
+
+    failure = serviceResponse.get( 'authenticationFailure' )
+    if failure is not None:
+        result.failureCode = failure.get( 'code' )
+        result.failureMessage = ( failure.get('description') or '' ).strip()
+        return result
+
+    success = serviceResponse.get( 'authenticationSuccess' ) or {}
+    result.user = success.get( 'user' )
+    result.pgtIou = success.get( 'proxyGrantingTicket' )
+    result.proxies = list( success.get('proxies') or [] )
+    for name, values in ( success.get('attributes') or {} ).items():
+        if not isinstance( values, list ):
+            values = [ values ]
+
+        for value in values:
+            result.addAttribute( name, value )
+
+    return result
+
+SAMLP_NS = 'urn:oasis:names:tc:SAML:2.0:protocol'
+
+def parseLogoutRequest( request ):
+    ''' Return the session index (the service ticket the session was
+    opened with) of a CAS single sign out request, None if not found.
+
+    Parsing stops at the SessionIndex element.
+
+    @param request
+    the logoutRequest sent by the CAS server.
+
+    '''
+    tag = '{%s}SessionIndex' % SAMLP_NS
+    try:
+        for event, elem in iterparse( StringIO(request), ('end',) ):
+            if elem.tag == tag:
+                return ( elem.text or '' ).strip() or None
+    except SyntaxError:
+        return None
+
+    return None
@@ -1,13 +1,20 @@
 
 # python
+import os
+import time
 from datetime import timedelta
+from itertools import islice
+from zlib import crc32
 
 # zope
 from Persistence import Persistent
 from zope.interface import implements
 from zope.bforest.periodic import OOBForest
+from BTrees.OOBTree import OOBTree
 
 from anz.casclient.interfaces import ISessionMappingStorage
+from anz.casclient.storage import VolatileMapping, FileMapping, \
+     getSharedStorage, getPluginKey, getStorageDirectory
 
 class SessionMappingStorage( Persistent ):
     ''' See interfaces.ISessionMappingStorage. '''
@@ -24,28 +31,223 @@ class SessionMappingStorage( Persistent ):
         self._session_id_to_mapping_id = OOBForest(
             timedelta(hours=1), count=3 )
     
+    # All lookups below use keyed access on the forests, which only looks
+    # the key up in each of their trees. Never test membership against
+    # keys(), it builds the key set of the whole forest.
+    
     def getSessionId( self, mappingId ):
         ''' See interfaces.ISessionMappingStorage. '''
-        return mappingId in self._mapping_id_to_session_id.keys() and \
-               self._mapping_id_to_session_id[mappingId] or None
+        return self._mapping_id_to_session_id.get( mappingId ) or None
     
     def removeByMappingId( self, mappingId ):
         ''' See interfaces.ISessionMappingStorage. '''
-        if mappingId in self._mapping_id_to_session_id.keys():
-            sessionId = self._mapping_id_to_session_id[mappingId]
-            
-            del self._session_id_to_mapping_id[sessionId]
+        sessionId = self._mapping_id_to_session_id.get( mappingId )
+        if sessionId is not None:
             del self._mapping_id_to_session_id[mappingId]
+            self._discard( self._session_id_to_mapping_id, sessionId )
     
     def removeBySessionId( self, sessionId ):
         ''' See interfaces.ISessionMappingStorage. '''
-        if sessionId in self._session_id_to_mapping_id.keys():
-            mappingId = self._session_id_to_mapping_id[sessionId]
-            
+        mappingId = self._session_id_to_mapping_id.get( sessionId )
+        if mappingId is not None:
             del self._session_id_to_mapping_id[sessionId]
-            del self._mapping_id_to_session_id[mappingId]
+            self._discard( self._mapping_id_to_session_id, mappingId )
     
     def addSession( self, mappingId, sessionId ):
         ''' See interfaces.ISessionMappingStorage. '''
         self._mapping_id_to_session_id[mappingId] = sessionId
         self._session_id_to_mapping_id[sessionId] = mappingId
+    
+    def _discard( self, forest, key ):
+        # The reverse entry may have been rotated out of the forest
+        # already.
+        if forest.get( key ) is not None:
+            del forest[key]
+
+class SessionMappingPartition( Persistent ):
+    ''' One partition of a PartitionedSessionMappingStorage.
+    
+    Entries are kept in OOBTrees as (value, time added) pairs. A login only
+    writes the small buckets its keys fall in, and the BTrees merge
+    concurrent changes made by different Zope clients to the same bucket
+    instead of raising a ConflictError. The partition itself is never
+    changed after it was created.
+    
+    Expired entries are dropped a few at a time, next to the key a login
+    writes: they mostly sit in the bucket written anyway, and logins
+    handled by other Zope clients purge next to their own keys. Lookups
+    ignore entries expired but not purged yet.
+    
+    '''
+    
+    # Entries following the written key checked for expiry on each write.
+    PURGE_BATCH = 8
+    
+    def __init__( self ):
+        # mapping id as key, ( session id, time ) as value
+        self._mapping_id_to_session_id = OOBTree()
+        
+        # session id as key, ( mapping id, time ) as value
+        self._session_id_to_mapping_id = OOBTree()
+    
+    def get( self, name, key, timeout ):
+        entry = getattr( self, name ).get( key )
+        if entry is None or entry[1] < time.time() - timeout:
+            return None
+        
+        return entry[0] or None
+    
+    def set( self, name, key, value, timeout ):
+        now = time.time()
+        mapping = getattr( self, name )
+        mapping[key] = ( value, now )
+        self._purge( mapping, key, now - timeout )
+    
+    def remove( self, name, key ):
+        entry = getattr( self, name ).pop( key, None )
+        return entry is not None and entry[0] or None
+    
+    def _purge( self, mapping, key, expired ):
+        keys = [ k for k, entry in islice(mapping.items(key,
+                                                        excludemin=True),
+                                          self.PURGE_BATCH)
+                 if entry[1] < expired ]
+        for k in keys:
+            del mapping[k]
+
+class PartitionedSessionMappingStorage( Persistent ):
+    ''' See interfaces.ISessionMappingStorage.
+    
+    Mappings are spread over a fixed number of SessionMappingPartition
+    objects by a hash of their key, so concurrent logins handled by
+    different Zope clients mostly write different objects, and the few
+    that write the same partition get their changes merged.
+    
+    '''
+    
+    implements( ISessionMappingStorage )
+    
+    # Mappings are kept for 3 hours, as long as the forests of
+    # SessionMappingStorage keep them.
+    TIME_OUT = 3 * 60 * 60
+    
+    def __init__( self, partitions=128 ):
+        ''' Creates a session mapping storage.
+        
+        @param partitions
+        number of partitions to spread the mappings over
+        
+        '''
+        self._partitions = tuple( [ SessionMappingPartition() for i in
+                                    range(partitions) ] )
+    
+    def getSessionId( self, mappingId ):
+        ''' See interfaces.ISessionMappingStorage. '''
+        return self._partition( mappingId ).get(
+            '_mapping_id_to_session_id', mappingId, self.TIME_OUT )
+    
+    def removeByMappingId( self, mappingId ):
+        ''' See interfaces.ISessionMappingStorage. '''
+        sessionId = self._partition( mappingId ).remove(
+            '_mapping_id_to_session_id', mappingId )
+        if sessionId is not None:
+            self._partition( sessionId ).remove(
+                '_session_id_to_mapping_id', sessionId )
+    
+    def removeBySessionId( self, sessionId ):
+        ''' See interfaces.ISessionMappingStorage. '''
+        mappingId = self._partition( sessionId ).remove(
+            '_session_id_to_mapping_id', sessionId )
+        if mappingId is not None:
+            self._partition( mappingId ).remove(
+                '_mapping_id_to_session_id', mappingId )
+    
+    def addSession( self, mappingId, sessionId ):
+        ''' See interfaces.ISessionMappingStorage. '''
+        self._partition( mappingId ).set(
+            '_mapping_id_to_session_id', mappingId, sessionId, self.TIME_OUT )
+        self._partition( sessionId ).set(
+            '_session_id_to_mapping_id', sessionId, mappingId, self.TIME_OUT )
+    
+    def _partition( self, key ):
+        # crc32 is stable across processes, unlike hash()
+        index = ( crc32(key) & 0xffffffff ) % len( self._partitions )
+        return self._partitions[index]
+
+class VolatileSessionMappingStorage( object ):
+    ''' See interfaces.ISessionMappingStorage.
+    Keeps the mappings in the memory of the current process.
+    
+    '''
+    
+    implements( ISessionMappingStorage )
+    
+    # Mappings are kept for 3 hours, as long as the ZODB storage does.
+    TIME_OUT = 3 * 60 * 60
+    
+    def __init__( self ):
+        ''' Creates a session mapping storage. '''
+        # mapping id as key, session id as value
+        self._mapping_id_to_session_id = VolatileMapping( self.TIME_OUT )
+        
+        # session id as key, mapping id as value
+        self._session_id_to_mapping_id = VolatileMapping( self.TIME_OUT )
+    
+    def getSessionId( self, mappingId ):
+        ''' See interfaces.ISessionMappingStorage. '''
+        return self._mapping_id_to_session_id.get( mappingId )
+    
+    def removeByMappingId( self, mappingId ):
+        ''' See interfaces.ISessionMappingStorage. '''
+        sessionId = self._mapping_id_to_session_id.pop( mappingId )
+        if sessionId is not None:
+            self._session_id_to_mapping_id.pop( sessionId )
+    
+    def removeBySessionId( self, sessionId ):
+        ''' See interfaces.ISessionMappingStorage. '''
+        mappingId = self._session_id_to_mapping_id.pop( sessionId )
+        if mappingId is not None:
+            self._mapping_id_to_session_id.pop( mappingId )
+    
+    def addSession( self, mappingId, sessionId ):
+        ''' See interfaces.ISessionMappingStorage. '''
+        self._mapping_id_to_session_id.set( mappingId, sessionId )
+        self._session_id_to_mapping_id.set( sessionId, mappingId )
+
+class FileSessionMappingStorage( VolatileSessionMappingStorage ):
+    ''' See interfaces.ISessionMappingStorage.
+    Keeps the mappings in files, shared by all the Zope clients of the host.
+    
+    '''
+    
+    def __init__( self, directory ):
+        ''' Creates a session mapping storage.
+        
+        @param directory
+        the directory to keep the mappings in
+        
+        '''
+        self._mapping_id_to_session_id = FileMapping(
+            os.path.join(directory, 'mapping'), self.TIME_OUT )
+        self._session_id_to_mapping_id = FileMapping(
+            os.path.join(directory, 'session'), self.TIME_OUT )
+
+def zodbSessionMappingStorage( plugin ):
+    ''' Adapt a plugin to the session mapping storage persisted on it in
+    the ZODB. Plugins created before the storage was partitioned keep
+    their SessionMappingStorage until upgrades.upgradeSessionStorage is
+    run.
+    
+    '''
+    return plugin._sessionStorage
+
+def volatileSessionMappingStorage( plugin ):
+    ''' Adapt a plugin to its in-process session mapping storage. '''
+    return getSharedStorage( ('session', 'volatile', getPluginKey(plugin)),
+                             VolatileSessionMappingStorage )
+
+def fileSessionMappingStorage( plugin ):
+    ''' Adapt a plugin to its file based session mapping storage. '''
+    directory = os.path.join( getStorageDirectory(plugin), 'session' )
+    return getSharedStorage( ('session', 'file', directory),
+                             FileSessionMappingStorage, directory )
@@ -0,0 +1,187 @@
+
+# python
+import hmac
+import json
+import os
+import time
+from base64 import urlsafe_b64encode, urlsafe_b64decode
+from hashlib import sha256
+from logging import getLogger
+
+from anz.casclient.assertion import Assertion
+from anz.casclient.principal import Principal
+from anz.casclient.proxyretriever import Cas20ProxyRetriever
+
+LOG = getLogger( 'anz.casclient' )
+
+# Browsers drop cookies bigger than about 4KB.
+MAX_COOKIE_SIZE = 4000
+
+def newSecret():
+    ''' Return a new random secret to sign cookies with. '''
+    return os.urandom( 32 ).encode( 'hex' )
+
+def encodeAssertion( assertion, secret, lifetime, pgtStorage=None ):
+    ''' Encode an assertion into a signed cookie value.
+
+    The principal id, attributes and an expiry time are signed with
+    HMAC-SHA256. The proxy granting ticket lets its holder act on behalf of
+    the user, it never leaves the server: it is kept in pgtStorage under a
+    random handle of this cookie, the cookie only carries the handle. Each
+    browser of a user thus has its own ticket.
+
+    @param assertion
+    the assertion to encode
+
+    @param secret
+    the secret of the plugin, the signing key is derived from it
+
+    @param lifetime
+    seconds the cookie is valid for
+
+    @param pgtStorage
+    mapping with set/get/pop (see storage.VolatileMapping) keeping the
+    proxy granting tickets, None drops them
+
+    @return
+    the cookie value.
+
+    '''
+    principal = assertion.getPrincipal()
+    payload = { 'id': principal.getId(),
+                'exp': int( time.time() + lifetime ) }
+
+    attributes = principal.getAttributes()
+    if attributes:
+        payload['attrs'] = attributes
+
+    if principal.pgt and pgtStorage is not None:
+        handle = os.urandom( 16 ).encode( 'hex' )
+        pgtStorage.set( handle, str(principal.pgt) )
+        payload['pgt'] = handle
+
+    body = _encode( json.dumps(payload, separators=(',', ':')) )
+    value = '%s.%s' % ( body, _sign(secret, body) )
+    if len( value ) > MAX_COOKIE_SIZE:
+        LOG.warning( 'Signed assertion cookie of %s is %d bytes long, '
+                     'browsers may drop it.' % ( principal.getId(),
+                                                 len(value) ) )
+
+    return value
+
+def decodeAssertion( value, secret, casServerUrlPrefix, connectTimeout=None,
+                     readTimeout=None, poolKey=None, pgtStorage=None ):
+    ''' Decode a cookie value built by encodeAssertion.
+
+    @param value
+    the cookie value
+
+    @param secret
+    the secret of the plugin the cookie was signed by
+
+    @param casServerUrlPrefix
+    the CAS server proxy tickets of the principal are retrieved from
+
+    @param poolKey
+    key of the proxy ticket pool of the plugin, see Cas20ProxyRetriever
+
+    @param pgtStorage
+    the mapping given to encodeAssertion
+
+    @return
+    an Assertion or None if the cookie is forged, corrupted or expired.
+
+    '''
+    payload = _loads( value, secret )
+    if payload is None:
+        return None
+
+    userId = payload['id']
+    try:
+        userId = str( userId )
+    except UnicodeError:
+        pass
+
+    attributes = payload.get( 'attrs' ) or {}
+    pgt = None
+    handle = _getPgtHandle( payload )
+    if handle and pgtStorage is not None:
+        # gone when it expired or was dropped at logout
+        pgt = pgtStorage.get( handle )
+
+    if pgt:
+        principal = Principal( userId, pgt,
+                               Cas20ProxyRetriever(casServerUrlPrefix,
+                                                   connectTimeout,
+                                                   readTimeout,
+                                                   poolKey),
+                               attributes )
+    else:
+        principal = Principal( userId, attributes=attributes )
+
+    return Assertion( principal )
+
+def dropPgt( value, secret, pgtStorage ):
+    ''' Drop the proxy granting ticket of a cookie value built by
+    encodeAssertion, the tickets of the other cookies of the user are kept.
+
+    @param value
+    the cookie value
+
+    @param secret
+    the secret of the plugin the cookie was signed by
+
+    @param pgtStorage
+    the mapping given to encodeAssertion
+
+    '''
+    payload = _loads( value, secret )
+    handle = payload is not None and _getPgtHandle( payload )
+    if handle:
+        pgtStorage.pop( handle )
+
+def _loads( value, secret ):
+    # the payload of a valid and unexpired cookie value, None otherwise
+    body, sep, signature = value.rpartition( '.' )
+    try:
+        valid = body and hmac.compare_digest( str(signature),
+                                              _sign(secret, body) )
+    except UnicodeError:
+        valid = False
+
+    if not valid:
+        return None
+
+    try:
+        payload = json.loads( _decode(body) )
+    except ( TypeError, ValueError ):
+        return None
+
+    if not isinstance( payload, dict ) or \
+       payload.get( 'exp', 0 ) < time.time():
+        return None
+
+    return payload
+
+def _getPgtHandle( payload ):
+    handle = payload.get( 'pgt' )
+    if not isinstance( handle, basestring ):
+        return None
+
+    return str( handle )
+
+def _deriveKey( secret, purpose ):
+    # one key per purpose, never the secret itself
+    return hmac.new( str(secret), 'anz.casclient:' + purpose,
+                     sha256 ).digest()
+
+def _sign( secret, body ):
+    return _encode( hmac.new(_deriveKey(secret, 'sign'), str(body),
+                             sha256).digest() )
+
+def _encode( data ):
+    return urlsafe_b64encode( data ).rstrip( '=' )
+
+def _decode( data ):
+    data = str( data )
+    return urlsafe_b64decode( data + '=' * (-len(data) % 4) )
@@ -0,0 +1,387 @@
+
+# python
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+from Queue import Queue, Full, Empty
+from StringIO import StringIO
+from logging import getLogger
+
+# zope
+from Acquisition import aq_chain
+from ZODB.POSException import ConflictError
+from zope.component.hooks import setSite
+from zope.component.interfaces import ISite
+from zope.publisher.browser import setDefaultSkin
+from ZPublisher.BaseRequest import RequestContainer
+from ZPublisher.HTTPRequest import HTTPRequest
+from ZPublisher.HTTPResponse import HTTPResponse
+import transaction
+
+LOG = getLogger( 'anz.casclient' )
+
+class LogoutQueue( object ):
+    ''' Applies single sign out requests in a background thread, clearing
+    the sessions of many requests in a single transaction instead of
+    committing once per request.
+
+    '''
+
+    # times a batch is retried on conflict errors
+    RETRIES = 3
+
+    def __init__( self, maxSize=10000, batchSize=100, opener=None ):
+        ''' Construct a logout queue.
+
+        @param maxSize
+        max number of logout requests waiting, put() refuses more
+
+        @param batchSize
+        max number of logout requests applied per transaction
+
+        @param opener
+        a callable returning the Zope application root object, default to
+        Zope2.app. A request is set up on it, as a publisher thread has.
+
+        '''
+        self.maxSize = maxSize
+        self.batchSize = batchSize
+        self.opener = opener or _openApp
+
+        self.processed = 0
+        self.failed = 0
+        self.batches = 0
+        self.lastBatchSize = 0
+        self.lastBatchSeconds = 0.0
+
+        self._queue = Queue( maxSize )
+        self._lock = threading.Lock()
+        self._worker = None
+
+    def put( self, path, mappingId, sessionId=None ):
+        ''' Queue the logout of the session mapped to mappingId by the
+        plugin at path.
+
+        @param sessionId
+        id of the session to clear, if known, default to the session
+        mapped to mappingId
+
+        @return
+        False if the queue is full and the logout must be applied by the
+        caller.
+
+        '''
+        try:
+            self._queue.put_nowait( (path, mappingId, sessionId) )
+        except Full:
+            return False
+
+        self._lock.acquire()
+        try:
+            if self._worker is None or not self._worker.isAlive():
+                self._worker = threading.Thread(
+                    target=self._run, name='anz.casclient single sign out' )
+                self._worker.setDaemon( True )
+                self._worker.start()
+        finally:
+            self._lock.release()
+
+        return True
+
+    def getStats( self ):
+        ''' Return a dict of the queue depth and processing counters. '''
+        rate = 0.0
+        if self.lastBatchSeconds:
+            rate = self.lastBatchSize / self.lastBatchSeconds
+
+        return { 'depth': self._queue.qsize(),
+                 'maxSize': self.maxSize,
+                 'batchSize': self.batchSize,
+                 'processed': self.processed,
+                 'failed': self.failed,
+                 'batches': self.batches,
+                 'rate': rate }
+
+    def _run( self ):
+        while True:
+            batch = [ self._queue.get() ]
+            while len( batch ) < self.batchSize:
+                try:
+                    batch.append( self._queue.get_nowait() )
+                except Empty:
+                    break
+
+            started = time.time()
+            try:
+                self._process( batch )
+            except Exception, e:
+                LOG.error( 'Fail to apply %d logout requests: %s' % \
+                           ( len(batch), e ) )
+                self.failed += len( batch )
+
+            self.batches += 1
+            self.lastBatchSize = len( batch )
+            self.lastBatchSeconds = time.time() - started
+
+    def _process( self, batch ):
+        # group by plugin, each plugin gets a transaction per batch
+        mappingIds = {}
+        sessionIds = {}
+        for path, mappingId, sessionId in batch:
+            mappingIds.setdefault( path, [] ).append( mappingId )
+            if sessionId is not None:
+                sessionIds.setdefault( path, {} )[mappingId] = sessionId
+
+        app = _withRequest( self.opener() )
+        try:
+            for path, ids in mappingIds.items():
+                for attempt in range( self.RETRIES ):
+                    try:
+                        plugin = app.unrestrictedTraverse( path )
+                        # local components (e.g. of a Plone site) are
+                        # looked up as when publishing
+                        setSite( _findSite(plugin) )
+                        plugin._logoutSessions( ids,
+                                                sessionIds.get(path) )
+                        transaction.commit()
+                    except ConflictError:
+                        transaction.abort()
+                        continue
+                    except Exception, e:
+                        transaction.abort()
+                        LOG.error( 'Fail to apply %d logout requests for '
+                                   '%s: %s' % ( len(ids), path, e ) )
+                        self.failed += len( ids )
+                        break
+
+                    self.processed += len( ids )
+                    break
+                else:
+                    LOG.error( 'Fail to apply %d logout requests for %s, '
+                               'too many conflicts.' % ( len(ids), path ) )
+                    self.failed += len( ids )
+        finally:
+            setSite( None )
+            transaction.abort()
+            app.REQUEST.close()
+            app._p_jar.close()
+
+def _withRequest( app ):
+    ''' Wrap app in an empty GET request, as ZPublisher wraps the root of
+    each published request, so code looking REQUEST up through
+    acquisition finds one.
+
+    '''
+    environ = { 'SERVER_NAME': 'localhost',
+                'SERVER_PORT': '80',
+                'REQUEST_METHOD': 'GET' }
+    request = HTTPRequest( StringIO(), environ,
+                           HTTPResponse(stdout=StringIO()) )
+    setDefaultSkin( request )
+    return app.__of__( RequestContainer(REQUEST=request) )
+
+def _findSite( obj ):
+    ''' Return the nearest site containing obj, or None. '''
+    for parent in aq_chain( obj ):
+        if ISite.providedBy( parent ):
+            return parent
+
+    return None
+
+def _openApp():
+    # imported here, only the worker thread needs a database connection
+    import Zope2
+    return Zope2.app()
+
+_logoutQueue = LogoutQueue()
+
+def getLogoutQueue():
+    ''' Retrieve the logout queue shared by the whole process. '''
+    return _logoutQueue
+
+class LogoutSpool( object ):
+    ''' Forwards single sign out requests to the other Zope clients of a
+    cluster through a spool directory they all share.
+
+    Each client has an inbox directory in the spool directory. The client
+    receiving a logout request from CAS drops a file in the inbox of each
+    live peer, peers poll their inbox and hand the requests to their
+    logout queue.
+
+    '''
+
+    # seconds after which a peer not polling its inbox is considered dead,
+    # and after which its inbox is removed
+    STALE = 60
+    EXPIRED = 3600
+
+    def __init__( self, directory, pollInterval=1, handler=None,
+                  nodeId=None ):
+        ''' Construct a logout spool.
+
+        @param directory
+        the spool directory shared by the Zope clients
+
+        @param pollInterval
+        seconds between two polls of the inbox
+
+        @param handler
+        a callable taking ( path, mappingId, sessionId ) and returning
+        False when the request can not be taken yet, default to queue it
+        in the logout queue
+
+        @param nodeId
+        name of the inbox of this client, default to the host name and
+        process id
+
+        '''
+        self.directory = directory
+        self.pollInterval = pollInterval
+        self.handler = handler or _queueLogout
+        self.nodeId = nodeId or '%s-%d' % ( socket.gethostname(),
+                                            os.getpid() )
+        self.inbox = os.path.join( directory, self.nodeId )
+
+        self.received = 0
+        self.sent = 0
+
+        if not os.path.isdir( self.inbox ):
+            os.makedirs( self.inbox )
+
+        self._heartbeat()
+        self._stopped = threading.Event()
+        self._worker = threading.Thread( target=self._run,
+                                         name='anz.casclient logout spool' )
+        self._worker.setDaemon( True )
+        self._worker.start()
+
+    def broadcast( self, path, mappingId, sessionId=None ):
+        ''' Forward a logout request to the live peers.
+
+        @param path
+        physical path of the plugin which received the request
+
+        @param mappingId
+        the session index of the request
+
+        @param sessionId
+        id of the session to clear, if known
+
+        '''
+        message = '\n'.join( ['/'.join( path ), mappingId, sessionId or ''] )
+        for inbox in self._getPeerInboxes():
+            try:
+                fd, tmp = tempfile.mkstemp( dir=inbox, prefix='.' )
+                try:
+                    os.write( fd, message )
+                finally:
+                    os.close( fd )
+
+                # files starting with a dot are not read, rename to make
+                # the message visible at once
+                name = os.path.basename( tmp )[1:]
+                os.rename( tmp, os.path.join(inbox, name) )
+                self.sent += 1
+            except OSError, e:
+                LOG.warning( 'Fail to forward logout request to %s: %s' % \
+                             ( inbox, e ) )
+
+    def getStats( self ):
+        ''' Return a dict of the node id, number of live peers and message
+        counters.
+
+        '''
+        return { 'nodeId': self.nodeId,
+                 'peers': len( self._getPeerInboxes() ),
+                 'sent': self.sent,
+                 'received': self.received }
+
+    def close( self ):
+        ''' Stop polling the inbox. '''
+        self._stopped.set()
+
+    def _heartbeat( self ):
+        open( os.path.join(self.inbox, '.alive'), 'w' ).close()
+
+    def _getPeerInboxes( self ):
+        now = time.time()
+        inboxes = []
+        for name in os.listdir( self.directory ):
+            inbox = os.path.join( self.directory, name )
+            if name == self.nodeId or not os.path.isdir( inbox ):
+                continue
+
+            try:
+                age = now - os.path.getmtime( os.path.join(inbox, '.alive') )
+            except OSError:
+                continue
+
+            if age < self.STALE:
+                inboxes.append( inbox )
+            elif age > self.EXPIRED:
+                shutil.rmtree( inbox, ignore_errors=True )
+
+        return inboxes
+
+    def _run( self ):
+        while not self._stopped.isSet():
+            try:
+                self._heartbeat()
+                self._poll()
+            except Exception, e:
+                LOG.warning( 'Fail to read logout spool %s: %s' % \
+                             ( self.inbox, e ) )
+
+            self._stopped.wait( self.pollInterval )
+
+    def _poll( self ):
+        for name in sorted( os.listdir(self.inbox) ):
+            if name.startswith( '.' ):
+                continue
+
+            filename = os.path.join( self.inbox, name )
+            f = open( filename, 'rb' )
+            try:
+                message = f.read()
+            finally:
+                f.close()
+
+            try:
+                path, mappingId, sessionId = message.split( '\n' )
+            except ValueError:
+                LOG.warning( 'Malformed logout message %s dropped.' % \
+                             filename )
+                os.unlink( filename )
+                continue
+
+            if not self.handler( tuple(path.split('/')), mappingId,
+                                 sessionId or None ):
+                # try again on the next poll
+                return
+
+            os.unlink( filename )
+            self.received += 1
+
+def _queueLogout( path, mappingId, sessionId ):
+    return getLogoutQueue().put( path, mappingId, sessionId )
+
+_spools = {}
+_spoolsLock = threading.Lock()
+
+def getLogoutSpool( directory ):
+    ''' Retrieve the logout spool of this process for a spool directory,
+    start polling it on first use.
+
+    '''
+    _spoolsLock.acquire()
+    try:
+        spool = _spools.get( directory )
+        if spool is None:
+            spool = _spools[directory] = LogoutSpool( directory )
+    finally:
+        _spoolsLock.release()
+
+    return spool
@@ -0,0 +1,172 @@
+
+# python
+import os
+import tempfile
+import threading
+import time
+from hashlib import sha1
+
+_storages = {}
+_lock = threading.Lock()
+
+def getSharedStorage( key, factory, *args ):
+    ''' Return the non-persistent storage registered under key, create it
+    by calling factory with args on first use.
+
+    '''
+    _lock.acquire()
+    try:
+        storage = _storages.get( key )
+        if storage is None:
+            storage = _storages[key] = factory( *args )
+    finally:
+        _lock.release()
+
+    return storage
+
+def getPluginKey( plugin ):
+    ''' Return a key identifying a plugin, used to share non-persistent
+    storages between the ZODB connections of a process.
+
+    '''
+    return '/'.join( plugin.getPhysicalPath() )
+
+def getStorageDirectory( plugin ):
+    ''' Return the directory the file based storages of a plugin keep their
+    entries in. Default to a directory in shared memory (/dev/shm) when
+    the host has one, so entries never hit the disk.
+
+    '''
+    base = getattr( plugin, 'storageDirectory', '' )
+    if not base:
+        base = os.path.isdir( '/dev/shm' ) and '/dev/shm' or \
+               tempfile.gettempdir()
+        base = os.path.join( base, 'anz.casclient' )
+
+    return os.path.join( base, sha1(getPluginKey( plugin )).hexdigest() )
+
+class VolatileMapping( object ):
+    ''' A thread-safe in-process mapping whose entries expire timeout
+    seconds after they were set.
+
+    '''
+
+    def __init__( self, timeout ):
+        self.timeout = timeout
+
+        self._data = {}
+        self._lock = threading.Lock()
+        self._nextPurge = time.time() + timeout
+
+    def get( self, key ):
+        ''' Return the value of key or None if not found or expired. '''
+        entry = self._data.get( key )
+        if entry is None or entry[1] < time.time():
+            return None
+
+        return entry[0]
+
+    def set( self, key, value ):
+        now = time.time()
+        self._lock.acquire()
+        try:
+            self._data[key] = ( value, now + self.timeout )
+            if now > self._nextPurge:
+                self._purge( now )
+        finally:
+            self._lock.release()
+
+    def pop( self, key ):
+        ''' Remove key and return its value or None if not found. '''
+        self._lock.acquire()
+        try:
+            entry = self._data.pop( key, None )
+        finally:
+            self._lock.release()
+
+        if entry is None or entry[1] < time.time():
+            return None
+
+        return entry[0]
+
+    def _purge( self, now ):
+        for key, entry in self._data.items():
+            if entry[1] < now:
+                del self._data[key]
+
+        self._nextPurge = now + self.timeout
+
+class FileMapping( object ):
+    ''' A mapping kept as one file per entry in a directory, so it can be
+    shared by all the Zope clients running on one host. Entries expire
+    timeout seconds after they were set.
+
+    Writes are done to a temporary file renamed over the entry, so readers
+    never see a partial value.
+
+    '''
+
+    def __init__( self, directory, timeout ):
+        self.directory = directory
+        self.timeout = timeout
+
+        self._nextPurge = time.time() + timeout
+        if not os.path.isdir( directory ):
+            try:
+                os.makedirs( directory )
+            except OSError:
+                # created by another process in the meantime
+                if not os.path.isdir( directory ):
+                    raise
+
+    def get( self, key ):
+        ''' Return the value of key or None if not found or expired. '''
+        path = self._path( key )
+        try:
+            if os.path.getmtime( path ) + self.timeout < time.time():
+                return None
+
+            f = open( path, 'rb' )
+            try:
+                return f.read()
+            finally:
+                f.close()
+        except ( IOError, OSError ):
+            return None
+
+    def set( self, key, value ):
+        path = self._path( key )
+        fd, tmp = tempfile.mkstemp( dir=self.directory, prefix='.' )
+        try:
+            os.write( fd, value )
+        finally:
+            os.close( fd )
+
+        os.rename( tmp, path )
+
+        now = time.time()
+        if now > self._nextPurge:
+            self._purge( now )
+
+    def pop( self, key ):
+        ''' Remove key and return its value or None if not found. '''
+        value = self.get( key )
+        try:
+            os.unlink( self._path(key) )
+        except OSError:
+            pass
+
+        return value
+
+    def _path( self, key ):
+        return os.path.join( self.directory, sha1(key).hexdigest() )
+
+    def _purge( self, now ):
+        self._nextPurge = now + self.timeout
+        for name in os.listdir( self.directory ):
+            path = os.path.join( self.directory, name )
+            try:
+                if os.path.getmtime( path ) + self.timeout < now:
+                    os.unlink( path )
+            except OSError:
+                pass
@@ -0,0 +1,504 @@
+
+''' Benchmarks of the login path against an in-process fake CAS server.
+
+Run them from the buildout, e.g.:
+
+  bin/zopepy -m anz.casclient.tests.benchmark --save baseline.json
+
+and after a change:
+
+  bin/zopepy -m anz.casclient.tests.benchmark --compare baseline.json
+
+Each benchmark reports its throughput (calls per second) and its p50, p90
+and p99 latencies. With --compare the exit status is 1 when the
+throughput or the p90 latency of a benchmark regressed by more than the
+tolerance.
+
+Benchmarks:
+
+- extract.*: AnzCASClient.extractCredentials end-to-end, for a login with
+  a service ticket (with and without a proxy granting ticket), a request
+  authenticated by the session and one authenticated by signed cookie
+- validate.*: each ticket validator against the fake CAS server
+- proxy.*: Cas20ProxyRetriever getting proxy tickets
+- storage.*: lookups in the proxy granting ticket and session mapping
+  storages of each backend, populated with --sizes entries. Lookup costs
+  must stay flat from 10k to 1M entries:
+
+    bin/zopepy -m anz.casclient.tests.benchmark -k storage \
+        --sizes 10000,100000,1000000
+
+'''
+
+# python
+import itertools
+import json
+import math
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from optparse import OptionParser
+
+# zope
+from Acquisition import Implicit
+from OFS.Folder import Folder
+
+from anz.casclient.proxygrantingticketstorage import \
+     ProxyGrantingTicketStorage, VolatileProxyGrantingTicketStorage, \
+     FileProxyGrantingTicketStorage
+from anz.casclient.sessionmappingstorage import \
+     PartitionedSessionMappingStorage, VolatileSessionMappingStorage, \
+     FileSessionMappingStorage
+from anz.casclient.proxyretriever import Cas20ProxyRetriever
+from anz.casclient.transport import getTransport
+from anz.casclient.validationspecification import Cas10TicketValidator, \
+     Cas20ServiceTicketValidator, Cas20ProxyTicketValidator, \
+     Cas30ServiceTicketValidator, Cas30ProxyTicketValidator, \
+     Cas20SAMLServiceTicketValidator
+from anz.casclient.tests.fakecas import FakeCASServer
+from anz.casclient.tests.test_casclient import FakeRequest, newPlugin
+
+SERVICE = 'https://service'
+PROXY = 'https://proxy/callback'
+ATTRIBUTES = { 'mail': 'bob@example.com',
+               'memberOf': ['staff', 'admins'] }
+PERCENTILES = ( 50, 90, 99 )
+
+# Entries of the ticket storages are kept for a day, so they outlive the
+# population of the largest sizes.
+DAY = 24 * 60 * 60
+
+class _PgtStorage( ProxyGrantingTicketStorage ):
+    TIME_OUT = DAY
+
+class _VolatilePgtStorage( VolatileProxyGrantingTicketStorage ):
+    TIME_OUT = DAY
+
+class _FilePgtStorage( FileProxyGrantingTicketStorage ):
+    TIME_OUT = DAY
+
+def percentile( samples, p ):
+    ''' Return the p-th percentile (nearest rank) of sorted samples. '''
+    if not samples:
+        return 0.0
+
+    rank = int( math.ceil(p / 100.0 * len(samples)) )
+    return samples[max( rank, 1 ) - 1]
+
+def measure( operation, number, concurrency=1, warmup=10 ):
+    ''' Call operation number times, from concurrency threads.
+
+    @return
+    a dict of the count of calls, the seconds they took, the throughput
+    (calls per second) and the p50, p90 and p99 latencies in seconds.
+
+    '''
+    for i in range( warmup ):
+        operation()
+
+    samples = []
+    lock = threading.Lock()
+
+    def work( count ):
+        durations = []
+        for i in xrange( count ):
+            started = time.time()
+            operation()
+            durations.append( time.time() - started )
+
+        lock.acquire()
+        try:
+            samples.extend( durations )
+        finally:
+            lock.release()
+
+    started = time.time()
+    if concurrency > 1:
+        threads = []
+        for i in range( concurrency ):
+            count = number // concurrency + ( i < number % concurrency )
+            thread = threading.Thread( target=work, args=(count,) )
+            thread.start()
+            threads.append( thread )
+
+        for thread in threads:
+            thread.join()
+    else:
+        work( number )
+
+    elapsed = max( time.time() - started, 1e-9 )
+    samples.sort()
+    result = { 'count': len( samples ),
+               'seconds': elapsed,
+               'throughput': len( samples ) / elapsed }
+    for p in PERCENTILES:
+        result['p%d' % p] = percentile( samples, p )
+
+    return result
+
+class _SessionData( dict ):
+    ''' Just what the plugin reads from a session. '''
+
+    def __init__( self, key ):
+        dict.__init__( self )
+        self.key = key
+
+    def getContainerKey( self ):
+        return self.key
+
+    def set( self, name, value ):
+        self[name] = value
+
+class _SessionDataManager( Implicit ):
+    ''' Serves the session of the current benchmark request. '''
+
+    def __init__( self ):
+        self.current = None
+        self._counter = itertools.count( 1 )
+
+    def getSessionData( self, create=1 ):
+        if self.current is None and create:
+            self.current = _SessionData( 'session-%d' %
+                                         self._counter.next() )
+
+        return self.current
+
+class _PloneSession( Implicit ):
+    ''' Stands in for the plone.session plugin. '''
+
+    @property
+    def source( self ):
+        return self
+
+    def createIdentifier( self, userId ):
+        return userId
+
+    def setupSession( self, userId, response ):
+        pass
+
+    _setupSession = setupSession
+
+class Benchmarks( object ):
+    ''' The benchmarks against one fake CAS server. '''
+
+    def __init__( self, cas, sizes=(), directory=None ):
+        ''' Construct the benchmarks.
+
+        @param cas
+        a started FakeCASServer
+
+        @param sizes
+        numbers of entries the storages are populated with
+
+        @param directory
+        where the file storages keep their entries
+
+        '''
+        self.cas = cas
+        self.sizes = sizes
+        self.directory = directory
+
+    def getNames( self ):
+        ''' Return the names of the benchmarks, in the order they run. '''
+        names = [ 'extract.login', 'extract.login_pgt', 'extract.session',
+                  'extract.cookie' ]
+        names.extend( ['validate.%s' % name for name in
+                       sorted( self._getValidators() )] )
+        names.append( 'proxy.cas20' )
+        for size in self.sizes:
+            for kind in ( 'pgt', 'session' ):
+                for backend in ( 'zodb', 'volatile', 'file' ):
+                    names.append( 'storage.%s.%s.%d' % (kind, backend, size) )
+
+        return names
+
+    def setUp( self, name ):
+        ''' Prepare the benchmark name.
+
+        @return
+        the operation to time, a callable without arguments.
+
+        '''
+        parts = name.split( '.' )
+        if parts[0] == 'extract':
+            return { 'login': self._extractLogin,
+                     'login_pgt': self._extractLoginPgt,
+                     'session': self._extractSession,
+                     'cookie': self._extractCookie }[parts[1]]()
+        if parts[0] == 'validate':
+            return self._validate( parts[1] )
+        if parts[0] == 'proxy':
+            return self._proxy()
+        if parts[0] == 'storage':
+            return getattr( self, '_%sStorage' % parts[1] )(
+                parts[2], int(parts[3]) )
+
+        raise ValueError( name )
+
+    # AnzCASClient.extractCredentials
+
+    def _newPlugin( self, **properties ):
+        folder = Folder( 'acl_users' )
+        folder.session_data_manager = _SessionDataManager()
+        folder.session = _PloneSession()
+        properties.setdefault( 'ticketValidationSpecification', 'CAS 2.0' )
+        folder._setObject( 'cas', newPlugin(
+            'cas', casServerUrlPrefix=self.cas.url, serviceUrl=SERVICE,
+            **properties) )
+        return folder.cas
+
+    def _login( self, plugin ):
+        plugin.session_data_manager.current = None
+        request = FakeRequest( form={'ticket': self.cas.issueTicket(
+            'bob', ATTRIBUTES)} )
+        assert plugin.extractCredentials( request ), 'login failed'
+        if plugin.proxyCallbackUrlPrefix:
+            assertion = request.other[plugin.CAS_REQUEST_ASSERTION +
+                                      plugin.getId()]
+            assert assertion.getPrincipal().pgt, 'no pgt'
+
+        return request
+
+    def _extractLogin( self ):
+        plugin = self._newPlugin()
+        return lambda: self._login( plugin )
+
+    def _extractLoginPgt( self ):
+        plugin = self._newPlugin( proxyCallbackUrlPrefix=SERVICE )
+
+        # the CAS server calls the callback of this process back
+        def callBack( pgtUrl, pgtIou, pgt ):
+            plugin.proxyCallback( pgt, pgtIou )
+
+        self.cas.proxyCallback = callBack
+        return lambda: self._login( plugin )
+
+    def _extractSession( self ):
+        plugin = self._newPlugin()
+        self._login( plugin )
+        return lambda: plugin.extractCredentials( FakeRequest() )
+
+    def _extractCookie( self ):
+        plugin = self._newPlugin( useSignedCookie=True,
+                                  storageBackend='volatile' )
+        response = self._login( plugin ).response
+        cookies = { plugin.signedCookieName:
+                    response.cookies[plugin.signedCookieName] }
+        return lambda: plugin.extractCredentials(
+            FakeRequest(cookies=cookies) )
+
+    # Ticket validators
+
+    def _getValidators( self ):
+        ''' Return ( validator, whether it validates proxy tickets ) by
+        name.
+
+        '''
+        url = self.cas.url
+        pgtStorage = VolatileProxyGrantingTicketStorage()
+        return {
+            'cas10': ( Cas10TicketValidator(url), False ),
+            'cas20': ( Cas20ServiceTicketValidator(url, pgtStorage),
+                       False ),
+            'cas20_proxy': ( Cas20ProxyTicketValidator(url, pgtStorage),
+                             True ),
+            'cas30': ( Cas30ServiceTicketValidator(url, pgtStorage),
+                       False ),
+            'cas30_json': ( Cas30ServiceTicketValidator(
+                url, pgtStorage, responseFormat='JSON'), False ),
+            'cas30_proxy': ( Cas30ProxyTicketValidator(url, pgtStorage),
+                             True ),
+            'saml11': ( Cas20SAMLServiceTicketValidator(url, pgtStorage),
+                        False ) }
+
+    def _validate( self, name ):
+        validator, proxy = self._getValidators()[name]
+        proxies = proxy and [ PROXY ] or []
+
+        def validate():
+            ticket = self.cas.issueTicket( 'bob', ATTRIBUTES, proxies )
+            validator.validate( ticket, SERVICE )
+
+        return validate
+
+    # Cas20ProxyRetriever
+
+    def _proxy( self ):
+        retriever = Cas20ProxyRetriever( self.cas.url )
+        pgt = self.cas.issuePgt( 'bob', PROXY )
+
+        def retrieve():
+            assert retriever.getProxyTicketIdFor( pgt, SERVICE ), \
+                   'no proxy ticket'
+
+        return retrieve
+
+    # Storages
+
+    def _getDirectory( self, name ):
+        directory = os.path.join( self.directory, name )
+        if os.path.isdir( directory ):
+            shutil.rmtree( directory )
+
+        return directory
+
+    def _pgtStorage( self, backend, size ):
+        if backend == 'zodb':
+            storage = _PgtStorage()
+        elif backend == 'volatile':
+            storage = _VolatilePgtStorage()
+        else:
+            storage = _FilePgtStorage( self._getDirectory('pgt') )
+
+        for i in xrange( size ):
+            storage.add( 'PGTIOU-%d' % i, 'PGT-%d' % i )
+
+        keys = _randomKeys( 'PGTIOU-%d', size )
+        return lambda: storage.retrieve( keys.next() )
+
+    def _sessionStorage( self, backend, size ):
+        if backend == 'zodb':
+            storage = PartitionedSessionMappingStorage()
+        elif backend == 'volatile':
+            storage = VolatileSessionMappingStorage()
+        else:
+            storage = FileSessionMappingStorage(
+                self._getDirectory('session') )
+
+        for i in xrange( size ):
+            storage.addSession( 'ST-%d' % i, 'session-%d' % i )
+
+        keys = _randomKeys( 'ST-%d', size )
+        return lambda: storage.getSessionId( keys.next() )
+
+def _randomKeys( pattern, size, count=1000 ):
+    return itertools.cycle( [pattern % random.randrange( size )
+                             for i in range( count )] )
+
+def compare( result, baseline, tolerance ):
+    ''' Compare a result with its baseline.
+
+    @return
+    ( throughput change, p90 change, whether it regressed ), changes as
+    fractions of the baseline.
+
+    '''
+    throughput = result['throughput'] / baseline['throughput'] - 1
+    p90 = baseline['p90'] and result['p90'] / baseline['p90'] - 1 or 0.0
+    return throughput, p90, throughput < -tolerance or p90 > tolerance
+
+def formatResult( name, result, baseline=None, tolerance=0.1 ):
+    ''' Format a result as a line of the report. '''
+    line = '%-34s %7d %10.1f %9.3f %9.3f %9.3f' % (
+        name, result['count'], result['throughput'],
+        result['p50'] * 1000, result['p90'] * 1000, result['p99'] * 1000 )
+    if baseline is not None:
+        throughput, p90, regressed = compare( result, baseline, tolerance )
+        line += ' %+8.1f%% %+8.1f%%%s' % ( throughput * 100, p90 * 100,
+                                           regressed and ' !' or '' )
+
+    return line
+
+def main( argv=None, out=sys.stdout ):
+    ''' Run the benchmarks, see the module docstring.
+
+    @return
+    the exit status.
+
+    '''
+    parser = OptionParser( usage='%prog [options]' )
+    parser.add_option( '-n', '--number', type='int', default=200,
+                       help='calls per benchmark [%default]' )
+    parser.add_option( '-l', '--lookups', type='int', default=10000,
+                       help='lookups per storage benchmark [%default]' )
+    parser.add_option( '-c', '--concurrency', type='int', default=1,
+                       help='threads calling each operation [%default]' )
+    parser.add_option( '--latency', type='float', default=0.0,
+                       help='seconds the fake CAS server delays each '
+                            'response for [%default]' )
+    parser.add_option( '--payload', type='int', default=0,
+                       help='length of an extra attribute released on '
+                            'validation [%default]' )
+    parser.add_option( '--sizes', default='10000,100000',
+                       help='comma separated numbers of entries the '
+                            'storages are populated with, e.g. '
+                            '10000,100000,1000000 [%default]' )
+    parser.add_option( '-k', '--only', action='append', default=[],
+                       help='only run the benchmarks whose name contains '
+                            'this, may be repeated' )
+    parser.add_option( '--save', metavar='FILE',
+                       help='save the results as a baseline to FILE' )
+    parser.add_option( '--compare', metavar='FILE',
+                       help='compare the results with the baseline in FILE' )
+    parser.add_option( '--tolerance', type='float', default=10.0,
+                       help='percent of throughput or p90 latency change '
+                            'reported as a regression [%default]' )
+    options, args = parser.parse_args( argv )
+
+    baseline = {}
+    if options.compare:
+        baseline = json.load( open(options.compare) )['results']
+
+    sizes = [ int(size) for size in options.sizes.split( ',' ) if size ]
+    directory = tempfile.mkdtemp( prefix='anz.casclient-benchmark-' )
+    cas = FakeCASServer( options.latency, options.payload ).start()
+    tolerance = options.tolerance / 100.0
+    results = {}
+    regressions = 0
+    try:
+        benchmarks = Benchmarks( cas, sizes, directory )
+        out.write( '%-34s %7s %10s %9s %9s %9s' % (
+            'benchmark', 'calls', 'calls/s', 'p50 ms', 'p90 ms', 'p99 ms') )
+        if options.compare:
+            out.write( ' %9s %9s' % ('calls/s', 'p90') )
+        out.write( '\n' )
+
+        for name in benchmarks.getNames():
+            if options.only and \
+               not [ part for part in options.only if part in name ]:
+                continue
+
+            number = name.startswith( 'storage.' ) and options.lookups \
+                     or options.number
+            operation = benchmarks.setUp( name )
+            results[name] = result = measure( operation, number,
+                                              options.concurrency )
+            del operation
+
+            if name in baseline and \
+               compare( result, baseline[name], tolerance )[2]:
+                regressions += 1
+
+            out.write( formatResult(name, result, baseline.get(name),
+                                    tolerance) + '\n' )
+            out.flush()
+    finally:
+        # close the kept-alive connections before the server
+        getTransport().clear()
+        cas.stop()
+        shutil.rmtree( directory, ignore_errors=True )
+
+    if options.save:
+        settings = dict( [(name, getattr( options, name )) for name in
+                          ('number', 'lookups', 'concurrency', 'latency',
+                           'payload', 'sizes')] )
+        f = open( options.save, 'w' )
+        try:
+            json.dump( {'settings': settings, 'results': results}, f,
+                       indent=1, sort_keys=True )
+        finally:
+            f.close()
+
+    if regressions:
+        out.write( '%d benchmarks regressed by more than %s%%.\n' % (
+            regressions, options.tolerance) )
+        return 1
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit( main() )
@@ -0,0 +1,409 @@
+
+# python
+import itertools
+import json
+import socket
+import threading
+import time
+import urllib2
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+from cgi import escape
+from urllib import urlencode
+from urlparse import urlsplit, parse_qs
+from xml.etree.cElementTree import fromstring
+
+CAS_NS = 'http://www.yale.edu/tp/cas'
+SAMLP_NS = 'urn:oasis:names:tc:SAML:1.0:protocol'
+
+class FakeCASServer( object ):
+    ''' A CAS server stand-in running in a thread of the current process,
+    for the tests and the benchmarks.
+
+    It serves CAS 1.0 (/validate), CAS 2.0 (/serviceValidate,
+    /proxyValidate, /proxy), CAS 3.0 (/p3/serviceValidate and
+    /p3/proxyValidate, XML or JSON) and SAML 1.1 (/samlValidate) under
+    url. Tickets are issued by issueTicket and are single use, like on a
+    real CAS server. When a ticket is validated with a pgtUrl the server
+    calls it back with a new pgtIou and pgt before answering.
+
+    Extra paths are served by routes: path as key, callable taking the
+    request handler as value. The callable either returns a ( status,
+    headers, body ) tuple or writes the response itself and returns None.
+
+    '''
+
+    def __init__( self, latency=0, payloadSize=0, host='127.0.0.1' ):
+        ''' Construct a fake CAS server, start() starts serving.
+
+        @param latency
+        seconds each response is delayed for
+
+        @param payloadSize
+        length of an extra 'payload' attribute released with each
+        validation, to simulate large attribute payloads
+
+        @param host
+        address to listen on, '::1' listens on IPv6
+
+        '''
+        self.latency = latency
+        self.payloadSize = payloadSize
+        self.host = host
+        self.routes = {}
+
+        # number of TCP connections accepted, ( method, path ) of each
+        # request received
+        self.connections = 0
+        self.requests = []
+
+        # callable taking a pgtUrl, pgtIou and pgt, default to a HTTP GET
+        # of the pgtUrl like a real CAS server
+        self.proxyCallback = _callBack
+
+        self._tickets = {}
+        self._pgts = {}
+        self._counter = itertools.count( 1 )
+        self._lock = threading.Lock()
+        self._server = None
+
+    @property
+    def url( self ):
+        host = ':' in self.host and '[%s]' % self.host or self.host
+        return 'http://%s:%d/cas' % ( host, self._server.server_address[1] )
+
+    def start( self ):
+        self._server = _Server( self )
+        thread = threading.Thread( target=self._server.serve_forever,
+                                   args=( 0.05, ),
+                                   name='fake CAS server' )
+        thread.setDaemon( True )
+        thread.start()
+        return self
+
+    def stop( self ):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def issueTicket( self, user, attributes=None, proxies=(), pgt=True ):
+        ''' Issue a service ticket (a proxy ticket if proxies are given).
+
+        @param user
+        id of the authenticated user
+
+        @param attributes
+        attributes released for the user, name as key, a value or a list
+        of values as value
+
+        @param proxies
+        proxy callback urls of the proxy chain, most recent first
+
+        @param pgt
+        whether a proxy granting ticket is granted when validated with a
+        pgtUrl
+
+        @return
+        the ticket id.
+
+        '''
+        prefix = proxies and 'PT' or 'ST'
+        ticket = '%s-%d-fakecas' % ( prefix, self._counter.next() )
+        self._lock.acquire()
+        try:
+            self._tickets[ticket] = ( user, dict(attributes or {}),
+                                      list(proxies), pgt )
+        finally:
+            self._lock.release()
+
+        return ticket
+
+    def issuePgt( self, user, pgtUrl='https://service' ):
+        ''' Grant a proxy granting ticket to user without calling pgtUrl
+        back.
+
+        @return
+        the proxy granting ticket id.
+
+        '''
+        pgt = 'PGT-%d-fakecas' % self._counter.next()
+        self._lock.acquire()
+        try:
+            self._pgts[pgt] = ( user, pgtUrl )
+        finally:
+            self._lock.release()
+
+        return pgt
+
+    def _takeTicket( self, ticket, acceptProxyTickets ):
+        self._lock.acquire()
+        try:
+            entry = self._tickets.get( ticket )
+            if entry is None or \
+               ( entry[2] and not acceptProxyTickets ):
+                return None
+
+            del self._tickets[ticket]
+            return entry
+        finally:
+            self._lock.release()
+
+    def _grantPgt( self, user, pgtUrl ):
+        number = self._counter.next()
+        pgtIou = 'PGTIOU-%d-fakecas' % number
+        pgt = 'PGT-%d-fakecas' % number
+        try:
+            self.proxyCallback( pgtUrl, pgtIou, pgt )
+        except Exception:
+            # CAS does not grant the pgt if the callback fails
+            return None
+
+        self._lock.acquire()
+        try:
+            self._pgts[pgt] = ( user, pgtUrl )
+        finally:
+            self._lock.release()
+
+        return pgtIou
+
+    def _attributes( self, attributes ):
+        attributes = dict( attributes )
+        if self.payloadSize:
+            attributes['payload'] = 'x' * self.payloadSize
+
+        return attributes
+
+    # Responses
+
+    def validate( self, query ):
+        entry = self._takeTicket( query.get('ticket'), False )
+        if entry is None:
+            return 'no\n\n'
+
+        return 'yes\n%s\n' % entry[0]
+
+    def serviceValidate( self, query, acceptProxyTickets=False,
+                         format='XML' ):
+        ticket = query.get( 'ticket' )
+        entry = self._takeTicket( ticket, acceptProxyTickets )
+        if entry is None:
+            return self._failure( 'INVALID_TICKET',
+                                  'Ticket %s not recognized' % ticket,
+                                  format )
+
+        user, attributes, proxies, grant = entry
+        attributes = self._attributes( attributes )
+        pgtIou = None
+        if grant and query.get( 'pgtUrl' ):
+            pgtIou = self._grantPgt( user, query['pgtUrl'] )
+
+        if format == 'JSON':
+            success = { 'user': user, 'attributes': attributes }
+            if pgtIou:
+                success['proxyGrantingTicket'] = pgtIou
+            if proxies:
+                success['proxies'] = proxies
+
+            return json.dumps( {'serviceResponse':
+                                {'authenticationSuccess': success}} )
+
+        xml = [ "<cas:serviceResponse xmlns:cas='%s'>" % CAS_NS,
+                '<cas:authenticationSuccess>',
+                '<cas:user>%s</cas:user>' % escape( user ) ]
+        if attributes:
+            xml.append( '<cas:attributes>' )
+            for name, values in sorted( attributes.items() ):
+                if not isinstance( values, list ):
+                    values = [ values ]
+
+                for value in values:
+                    xml.append( '<cas:%s>%s</cas:%s>' % ( name,
+                                                         escape(value),
+                                                         name ) )
+            xml.append( '</cas:attributes>' )
+        if pgtIou:
+            xml.append( '<cas:proxyGrantingTicket>%s'
+                        '</cas:proxyGrantingTicket>' % pgtIou )
+        if proxies:
+            xml.append( '<cas:proxies>' )
+            for proxy in proxies:
+                xml.append( '<cas:proxy>%s</cas:proxy>' % escape(proxy) )
+            xml.append( '</cas:proxies>' )
+        xml.append( '</cas:authenticationSuccess></cas:serviceResponse>' )
+        return '\n'.join( xml )
+
+    def proxy( self, query ):
+        self._lock.acquire()
+        try:
+            entry = self._pgts.get( query.get('pgt') )
+        finally:
+            self._lock.release()
+
+        if entry is None:
+            return "<cas:serviceResponse xmlns:cas='%s'>" \
+                   "<cas:proxyFailure code='INVALID_TICKET'>" \
+                   "pgt not recognized</cas:proxyFailure>" \
+                   "</cas:serviceResponse>" % CAS_NS
+
+        user, pgtUrl = entry
+        ticket = self.issueTicket( user, proxies=[pgtUrl], pgt=False )
+        return "<cas:serviceResponse xmlns:cas='%s'><cas:proxySuccess>" \
+               "<cas:proxyTicket>%s</cas:proxyTicket></cas:proxySuccess>" \
+               "</cas:serviceResponse>" % ( CAS_NS, ticket )
+
+    def samlValidate( self, body ):
+        try:
+            ticket = fromstring( body ).findtext(
+                './/{%s}AssertionArtifact' % SAMLP_NS )
+        except SyntaxError:
+            ticket = None
+
+        entry = self._takeTicket( ticket, False )
+        if entry is None:
+            return SAML_RESPONSE % { 'status': 'saml1p:RequestDenied',
+                                     'assertion': '' }
+
+        user, attributes, proxies, grant = entry
+        now = time.time()
+        values = []
+        for name, value in sorted( self._attributes(attributes).items() ):
+            if not isinstance( value, list ):
+                value = [ value ]
+
+            values.append(
+                '<saml1:Attribute AttributeName="%s" AttributeNamespace='
+                '"http://www.ja-sig.org/products/cas/">%s</saml1:Attribute>'
+                % ( name, ''.join(['<saml1:AttributeValue>%s'
+                                   '</saml1:AttributeValue>' % escape(v)
+                                   for v in value]) ) )
+
+        assertion = SAML_ASSERTION % {
+            'user': escape( user ),
+            'attributes': ''.join( values ),
+            'notBefore': _samlDate( now - 30 ),
+            'notOnOrAfter': _samlDate( now + 30 ),
+            'instant': _samlDate( now ) }
+        return SAML_RESPONSE % { 'status': 'saml1p:Success',
+                                 'assertion': assertion }
+
+    def _failure( self, code, message, format ):
+        if format == 'JSON':
+            return json.dumps( {'serviceResponse': {'authenticationFailure':
+                                {'code': code, 'description': message}}} )
+
+        return "<cas:serviceResponse xmlns:cas='%s'>" \
+               "<cas:authenticationFailure code='%s'>%s" \
+               "</cas:authenticationFailure></cas:serviceResponse>" % \
+               ( CAS_NS, code, escape(message) )
+
+    def respond( self, handler, method, path, query, body ):
+        ''' Return the ( status, headers, body ) of a request. '''
+        route = self.routes.get( path )
+        if route is not None:
+            return route( handler )
+
+        if not path.startswith( '/cas/' ):
+            return 404, {}, 'Not found'
+
+        name = path[len( '/cas/' ):]
+        if name == 'validate':
+            return 200, {}, self.validate( query )
+        if name == 'serviceValidate':
+            return 200, {}, self.serviceValidate( query )
+        if name == 'proxyValidate':
+            return 200, {}, self.serviceValidate( query, True )
+        if name in ( 'p3/serviceValidate', 'p3/proxyValidate' ):
+            format = query.get( 'format', 'XML' ).upper()
+            return 200, {}, self.serviceValidate(
+                query, name == 'p3/proxyValidate', format )
+        if name == 'proxy':
+            return 200, {}, self.proxy( query )
+        if name == 'samlValidate' and method == 'POST':
+            return 200, {'Content-Type': 'text/xml'}, \
+                   self.samlValidate( body )
+        if name == 'login':
+            return 200, {'Content-Type': 'text/html'}, '<html>login</html>'
+
+        return 404, {}, 'Not found'
+
+class _Server( ThreadingMixIn, HTTPServer ):
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__( self, cas ):
+        self.cas = cas
+        if ':' in cas.host:
+            self.address_family = socket.AF_INET6
+
+        HTTPServer.__init__( self, (cas.host, 0), _Handler )
+
+    def handle_error( self, request, clientAddress ):
+        # clients giving up on a response are expected
+        pass
+
+class _Handler( BaseHTTPRequestHandler ):
+
+    # keep connections alive between requests
+    protocol_version = 'HTTP/1.1'
+
+    # send each response in one go, small writes would wait for the
+    # delayed ACK of the client
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def setup( self ):
+        BaseHTTPRequestHandler.setup( self )
+        cas = self.server.cas
+        cas._lock.acquire()
+        try:
+            cas.connections += 1
+        finally:
+            cas._lock.release()
+
+    def do_GET( self ):
+        self._handle( 'GET', None )
+
+    def do_POST( self ):
+        length = int( self.headers.get('Content-Length') or 0 )
+        self._handle( 'POST', self.rfile.read(length) )
+
+    def _handle( self, method, body ):
+        cas = self.server.cas
+        parts = urlsplit( self.path )
+        query = dict( [ (name, values[0]) for name, values in
+                        parse_qs(parts.query).items() ] )
+        cas.requests.append( (method, self.path) )
+        if cas.latency:
+            time.sleep( cas.latency )
+
+        response = cas.respond( self, method, parts.path, query, body )
+        if response is None:
+            self.wfile.flush()
+            return
+
+        status, headers, body = response
+        self.send_response( status )
+        headers = dict( headers )
+        headers.setdefault( 'Content-Type', 'text/plain' )
+        headers['Content-Length'] = str( len(body) )
+        for name, value in headers.items():
+            self.send_header( name, value )
+        self.end_headers()
+        self.wfile.write( body )
+        self.wfile.flush()
+
+    def log_message( self, *args ):
+        pass
+
+def _callBack( pgtUrl, pgtIou, pgt ):
+    separator = '?' in pgtUrl and '&' or '?'
+    urllib2.urlopen( pgtUrl + separator +
+                     urlencode({'pgtIou': pgtIou, 'pgtId': pgt}),
+                     timeout=5 ).read()
+
+def _samlDate( seconds ):
+    return time.strftime( '%Y-%m-%dT%H:%M:%S.000Z', time.gmtime(seconds) )
+
+SAML_RESPONSE = '''<SOAP-ENV:Envelope xmlns:SOAP-ENV="http://schemas.xmlsoap.org/soap/envelope/"><SOAP-ENV:Header/><SOAP-ENV:Body><saml1p:Response xmlns:saml1p="urn:oasis:names:tc:SAML:1.0:protocol" IssueInstant="2008-12-10T14:12:14.817Z" MajorVersion="1" MinorVersion="1" ResponseID="_fakecas"><saml1p:Status><saml1p:StatusCode Value="%(status)s"/></saml1p:Status>%(assertion)s</saml1p:Response></SOAP-ENV:Body></SOAP-ENV:Envelope>'''
+
+SAML_ASSERTION = '''<saml1:Assertion xmlns:saml1="urn:oasis:names:tc:SAML:1.0:assertion" AssertionID="_fakecas" IssueInstant="%(instant)s" Issuer="localhost" MajorVersion="1" MinorVersion="1"><saml1:Conditions NotBefore="%(notBefore)s" NotOnOrAfter="%(notOnOrAfter)s"><saml1:AudienceRestrictionCondition><saml1:Audience>https://service</saml1:Audience></saml1:AudienceRestrictionCondition></saml1:Conditions><saml1:AttributeStatement><saml1:Subject><saml1:NameIdentifier>%(user)s</saml1:NameIdentifier></saml1:Subject>%(attributes)s</saml1:AttributeStatement><saml1:AuthenticationStatement AuthenticationInstant="%(instant)s" AuthenticationMethod="urn:oasis:names:tc:SAML:1.0:am:password"><saml1:Subject><saml1:NameIdentifier>%(user)s</saml1:NameIdentifier></saml1:Subject></saml1:AuthenticationStatement></saml1:Assertion>'''
@@ -0,0 +1,111 @@
+
+# python
+import cPickle
+import unittest
+
+from anz.casclient.assertion import Assertion
+from anz.casclient.principal import Principal, _restorePrincipal
+from anz.casclient.proxyretriever import Cas20ProxyRetriever
+
+CAS = 'https://cas.example.com/cas'
+PGT = 'PGT-1-' + 'x' * 40
+
+class OldRetriever( object ):
+    pass
+
+class OldPrincipal( object ):
+    pass
+
+class OldAssertion( object ):
+    pass
+
+class OldReduce( object ):
+    ''' Pickles as Principal.__reduce__ did before the pool key. '''
+
+    def __init__( self, args ):
+        self.args = args
+
+    def __reduce__( self ):
+        return _restorePrincipal, self.args
+
+def oldPickle( pgt=PGT, principalOnly=False ):
+    ''' Pickle an assertion (or its principal) the way versions without
+    __slots__ did: plain objects and their __dict__.
+
+    '''
+    retriever = OldRetriever()
+    retriever.__dict__.update( casServerUrl=CAS, connectTimeout=None,
+                               readTimeout=None )
+    principal = OldPrincipal()
+    principal.__dict__.update( id='bob', pgt=pgt,
+                               proxyRetriever=pgt and retriever or None,
+                               attributes={} )
+    assertion = OldAssertion()
+    assertion.__dict__.update( principal=principal )
+
+    data = cPickle.dumps( principalOnly and principal or assertion, 1 )
+    for old, new in ( ('OldRetriever', 'proxyretriever\nCas20ProxyRetriever'),
+                      ('OldPrincipal', 'principal\nPrincipal'),
+                      ('OldAssertion', 'assertion\nAssertion') ):
+        data = data.replace( 'anz.casclient.tests.test_assertion\n' + old,
+                             'anz.casclient.' + new )
+
+    return data
+
+def newAssertion( pgt=PGT ):
+    retriever = pgt and Cas20ProxyRetriever( CAS, poolKey='/plone/cas' ) \
+                or None
+    return Assertion( Principal('bob', pgt, retriever) )
+
+class PickleTests( unittest.TestCase ):
+
+    def test_round_trip( self ):
+        assertion = newAssertion()
+        assertion.getPrincipal().attributes['mail'] = 'bob@example.com'
+        loaded = cPickle.loads( cPickle.dumps(assertion, 1) )
+
+        principal = loaded.getPrincipal()
+        self.assertEqual( principal.getId(), 'bob' )
+        self.assertEqual( principal.pgt, PGT )
+        self.assertEqual( principal.getAttributes(),
+                          {'mail': 'bob@example.com'} )
+        self.assertEqual( principal.proxyRetriever.casServerUrl, CAS )
+        self.assertEqual( principal.proxyRetriever.poolKey, '/plone/cas' )
+        self.assertEqual( loaded.getValidFromDate(),
+                          assertion.getValidFromDate() )
+
+    def test_no_dict( self ):
+        assertion = newAssertion()
+        self.assertFalse( hasattr(assertion, '__dict__') )
+        self.assertFalse( hasattr(assertion.getPrincipal(), '__dict__') )
+
+    def test_loads_principals_pickled_without_pool_key( self ):
+        data = cPickle.dumps( OldReduce(('bob', PGT, (CAS, None, None),
+                                         None)), 1 )
+        retriever = cPickle.loads( data ).proxyRetriever
+        self.assertEqual( retriever.casServerUrl, CAS )
+        self.assertEqual( retriever.poolKey, None )
+
+    def test_loads_assertions_pickled_before_slots( self ):
+        loaded = cPickle.loads( oldPickle() )
+        principal = loaded.getPrincipal()
+        self.assertEqual( principal.getId(), 'bob' )
+        self.assertEqual( principal.pgt, PGT )
+        self.assertEqual( principal.getAttributes(), {} )
+        self.assertEqual( principal.proxyRetriever.casServerUrl, CAS )
+        self.assertTrue( loaded.isValid() )
+
+    def test_pickle_size( self ):
+        for pgt in ( PGT, None ):
+            # the principal is less than half its former size
+            old = len( oldPickle(pgt, principalOnly=True) )
+            new = len( cPickle.dumps(newAssertion(pgt).getPrincipal(), 1) )
+            self.assertTrue( new * 2 < old, (pgt, old, new) )
+
+            # even though assertions now carry their validity dates
+            old = len( oldPickle(pgt) )
+            new = len( cPickle.dumps(newAssertion(pgt), 1) )
+            self.assertTrue( new < old, (pgt, old, new) )
+
+def test_suite():
+    return unittest.defaultTestLoader.loadTestsFromName( __name__ )
@@ -0,0 +1,164 @@
+
+# python
+import socket
+import threading
+import time
+import unittest
+
+from anz.casclient.asynctransport import AsyncTransport
+from anz.casclient.exceptions import ConnectionException
+from anz.casclient.tests.fakecas import FakeCASServer
+
+def _ipv6():
+    if not socket.has_ipv6:
+        return False
+
+    try:
+        sock = socket.socket( socket.AF_INET6, socket.SOCK_STREAM )
+        sock.bind( ('::1', 0) )
+        sock.close()
+    except socket.error:
+        return False
+
+    return True
+
+class AsyncTransportTests( unittest.TestCase ):
+
+    def setUp( self ):
+        self.cas = FakeCASServer().start()
+        self.transport = AsyncTransport()
+
+    def tearDown( self ):
+        self.cas.stop()
+
+    def _path( self, path ):
+        return self.cas.url[:-len( '/cas' )] + path
+
+    def _validate( self, cas ):
+        ticket = cas.issueTicket( 'bob' )
+        return self.transport.request(
+            '%s/validate?ticket=%s&service=x' % (cas.url, ticket) )
+
+    def test_request( self ):
+        self.assertEqual( self._validate(self.cas), 'yes\nbob\n' )
+
+    def test_concurrent_requests_share_one_thread( self ):
+        self.cas.latency = 0.5
+        results = []
+
+        def validate():
+            results.append( self._validate(self.cas) )
+
+        before = threading.enumerate()
+        start = time.time()
+        callers = [ threading.Thread(target=validate) for i in range(40) ]
+        for caller in callers:
+            caller.start()
+        for caller in callers:
+            caller.join()
+
+        self.assertEqual( results, ['yes\nbob\n'] * 40 )
+        # 20 seconds if the requests were sent one after the other
+        self.assertTrue( time.time() - start < 5 )
+        started = [ t for t in threading.enumerate()
+                    if t.name.startswith( 'anz.casclient' ) and
+                    t not in before ]
+        self.assertEqual( started, [self.transport._thread] )
+
+    def test_keeps_connections_alive( self ):
+        for i in range( 5 ):
+            self.assertEqual( self._validate(self.cas), 'yes\nbob\n' )
+
+        self.assertEqual( self.cas.connections, 1 )
+
+        # the server asks to close it
+        self.cas.routes['/close'] = lambda h: (
+            200, {'Connection': 'close'}, 'closed' )
+        self.assertEqual( self.transport.request(self._path('/close')),
+                          'closed' )
+        self.assertEqual( self._validate(self.cas), 'yes\nbob\n' )
+        self.assertEqual( self.cas.connections, 2 )
+
+    def test_chunked_response( self ):
+        def chunked( handler ):
+            handler.send_response( 200 )
+            handler.send_header( 'Transfer-Encoding', 'chunked' )
+            handler.end_headers()
+            handler.wfile.write( '4\r\nyes\n\r\n4;x=y\r\nbob\n\r\n'
+                                 '0\r\n\r\n' )
+        self.cas.routes['/chunked'] = chunked
+
+        for i in range( 2 ):
+            self.assertEqual( self.transport.request(self._path('/chunked')),
+                              'yes\nbob\n' )
+        self.assertEqual( self.cas.connections, 1 )
+
+    def test_tries_each_address( self ):
+        closed = socket.socket()
+        closed.bind( ('127.0.0.1', 0) )
+        port = int( self.cas.url.split(':')[2].split('/')[0] )
+        self.transport._addresses[('localhost', port)] = (
+            [(socket.AF_INET, closed.getsockname()),
+             (socket.AF_INET, ('127.0.0.1', port))], time.time() + 60 )
+        closed.close()
+
+        ticket = self.cas.issueTicket( 'bob' )
+        self.assertEqual( self.transport.request(
+            'http://localhost:%d/cas/validate?ticket=%s&service=x' %
+            (port, ticket)), 'yes\nbob\n' )
+
+    def test_resolves_outside_the_event_loop( self ):
+        threads = []
+        getaddrinfo = socket.getaddrinfo
+
+        def recordingGetaddrinfo( *args ):
+            threads.append( threading.currentThread() )
+            return getaddrinfo( *args )
+        socket.getaddrinfo = recordingGetaddrinfo
+        try:
+            self.transport.request( self.cas.url.replace('127.0.0.1',
+                                                         'localhost') +
+                                    '/login' )
+        finally:
+            socket.getaddrinfo = getaddrinfo
+
+        self.assertTrue( threads )
+        self.assertFalse( self.transport._thread in threads )
+        self.assertFalse( threading.currentThread() in threads )
+
+    def test_ipv6( self ):
+        if not _ipv6():
+            return
+
+        cas = FakeCASServer( host='::1' ).start()
+        try:
+            self.assertEqual( self._validate(cas), 'yes\nbob\n' )
+        finally:
+            cas.stop()
+
+    def test_follows_redirects_of_get( self ):
+        ticket = self.cas.issueTicket( 'bob' )
+        target = '/cas/validate?ticket=%s&service=x' % ticket
+        self.cas.routes['/moved'] = lambda h: ( 302, {'Location': target},
+                                                '' )
+        self.assertEqual( self.transport.request(self._path('/moved')),
+                          'yes\nbob\n' )
+
+    def test_redirects( self ):
+        self.cas.routes['/loop'] = lambda h: ( 302, {'Location': '/loop'},
+                                               '' )
+        self.assertRaises( ConnectionException, self.transport.request,
+                           self._path('/loop') )
+
+        # a 302 would turn the POST into a GET
+        self.cas.routes['/found'] = lambda h: (
+            302, {'Location': '/cas/samlValidate'}, '' )
+        self.assertRaises( ConnectionException, self.transport.request,
+                           self._path('/found'), '<x/>' )
+
+    def test_http_error( self ):
+        self.assertRaises( ConnectionException, self.transport.request,
+                           self._path('/nowhere') )
+
+def test_suite():
+    return unittest.defaultTestLoader.loadTestsFromName( __name__ )
@@ -0,0 +1,62 @@
+
+# python
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from StringIO import StringIO
+
+from anz.casclient.tests.benchmark import main, percentile, compare
+
+class BenchmarkTests( unittest.TestCase ):
+    ''' The benchmark runner keeps working, figures are not checked. '''
+
+    def setUp( self ):
+        self.directory = tempfile.mkdtemp()
+        self.baseline = os.path.join( self.directory, 'baseline.json' )
+
+    def tearDown( self ):
+        shutil.rmtree( self.directory )
+
+    def test_save_and_compare( self ):
+        out = StringIO()
+        args = [ '-n', '5', '-l', '50', '--sizes', '100' ]
+        self.assertEqual( main(args + ['--save', self.baseline], out), 0 )
+
+        results = json.load( open(self.baseline) )['results']
+        for name in ( 'extract.login', 'extract.login_pgt',
+                      'extract.session', 'extract.cookie', 'validate.cas10',
+                      'validate.cas20', 'validate.cas20_proxy',
+                      'validate.cas30', 'validate.cas30_json',
+                      'validate.cas30_proxy', 'validate.saml11',
+                      'proxy.cas20', 'storage.pgt.zodb.100',
+                      'storage.pgt.file.100', 'storage.session.volatile.100' ):
+            self.assertEqual( results[name]['count'],
+                              name.startswith('storage') and 50 or 5 )
+            self.assertTrue( results[name]['p50'] <= results[name]['p99'] )
+
+        out = StringIO()
+        self.assertEqual( main(args + ['-k', 'cas30', '--compare',
+                                       self.baseline, '--tolerance',
+                                       '1000000'], out), 0 )
+        self.assertEqual( len(out.getvalue().splitlines()), 4 )
+
+    def test_compare( self ):
+        baseline = { 'throughput': 100.0, 'p90': 0.010 }
+        self.assertFalse( compare({'throughput': 95.0, 'p90': 0.0105},
+                                  baseline, 0.1)[2] )
+        self.assertTrue( compare({'throughput': 80.0, 'p90': 0.010},
+                                 baseline, 0.1)[2] )
+        self.assertTrue( compare({'throughput': 100.0, 'p90': 0.020},
+                                 baseline, 0.1)[2] )
+
+    def test_percentile( self ):
+        samples = range( 1, 101 )
+        self.assertEqual( percentile(samples, 50), 50 )
+        self.assertEqual( percentile(samples, 99), 99 )
+        self.assertEqual( percentile([7], 90), 7 )
+        self.assertEqual( percentile([], 90), 0.0 )
+
+def test_suite():
+    return unittest.defaultTestLoader.loadTestsFromName( __name__ )
@@ -0,0 +1,253 @@
+
+# python
+import os
+import shutil
+import tempfile
+import unittest
+
+from anz.casclient.casclient import AnzCASClient
+from anz.casclient.storage import getPluginKey
+from anz.casclient.metrics import getMetrics, renderSamples
+from anz.casclient.proxyticketpool import getProxyTicketPool
+from anz.casclient.singlesignout import getLogoutQueue
+from anz.casclient.transport import getTransport
+from anz.casclient.asynctransport import getAsyncTransport
+from anz.casclient.endpoints import getEndpointGroup, \
+     configureEndpointGroup
+
+class FakeResponse( object ):
+
+    def __init__( self ):
+        self.cookies = {}
+
+    def setCookie( self, name, value, **kw ):
+        self.cookies[name] = value
+
+    def expireCookie( self, name, **kw ):
+        self.cookies.pop( name, None )
+
+    def redirect( self, url, lock=0 ):
+        self.location = url
+
+class FakeRequest( dict ):
+    ''' Just what the plugin reads from a request. '''
+
+    def __init__( self, form=None, cookies=None ):
+        self.form = form or {}
+        self.cookies = cookies or {}
+        self.other = {}
+        self.response = FakeResponse()
+        self['SERVER_URL'] = 'https://service'
+
+    def __getattr__( self, name ):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError( name )
+
+LOGOUT = '''<samlp:LogoutRequest
+  xmlns:samlp="urn:oasis:names:tc:SAML:2.0:protocol">
+  <samlp:SessionIndex>ST-1</samlp:SessionIndex>
+</samlp:LogoutRequest>'''
+
+class SessionDataManager( object ):
+    ''' Just what the plugin reads from the session data manager. '''
+
+    def __init__( self ):
+        self.sessions = { 'session-1': {'logged in': True} }
+
+    def getSessionDataByKey( self, key ):
+        return self.sessions.get( key )
+
+def newPlugin( id='cas', **properties ):
+    plugin = AnzCASClient( id, id )
+    plugin.casServerUrlPrefix = 'http://cas.example.com/cas'
+    for name, value in properties.items():
+        plugin._updateProperty( name, value )
+
+    return plugin
+
+class BackChannelTests( unittest.TestCase ):
+    ''' The process wide back-channel helpers are configured once per
+    plugin, not on each request.
+
+    '''
+
+    def test_configured_once( self ):
+        plugin = newPlugin( useSignedCookie=True )
+        calls = []
+        configure = plugin._configureBackChannel
+        plugin._configureBackChannel = lambda: calls.append( configure() )
+
+        for i in range( 3 ):
+            self.assertEqual( plugin.extractCredentials(FakeRequest()),
+                              None )
+        self.assertEqual( len(calls), 1 )
+
+        plugin._updateProperty( 'proxyTicketPoolSize', 3 )
+        plugin.extractCredentials( FakeRequest() )
+        self.assertEqual( len(calls), 2 )
+
+    def test_cookie_mode_configures( self ):
+        # no ticket validated, as after a restart with a valid cookie
+        plugin = newPlugin( 'cookie', useSignedCookie=True,
+                            proxyTicketPoolSize=2 )
+        plugin.extractCredentials( FakeRequest() )
+        self.assertNotEqual( getProxyTicketPool(getPluginKey(plugin)),
+                             None )
+
+    def test_pools_per_plugin( self ):
+        # two plugins for the same CAS server with different settings
+        first = newPlugin( 'first', useSignedCookie=True,
+                           proxyTicketPoolSize=2 )
+        second = newPlugin( 'second', useSignedCookie=True,
+                            proxyTicketPoolSize=5 )
+        first.extractCredentials( FakeRequest() )
+        second.extractCredentials( FakeRequest() )
+        pools = ( getProxyTicketPool(getPluginKey(first)),
+                  getProxyTicketPool(getPluginKey(second)) )
+
+        for i in range( 3 ):
+            first._configureBackChannel()
+            second._configureBackChannel()
+
+        self.assertEqual( pools[0].size, 2 )
+        self.assertEqual( pools[1].size, 5 )
+        self.assertTrue( getProxyTicketPool(getPluginKey(first)) is
+                         pools[0] )
+        self.assertTrue( getProxyTicketPool(getPluginKey(second)) is
+                         pools[1] )
+
+    def test_validators_use_the_pool_of_their_plugin( self ):
+        plugin = newPlugin( 'validators' )
+        self.assertEqual( plugin._getValidator('service').poolKey,
+                          getPluginKey(plugin) )
+
+    def test_broken_spool_does_not_break_authentication( self ):
+        base = tempfile.mkdtemp()
+        try:
+            blocker = os.path.join( base, 'file' )
+            open( blocker, 'w' ).close()
+            plugin = newPlugin( 'spool', useSignedCookie=True,
+                                sloSpoolDirectory=os.path.join(blocker,
+                                                               'spool') )
+            self.assertEqual( plugin.extractCredentials(FakeRequest()),
+                              None )
+        finally:
+            shutil.rmtree( base )
+
+    def test_transport_configured( self ):
+        try:
+            plugin = newPlugin( 'pool', connectionPoolSize=3,
+                                maxConnectionsPerHost=4,
+                                connectionIdleTimeout=5 )
+            plugin._configureBackChannel()
+            transport = getTransport()
+            self.assertEqual( (transport.poolSize, transport.maxPerHost,
+                               transport.idleTimeout), (3, 4, 5) )
+            self.assertEqual( (getAsyncTransport().poolSize,
+                               getAsyncTransport().idleTimeout), (3, 5) )
+
+            # the pooled connections are kept when nothing changed
+            plugin._configureBackChannel()
+            self.assertTrue( getTransport() is transport )
+        finally:
+            newPlugin( 'default' )._configureBackChannel()
+
+        self.assertEqual( getTransport().poolSize, 10 )
+
+    def test_broken_spool_does_not_break_logout( self ):
+        base = tempfile.mkdtemp()
+        try:
+            blocker = os.path.join( base, 'file' )
+            open( blocker, 'w' ).close()
+            plugin = newPlugin( 'spoollogout', storageBackend='volatile',
+                                sloSpoolDirectory=os.path.join(blocker,
+                                                               'spool') )
+            plugin.session_data_manager = SessionDataManager()
+            session = plugin.session_data_manager.sessions['session-1']
+            plugin._getSessionStorage().addSession( 'ST-1', 'session-1' )
+            plugin.REQUEST = FakeRequest( form={'logoutRequest': LOGOUT} )
+
+            self.assertEqual( plugin._logoutCallback(), 'Logout seccess.' )
+            self.assertEqual( session, {} )
+        finally:
+            shutil.rmtree( base )
+
+    def test_logout_queue_configured_once( self ):
+        queue = getLogoutQueue()
+        batchSize = queue.batchSize
+        try:
+            plugin = newPlugin( 'batch', asyncSingleSignOut=True,
+                                singleSignOutBatchSize=7 )
+            plugin._configureBackChannel()
+            self.assertEqual( queue.batchSize, 7 )
+        finally:
+            queue.batchSize = batchSize
+
+    def test_endpoint_group_kept( self ):
+        url = 'http://group.example.com/cas'
+        nodes = [ 'http://node1/cas', 'http://node2/cas' ]
+        group = configureEndpointGroup( url, nodes, 10 )
+        group.endpoints[0].healthy = False
+        try:
+            self.assertTrue( configureEndpointGroup(url, nodes, 20) is group )
+            self.assertEqual( group.probeInterval, 20 )
+            self.assertFalse( group.endpoints[0].healthy )
+        finally:
+            configureEndpointGroup( url, [] )
+
+        self.assertEqual( getEndpointGroup(url), None )
+
+class MetricsTests( unittest.TestCase ):
+
+    def tearDown( self ):
+        getMetrics().setEnabled( getPluginKey(self.on), False )
+
+    def test_enabled_while_one_plugin_collects( self ):
+        self.on = newPlugin( 'on', useSignedCookie=True,
+                             collectMetrics=True )
+        off = newPlugin( 'off', useSignedCookie=True )
+        for plugin in ( self.on, off, self.on, off ):
+            plugin._v_backChannel = False
+            plugin.extractCredentials( FakeRequest() )
+            self.assertTrue( getMetrics().enabled )
+
+        self.on._updateProperty( 'collectMetrics', False )
+        self.on.extractCredentials( FakeRequest() )
+        self.assertFalse( getMetrics().enabled )
+
+class StateMetricsTests( unittest.TestCase ):
+    ''' The state of the back-channel helpers is exported with the
+    metrics.
+
+    '''
+
+    def test_samples( self ):
+        plugin = newPlugin( 'state', cacheProxyTicketValidation=True )
+        output = renderSamples( plugin.getStateSamples() )
+        for line in ( '# TYPE anz_casclient_circuit_state gauge',
+                      'anz_casclient_circuit_state{state="closed"} 1',
+                      'anz_casclient_circuit_state{state="open"} 0',
+                      'anz_casclient_circuit_rejected_total 0',
+                      'anz_casclient_proxy_ticket_cache_hits_total 0',
+                      'anz_casclient_slo_queue_depth 0' ):
+            self.assertTrue( line in output.splitlines(), line )
+
+        plugin._updateProperty( 'cacheProxyTicketValidation', False )
+        self.assertFalse( 'proxy_ticket_cache' in
+                          renderSamples(plugin.getStateSamples()) )
+
+    def test_render_samples( self ):
+        self.assertEqual( renderSamples(
+            [('node_up', 'gauge', {'url': 'http://a/"b"'}, True),
+             ('node_up', 'gauge', {'url': 'http://c'}, False),
+             ('rate', 'gauge', None, 0.5)]),
+            '# TYPE anz_casclient_node_up gauge\n'
+            'anz_casclient_node_up{url="http://a/\\"b\\""} 1\n'
+            'anz_casclient_node_up{url="http://c"} 0\n'
+            '# TYPE anz_casclient_rate gauge\n'
+            'anz_casclient_rate 0.500000\n' )
+
+def test_suite():
+    return unittest.defaultTestLoader.loadTestsFromName( __name__ )
@@ -0,0 +1,85 @@
+
+# python
+import time
+import unittest
+
+from anz.casclient.circuitbreaker import CircuitBreaker, isFailure, \
+     configureCircuitBreaker
+from anz.casclient.endpoints import configureEndpointGroup
+from anz.casclient.exceptions import ConnectionException, \
+     DeadlineExceededException, HTTPErrorException
+from anz.casclient.transport import setDeadline, restoreDeadline
+from anz.casclient.utils import retrieveResponseFromServer
+from anz.casclient.tests.fakecas import FakeCASServer
+
+class IsFailureTests( unittest.TestCase ):
+
+    def test_failures( self ):
+        self.assertTrue( isFailure(ConnectionException('Fail to connect, '
+                                                       'timed out')) )
+        self.assertTrue( isFailure(HTTPErrorException(500)) )
+        self.assertTrue( isFailure(HTTPErrorException(503)) )
+
+    def test_not_failures( self ):
+        self.assertFalse( isFailure(HTTPErrorException(404)) )
+        self.assertFalse( isFailure(HTTPErrorException(400)) )
+        self.assertFalse( isFailure(
+            DeadlineExceededException('Deadline exceeded.')) )
+
+class BreakerTests( unittest.TestCase ):
+
+    def setUp( self ):
+        self.cas = FakeCASServer().start()
+        self.root = self.cas.url[:-len( '/cas' )]
+        self.breaker = configureCircuitBreaker( self.cas.url, 0.5, 4, 30,
+                                                30 )
+        self.breaker.reset()
+
+    def tearDown( self ):
+        configureCircuitBreaker( self.cas.url, 0, 0, 0, 0 )
+        self.cas.stop()
+
+    def _fail( self, url, exception=ConnectionException ):
+        for i in range( 10 ):
+            self.assertRaises( exception, retrieveResponseFromServer, url )
+
+    def test_client_errors_keep_it_closed( self ):
+        self._fail( self.root + '/nowhere', HTTPErrorException )
+        self.assertEqual( self.breaker.getState()['state'], 'closed' )
+        self.assertEqual( self.breaker.getState()['failures'], 0 )
+
+    def test_server_errors_open_it( self ):
+        self.cas.routes['/broken'] = lambda h: ( 500, {}, 'Oops' )
+        self._fail( self.root + '/broken' )
+        self.assertEqual( self.breaker.getState()['state'], 'open' )
+
+    def test_deadline_keeps_it_closed( self ):
+        self.cas.latency = 0.2
+        previous = setDeadline( 0.05 )
+        try:
+            self._fail( self.cas.url + '/login', DeadlineExceededException )
+        finally:
+            restoreDeadline( previous )
+
+        self.assertEqual( self.breaker.getState()['state'], 'closed' )
+        self.assertEqual( self.breaker.getState()['failures'], 0 )
+
+class EndpointGroupTests( unittest.TestCase ):
+
+    def setUp( self ):
+        self.cas = FakeCASServer().start()
+        self.url = 'http://cas.example.com/cas'
+        self.group = configureEndpointGroup( self.url, [self.cas.url], 0 )
+
+    def tearDown( self ):
+        configureEndpointGroup( self.url, [] )
+        self.cas.stop()
+
+    def test_client_error_keeps_node_healthy( self ):
+        self.assertRaises( HTTPErrorException, retrieveResponseFromServer,
+                           self.url + '/nowhere' )
+        self.assertTrue( self.group.endpoints[0].healthy )
+        self.assertEqual( self.group.endpoints[0].failures, 0 )
+
+def test_suite():
+    return unittest.defaultTestLoader.loadTestsFromName( __name__ )
@@ -0,0 +1,130 @@
+
+# python
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+# zope
+import transaction
+from OFS.Application import Application
+from ZODB.DB import DB
+from ZODB.MappingStorage import MappingStorage
+
+from anz.casclient import casclient
+from anz.casclient.proxygrantingticketstorage import PgtRendezvous, \
+     getPgtHandover
+from anz.casclient.tests.fakecas import FakeCASServer
+from anz.casclient.tests.test_casclient import newPlugin
+
+SERVICE = 'https://service'
+
+class SlimCallbackLoadTests( unittest.TestCase ):
+    ''' The slim proxy callback with the 'zodb' storage backend hands the
+    tickets over to validations running on other Zope clients, without
+    writing to the ZODB.
+
+    '''
+
+    THREADS = 8
+    LOGINS = 25
+
+    def setUp( self ):
+        self.directory = tempfile.mkdtemp()
+        self.cas = FakeCASServer().start()
+        self.db = DB( MappingStorage(), pool_size=self.THREADS + 2 )
+        conn = self.db.open()
+        app = conn.root()['Application'] = Application()
+        app._setObject( 'cas', newPlugin(
+            'cas', casServerUrlPrefix=self.cas.url, serviceUrl=SERVICE,
+            ticketValidationSpecification='CAS 2.0',
+            proxyCallbackUrlPrefix=SERVICE, slimProxyCallback=True,
+            storageDirectory=self.directory) )
+        transaction.commit()
+        conn.close()
+
+        # the callback is answered by another Zope client: it does not
+        # share the rendezvous of the validations
+        self._getPgtRendezvous = casclient.getPgtRendezvous
+        other = PgtRendezvous()
+        casclient.getPgtRendezvous = lambda: other
+
+    def tearDown( self ):
+        casclient.getPgtRendezvous = self._getPgtRendezvous
+        self.cas.stop()
+        self.db.close()
+        shutil.rmtree( self.directory )
+
+    def _openPlugin( self ):
+        manager = transaction.TransactionManager()
+        conn = self.db.open( transaction_manager=manager )
+        return conn.root()['Application'].cas
+
+    def test_logins( self ):
+        callbackPlugin = self._openPlugin()
+        lock = threading.Lock()
+
+        def callBack( pgtUrl, pgtIou, pgt ):
+            self.assertTrue( pgtUrl.endswith(
+                '/@@anz-casclient-proxycallback') )
+            # one request at a time, ZODB connections are not thread-safe
+            lock.acquire()
+            try:
+                callbackPlugin._proxyCallback( pgt, pgtIou, False )
+            finally:
+                lock.release()
+
+        self.cas.proxyCallback = callBack
+        lastTransaction = self.db.lastTransaction()
+        pgts = []
+        errors = []
+
+        def login():
+            plugin = self._openPlugin()
+            try:
+                for i in range( self.LOGINS ):
+                    ticket = self.cas.issueTicket( 'bob' )
+                    assertion = plugin.validateServiceTicket( SERVICE,
+                                                              ticket )
+                    pgts.append( assertion.getPrincipal().pgt )
+            except Exception, e:
+                errors.append( e )
+
+            plugin._p_jar.close()
+
+        threads = [ threading.Thread(target=login)
+                    for i in range( self.THREADS ) ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual( errors, [] )
+        self.assertEqual( len(pgts), self.THREADS * self.LOGINS )
+        self.assertFalse( None in pgts )
+        self.assertEqual( len(set( pgts )), len(pgts) )
+
+        # nothing was committed, and the handed over tickets were taken
+        self.assertEqual( self.db.lastTransaction(), lastTransaction )
+        directory = getPgtHandover( callbackPlugin ).directory
+        self.assertEqual( [name for name in os.listdir(directory)
+                           if not name.startswith('.')], [] )
+        callbackPlugin._p_jar.close()
+
+    def test_handover_directory( self ):
+        plugin = newPlugin( 'cas', storageDirectory=self.directory )
+        # single sign out forwarding has nothing to do with it
+        plugin.sloSpoolDirectory = os.path.join( self.directory, 'spool' )
+        self.assertTrue( getPgtHandover(plugin).directory.startswith(
+            os.path.join(self.directory, '')) )
+        self.assertFalse( getPgtHandover(plugin).directory.startswith(
+            plugin.sloSpoolDirectory) )
+
+        plugin.pgtHandoverDirectory = os.path.join( self.directory,
+                                                    'handover' )
+        self.assertTrue( getPgtHandover(plugin).directory.startswith(
+            os.path.join(plugin.pgtHandoverDirectory, '')) )
+
+def test_suite():
+    return unittest.defaultTestLoader.loadTestsFromName( __name__ )
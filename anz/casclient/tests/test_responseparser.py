@@ -0,0 +1,136 @@
+
+# python
+import unittest
+from xml.dom import minidom
+
+from anz.casclient import validationspecification
+from anz.casclient.responseparser import parseCas20Response, \
+     parseCas30JsonResponse
+from anz.casclient.proxygrantingticketstorage import \
+     VolatileProxyGrantingTicketStorage
+from anz.casclient.validationspecification import \
+     Cas20ProxyTicketValidator
+from anz.casclient.exceptions import InvalidProxyChainException
+from anz.casclient.tests.fakecas import FakeCASServer, CAS_NS
+
+def _minidomParse( response ):
+    # what the validators did before the single pass parser
+    dom = minidom.parseString( response )
+    user = dom.getElementsByTagNameNS( CAS_NS, 'user' )
+    attributes = {}
+    for node in dom.getElementsByTagNameNS( CAS_NS, 'attributes' ):
+        for child in node.childNodes:
+            if child.nodeType == child.ELEMENT_NODE:
+                attributes.setdefault( child.localName, [] ).append(
+                    child.firstChild and child.firstChild.data or '' )
+    proxies = [ node.firstChild.data for node in
+                dom.getElementsByTagNameNS(CAS_NS, 'proxy') ]
+    return user[0].firstChild.data, attributes, proxies
+
+class ResponseParserTests( unittest.TestCase ):
+
+    def _response( self, cas, attributes=None, proxies=(), format='XML' ):
+        ticket = cas.issueTicket( 'bob', attributes, proxies )
+        return cas.serviceValidate( {'ticket': ticket}, True, format )
+
+    def test_success( self ):
+        cas = FakeCASServer()
+        result = parseCas20Response( self._response(
+            cas, {'mail': 'bob@example.com', 'groups': ['a', 'b']},
+            ['https://proxy2/cb', 'https://proxy1/cb']) )
+        self.assertEqual( result.user, 'bob' )
+        self.assertEqual( result.getAttributes(),
+                          {'mail': 'bob@example.com', 'groups': ['a', 'b']} )
+        self.assertEqual( result.proxies,
+                          ['https://proxy2/cb', 'https://proxy1/cb'] )
+        self.assertEqual( result.failureCode, None )
+
+    def test_failure( self ):
+        cas = FakeCASServer()
+        result = parseCas20Response(
+            cas.serviceValidate({'ticket': 'ST-unknown'}) )
+        self.assertEqual( result.user, None )
+        self.assertEqual( result.failureCode, 'INVALID_TICKET' )
+        self.assertEqual( result.failureMessage,
+                          'Ticket ST-unknown not recognized' )
+
+    def test_proxy_response( self ):
+        result = parseCas20Response(
+            "<cas:serviceResponse xmlns:cas='%s'><cas:proxySuccess>"
+            "<cas:proxyTicket>PT-1</cas:proxyTicket></cas:proxySuccess>"
+            "</cas:serviceResponse>" % CAS_NS )
+        self.assertEqual( result.proxyTicket, 'PT-1' )
+
+    def test_large_attribute_payloads( self ):
+        # a 1MB attribute and 500 multi-valued attributes
+        cas = FakeCASServer( payloadSize=1024*1024 )
+        attributes = dict( [ ('attr%d' % i, ['value%d' % i, 'other%d' % i])
+                             for i in range(500) ] )
+        response = self._response( cas, attributes,
+                                   ['https://proxy/cb'] * 20 )
+        result = parseCas20Response( response )
+
+        self.assertEqual( len(result.attributes), 501 )
+        self.assertEqual( result.attributes['payload'],
+                          ['x' * 1024 * 1024] )
+        self.assertEqual( result.attributes['attr499'],
+                          ['value499', 'other499'] )
+        self.assertEqual( len(result.proxies), 20 )
+
+        # same result as the DOM parse it replaces
+        user, domAttributes, proxies = _minidomParse( response )
+        self.assertEqual( ( user, domAttributes, proxies ),
+                          ( result.user, result.attributes, result.proxies ) )
+
+    def test_json_matches_xml( self ):
+        cas = FakeCASServer()
+        attributes = {'mail': 'bob@example.com', 'groups': ['a', 'b']}
+        proxies = ['https://proxy/cb']
+        xml = parseCas20Response( self._response(cas, attributes, proxies) )
+        json = parseCas30JsonResponse(
+            self._response(cas, attributes, proxies, 'JSON') )
+        for name in ( 'user', 'attributes', 'proxies', 'pgtIou' ):
+            self.assertEqual( getattr(xml, name), getattr(json, name) )
+
+class ProxyValidationTests( unittest.TestCase ):
+
+    def setUp( self ):
+        self.cas = FakeCASServer().start()
+        self.parses = []
+        self._parse = validationspecification.parseCas20Response
+
+        def countingParse( response ):
+            self.parses.append( len(response) )
+            return self._parse( response )
+        validationspecification.parseCas20Response = countingParse
+
+    def tearDown( self ):
+        validationspecification.parseCas20Response = self._parse
+        self.cas.stop()
+
+    def _validator( self, **kw ):
+        return Cas20ProxyTicketValidator(
+            self.cas.url, VolatileProxyGrantingTicketStorage(), **kw )
+
+    def test_response_parsed_once( self ):
+        ticket = self.cas.issueTicket( 'bob', {'mail': 'bob@example.com'},
+                                       ['https://proxy/cb'] )
+        assertion = self._validator().validate( ticket, 'https://service' )
+        self.assertEqual( assertion.getPrincipal().getId(), 'bob' )
+        self.assertEqual( len(self.parses), 1 )
+
+    def test_proxy_chain_from_the_same_parse( self ):
+        validator = self._validator(
+            acceptAnyProxy=False,
+            allowedProxyChains=['https://proxy2/cb https://proxy1/cb'] )
+        ticket = self.cas.issueTicket(
+            'bob', proxies=['https://proxy2/cb', 'https://proxy1/cb'] )
+        validator.validate( ticket, 'https://service' )
+
+        ticket = self.cas.issueTicket( 'bob', proxies=['https://evil/cb'] )
+        self.assertRaises( InvalidProxyChainException, validator.validate,
+                           ticket, 'https://service' )
+        self.assertEqual( len(self.parses), 2 )
+
+def test_suite():
+    return unittest.defaultTestLoader.loadTestsFromName( __name__ )
@@ -0,0 +1,106 @@
+
+# python
+import unittest
+
+from anz.casclient.assertion import Assertion
+from anz.casclient.principal import Principal
+from anz.casclient.proxyretriever import Cas20ProxyRetriever
+from anz.casclient.signedcookie import encodeAssertion, decodeAssertion, \
+     newSecret, dropPgt, _encode, _decode
+from anz.casclient.storage import VolatileMapping
+from anz.casclient.tests.test_casclient import FakeRequest, newPlugin
+
+CAS = 'http://cas.example.com/cas'
+
+def newAssertion( pgt=None ):
+    retriever = pgt and Cas20ProxyRetriever( CAS ) or None
+    return Assertion( Principal('bob', pgt, retriever,
+                                {'mail': 'bob@example.com'}) )
+
+class SignedCookieTests( unittest.TestCase ):
+
+    def setUp( self ):
+        self.secret = newSecret()
+        self.storage = VolatileMapping( 60 )
+
+    def _roundTrip( self, value ):
+        return decodeAssertion( value, self.secret, CAS,
+                                pgtStorage=self.storage )
+
+    def test_round_trip( self ):
+        value = encodeAssertion( newAssertion('PGT-1-secret'), self.secret,
+                                 60, self.storage )
+        principal = self._roundTrip( value ).getPrincipal()
+        self.assertEqual( principal.getId(), 'bob' )
+        self.assertEqual( principal.getAttributes(),
+                          {'mail': 'bob@example.com'} )
+        self.assertEqual( principal.pgt, 'PGT-1-secret' )
+
+    def test_pgt_stays_on_the_server( self ):
+        value = encodeAssertion( newAssertion('PGT-1-secret'), self.secret,
+                                 60, self.storage )
+        self.assertFalse( 'PGT-1-secret' in _decode(value.split('.')[0]) )
+
+        # dropped at logout
+        dropPgt( value, self.secret, self.storage )
+        self.assertEqual( self._roundTrip(value).getPrincipal().pgt, None )
+
+    def test_one_pgt_per_cookie( self ):
+        # two browsers of the same user
+        first = encodeAssertion( newAssertion('PGT-1-first'), self.secret,
+                                 60, self.storage )
+        second = encodeAssertion( newAssertion('PGT-2-second'), self.secret,
+                                  60, self.storage )
+        self.assertEqual( self._roundTrip(first).getPrincipal().pgt,
+                          'PGT-1-first' )
+        self.assertEqual( self._roundTrip(second).getPrincipal().pgt,
+                          'PGT-2-second' )
+
+        # logging out of one keeps the ticket of the other
+        dropPgt( first, self.secret, self.storage )
+        self.assertEqual( self._roundTrip(first).getPrincipal().pgt, None )
+        self.assertEqual( self._roundTrip(second).getPrincipal().pgt,
+                          'PGT-2-second' )
+
+    def test_tampered( self ):
+        value = encodeAssertion( newAssertion(), self.secret, 60 )
+        body, signature = value.split( '.' )
+        forged = _decode( body ).replace( 'bob', 'eve' )
+        for tampered in ( '%s.%s' % (_encode(forged), signature),
+                          '%s.%s' % (body, signature[:-2] + 'AA'),
+                          '%s.%s' % (body, u'\xe9' * len(signature)),
+                          body, '' ):
+            self.assertEqual( self._roundTrip(tampered), None )
+
+        self.assertEqual( decodeAssertion(value, newSecret(), CAS), None )
+
+    def test_expired( self ):
+        value = encodeAssertion( newAssertion(), self.secret, -1 )
+        self.assertEqual( self._roundTrip(value), None )
+
+    def test_reset_credentials_does_not_touch_the_session( self ):
+        plugin = newPlugin( 'signed', useSignedCookie=True,
+                            storageBackend='volatile' )
+        plugin.casServerUrlPrefix = ''
+        storage = plugin._getCookiePgtStorage()
+        value = encodeAssertion( newAssertion('PGT-2-secret'),
+                                 plugin._getCookieSecret(), 60, storage )
+        other = encodeAssertion( newAssertion('PGT-3-secret'),
+                                 plugin._getCookieSecret(), 60, storage )
+
+        # FakeRequest has no SESSION, using it raises AttributeError
+        request = FakeRequest( cookies={plugin.signedCookieName: value} )
+        request.response.cookies[plugin.signedCookieName] = value
+        plugin.resetCredentials( request, request.response )
+
+        self.assertEqual( decodeAssertion(value, plugin._getCookieSecret(),
+                                          '', pgtStorage=storage)
+                          .getPrincipal().pgt, None )
+        self.assertEqual( decodeAssertion(other, plugin._getCookieSecret(),
+                                          '', pgtStorage=storage)
+                          .getPrincipal().pgt, 'PGT-3-secret' )
+        self.assertFalse( plugin.signedCookieName in
+                          request.response.cookies )
+
+def test_suite():
+    return unittest.defaultTestLoader.loadTestsFromName( __name__ )
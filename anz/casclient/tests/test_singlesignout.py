@@ -0,0 +1,117 @@
+
+# python
+import time
+import unittest
+
+# zope
+import transaction
+from OFS.Application import Application
+from OFS.Folder import Folder
+from OFS.SimpleItem import SimpleItem
+from ZODB.DB import DB
+from ZODB.MappingStorage import MappingStorage
+from persistent.mapping import PersistentMapping
+from zope.component import getGlobalSiteManager
+from zope.component.hooks import getSite
+from zope.component.interfaces import ISite
+from zope.interface import implements
+
+from anz.casclient.singlesignout import LogoutQueue
+from anz.casclient.tests.test_casclient import newPlugin
+
+class Site( Folder ):
+
+    implements( ISite )
+
+    def getSiteManager( self ):
+        return getGlobalSiteManager()
+
+# ( site, request ) of each session lookup
+lookups = []
+
+class SessionDataManager( SimpleItem ):
+    ''' Just what the plugin reads from the session data manager. '''
+
+    def __init__( self ):
+        self.sessions = {}
+
+    def getSessionDataByKey( self, key ):
+        lookups.append( (getSite(), getattr(self, 'REQUEST', None)) )
+        return self.sessions.get( key )
+
+class LogoutReplayTests( unittest.TestCase ):
+
+    SIZE = 10000
+
+    def setUp( self ):
+        self.db = DB( MappingStorage() )
+        conn = self.db.open()
+        root = conn.root()
+
+        site = Site( 'site' )
+        site._setObject( 'cas', newPlugin('cas') )
+        site._setObject( 'session_data_manager', SessionDataManager() )
+        root['Application'] = app = Application()
+        app._setObject( 'site', site )
+
+        plugin = app.site.cas
+        sdm = app.site.session_data_manager
+        for i in range( self.SIZE ):
+            plugin._getSessionStorage().addSession( 'ST-%d' % i,
+                                                    'session-%d' % i )
+            sdm.sessions['session-%d' % i] = PersistentMapping(
+                {'logged in': True} )
+
+        transaction.commit()
+        conn.close()
+
+    def tearDown( self ):
+        transaction.abort()
+        self.db.close()
+
+    def _openApp( self ):
+        return self.db.open().root()['Application']
+
+    def test_replay( self ):
+        queue = LogoutQueue( maxSize=self.SIZE, batchSize=500,
+                             opener=self._openApp )
+        start = time.time()
+        for i in range( self.SIZE ):
+            self.assertTrue( queue.put('/site/cas', 'ST-%d' % i) )
+
+        while queue.processed + queue.failed < self.SIZE and \
+              time.time() - start < 60:
+            time.sleep( 0.05 )
+
+        self.assertEqual( queue.getStats()['processed'], self.SIZE )
+        self.assertEqual( queue.failed, 0 )
+        self.assertTrue( queue.batches <= self.SIZE / 500 + 1 )
+
+        conn = self.db.open()
+        try:
+            site = conn.root()['Application'].site
+            sessions = site.session_data_manager.sessions
+            self.assertEqual( [s for s in sessions.values() if s], [] )
+            self.assertEqual(
+                site.cas._getSessionStorage().getSessionId('ST-0'), None )
+        finally:
+            conn.close()
+
+    def test_request_and_site_are_set_up( self ):
+        queue = LogoutQueue( opener=self._openApp )
+        del lookups[:]
+        queue._process( [('/site/cas', 'ST-1', None)] )
+
+        site, request = lookups[0]
+        self.assertEqual( site.getId(), 'site' )
+        self.assertNotEqual( request, None )
+        self.assertEqual( getSite(), None )
+        conn = self.db.open()
+        try:
+            sdm = conn.root()['Application'].site.session_data_manager
+            self.assertEqual( sdm.sessions['session-1'], {} )
+        finally:
+            conn.close()
+
+def test_suite():
+    return unittest.defaultTestLoader.loadTestsFromName( __name__ )
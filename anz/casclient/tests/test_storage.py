@@ -0,0 +1,289 @@
+
+# python
+import shutil
+import tempfile
+import threading
+import unittest
+
+# zope
+import transaction
+from ZODB.POSException import ConflictError
+from ZODB.DB import DB
+from ZODB.MappingStorage import MappingStorage
+from zope.component import provideAdapter
+from zope.component.testing import setUp, tearDown
+
+from anz.casclient import storage, proxygrantingticketstorage, \
+     sessionmappingstorage
+from anz.casclient.casclient import AnzCASClient
+from anz.casclient.interfaces import IAnzCASClient, \
+     IProxyGrantingTicketStorage, ISessionMappingStorage
+from anz.casclient.proxygrantingticketstorage import \
+     ProxyGrantingTicketStorage, FileProxyGrantingTicketStorage
+from anz.casclient.sessionmappingstorage import SessionMappingStorage, \
+     FileSessionMappingStorage, PartitionedSessionMappingStorage, \
+     SessionMappingPartition
+from anz.casclient.upgrades import upgradeSessionStorage
+
+def _noKeys():
+    raise AssertionError( 'keys() builds the key set of the whole forest' )
+
+class ForestLookupTests( unittest.TestCase ):
+    ''' Lookups in the forest based storages must be keyed, whatever the
+    number of live entries.
+
+    '''
+
+    SIZES = ( 10000, 100000 )
+
+    def test_pgt_storage( self ):
+        for size in self.SIZES:
+            storage = ProxyGrantingTicketStorage()
+            for i in range( size ):
+                storage.add( 'PGTIOU-%d' % i, 'PGT-%d' % i )
+            storage._mapping.keys = _noKeys
+
+            self.assertEqual( storage.retrieve('PGTIOU-0'), 'PGT-0' )
+            self.assertEqual( storage.retrieve('PGTIOU-%d' % (size-1)),
+                              'PGT-%d' % (size-1) )
+            self.assertEqual( storage.retrieve('PGTIOU-unknown'), None )
+
+    def test_session_mapping_storage( self ):
+        for size in self.SIZES:
+            storage = SessionMappingStorage()
+            for i in range( size ):
+                storage.addSession( 'ST-%d' % i, 'session-%d' % i )
+            storage._mapping_id_to_session_id.keys = _noKeys
+            storage._session_id_to_mapping_id.keys = _noKeys
+
+            self.assertEqual( storage.getSessionId('ST-1'), 'session-1' )
+            self.assertEqual( storage.getSessionId('ST-unknown'), None )
+
+            storage.removeByMappingId( 'ST-1' )
+            self.assertEqual( storage.getSessionId('ST-1'), None )
+            storage.removeBySessionId( 'session-1' )
+
+            storage.removeBySessionId( 'session-2' )
+            self.assertEqual( storage.getSessionId('ST-2'), None )
+
+            storage.removeByMappingId( 'ST-unknown' )
+            storage.removeBySessionId( 'session-unknown' )
+
+    def test_reverse_entry_rotated_out( self ):
+        storage = SessionMappingStorage()
+        storage.addSession( 'ST-1', 'session-1' )
+        del storage._session_id_to_mapping_id['session-1']
+
+        # does not raise KeyError
+        storage.removeByMappingId( 'ST-1' )
+        self.assertEqual( storage.getSessionId('ST-1'), None )
+
+def registerBackends():
+    ''' Register the storage backends like configure.zcml does. '''
+    for backend in ( 'zodb', 'volatile', 'file' ):
+        provideAdapter( getattr(proxygrantingticketstorage,
+                                '%sProxyGrantingTicketStorage' % backend),
+                        ( IAnzCASClient, ), IProxyGrantingTicketStorage,
+                        name=backend )
+        provideAdapter( getattr(sessionmappingstorage,
+                                '%sSessionMappingStorage' % backend),
+                        ( IAnzCASClient, ), ISessionMappingStorage,
+                        name=backend )
+
+class BackendTests( unittest.TestCase ):
+    ''' Logins must not write to the ZODB with the volatile and file
+    backends.
+
+    '''
+
+    def setUp( self ):
+        setUp()
+        registerBackends()
+        self.directory = tempfile.mkdtemp()
+        self.db = DB( MappingStorage() )
+        self.conn = self.db.open()
+        self.plugin = AnzCASClient( 'cas', 'CAS' )
+        self.plugin.storageDirectory = self.directory
+        self.conn.root()['cas'] = self.plugin
+        transaction.commit()
+
+    def tearDown( self ):
+        transaction.abort()
+        self.conn.close()
+        self.db.close()
+        storage._storages.clear()
+        shutil.rmtree( self.directory )
+        tearDown()
+
+    def _login( self, count ):
+        for i in range( count ):
+            self.plugin._getPgtStorage().add( 'PGTIOU-%d' % i, 'PGT-%d' % i )
+            self.plugin._getSessionStorage().addSession( 'ST-%d' % i,
+                                                         'session-%d' % i )
+            transaction.commit()
+
+    def _assertLoggedIn( self, count ):
+        for i in range( count ):
+            self.assertEqual(
+                self.plugin._getPgtStorage().retrieve('PGTIOU-%d' % i),
+                'PGT-%d' % i )
+            self.assertEqual(
+                self.plugin._getSessionStorage().getSessionId('ST-%d' % i),
+                'session-%d' % i )
+
+    def test_no_zodb_writes( self ):
+        for backend in ( 'volatile', 'file' ):
+            self.plugin.storageBackend = backend
+            transaction.commit()
+
+            last = self.db.lastTransaction()
+            self._login( 100 )
+            self.assertEqual( self.db.lastTransaction(), last )
+            self._assertLoggedIn( 100 )
+
+    def test_zodb_backend( self ):
+        last = self.db.lastTransaction()
+        self._login( 10 )
+        self.assertNotEqual( self.db.lastTransaction(), last )
+        self._assertLoggedIn( 10 )
+
+    def test_backend_per_plugin( self ):
+        other = AnzCASClient( 'other', 'Other' )
+        other.storageBackend = 'volatile'
+        self.plugin.storageBackend = 'file'
+        self.plugin._getSessionStorage().addSession( 'ST-1', 'session-1' )
+
+        self.assertTrue( isinstance(self.plugin._getSessionStorage(),
+                                    FileSessionMappingStorage) )
+        self.assertEqual( other._getSessionStorage().getSessionId('ST-1'),
+                          None )
+
+    def test_file_backend_shared_by_clients( self ):
+        # two Zope clients of the host each have their own instance
+        first = FileProxyGrantingTicketStorage( self.directory )
+        second = FileProxyGrantingTicketStorage( self.directory )
+        first.add( 'PGTIOU-1', 'PGT-1' )
+        self.assertEqual( second.retrieve('PGTIOU-1'), 'PGT-1' )
+
+        first = FileSessionMappingStorage( self.directory )
+        second = FileSessionMappingStorage( self.directory )
+        first.addSession( 'ST-1', 'session-1' )
+        self.assertEqual( second.getSessionId('ST-1'), 'session-1' )
+        second.removeBySessionId( 'session-1' )
+        self.assertEqual( first.getSessionId('ST-1'), None )
+
+class PartitionedStorageTests( unittest.TestCase ):
+
+    def setUp( self ):
+        self.db = DB( MappingStorage() )
+        conn = self.db.open()
+        conn.root()['storage'] = PartitionedSessionMappingStorage()
+        transaction.commit()
+        conn.close()
+
+    def tearDown( self ):
+        self.db.close()
+
+    def test_concurrent_logins( self ):
+        # each thread stands for a Zope client with a ZODB connection of
+        # its own
+        threads = 8
+        logins = 100
+        conflicts = []
+
+        def login( client ):
+            tm = transaction.TransactionManager()
+            conn = self.db.open( transaction_manager=tm )
+            storage = conn.root()['storage']
+            try:
+                for i in range( logins ):
+                    while True:
+                        storage.addSession( 'ST-%d-%d' % (client, i),
+                                            'session-%d-%d' % (client, i) )
+                        try:
+                            tm.commit()
+                            break
+                        except ConflictError:
+                            conflicts.append( client )
+                            tm.abort()
+            finally:
+                conn.close()
+
+        workers = [ threading.Thread(target=login, args=(client,))
+                    for client in range(threads) ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        conn = self.db.open()
+        storage = conn.root()['storage']
+        for client in range( threads ):
+            for i in range( logins ):
+                self.assertEqual(
+                    storage.getSessionId('ST-%d-%d' % (client, i)),
+                    'session-%d-%d' % (client, i) )
+                self.assertEqual(
+                    storage._partition( 'session-%d-%d' % (client, i) ).get(
+                        '_session_id_to_mapping_id',
+                        'session-%d-%d' % (client, i), storage.TIME_OUT ),
+                    'ST-%d-%d' % (client, i) )
+        conn.close()
+
+        # concurrent writes to the same bucket are merged, only bucket
+        # splits may conflict
+        self.assertTrue( len(conflicts) < threads * logins / 10,
+                         '%d conflicts' % len(conflicts) )
+
+    def test_login_writes_little( self ):
+        conn = self.db.open()
+        storage = conn.root()['storage']
+        # realistic ticket and session id lengths
+        for i in range( 10000 ):
+            storage.addSession( 'ST-%d-9ixbMpfs2qC3kRfaZTtM-cas01' % i,
+                                '%d-A7lG5bR2nTq9xWcK0vJ3' % i )
+        transaction.commit()
+
+        size = self.db.getSize()
+        storage.addSession( 'ST-new', 'session-new' )
+        transaction.commit()
+        conn.close()
+
+        # two small buckets, not whole partitions
+        self.assertTrue( self.db.getSize() - size < 8000 )
+
+    def test_purge_is_bounded( self ):
+        partition = SessionMappingPartition()
+        mapping = partition._mapping_id_to_session_id
+        for i in range( 100 ):
+            mapping['ST-%03d' % i] = ( 'session-%d' % i, 0 )
+
+        # expired entries are ignored before they are purged
+        self.assertEqual( partition.get('_mapping_id_to_session_id',
+                                        'ST-050', 60), None )
+
+        # a write only purges a few entries following its key
+        partition.set( '_mapping_id_to_session_id', 'ST-050a', 'new', 60 )
+        self.assertEqual( len(mapping), 100 + 1 - partition.PURGE_BATCH )
+        self.assertTrue( 'ST-050' in mapping )
+        self.assertFalse( 'ST-051' in mapping )
+        self.assertTrue( 'ST-051' > 'ST-050a' )
+        self.assertEqual( partition.get('_mapping_id_to_session_id',
+                                        'ST-050a', 60), 'new' )
+
+class UpgradeTests( unittest.TestCase ):
+
+    def test_forest_storage( self ):
+        plugin = AnzCASClient( 'cas', 'CAS' )
+        plugin._sessionStorage = SessionMappingStorage()
+        plugin._sessionStorage.addSession( 'ST-1', 'session-1' )
+
+        self.assertTrue( upgradeSessionStorage(plugin) )
+        self.assertTrue( isinstance(plugin._sessionStorage,
+                                    PartitionedSessionMappingStorage) )
+        self.assertEqual( plugin._sessionStorage.getSessionId('ST-1'),
+                          'session-1' )
+        self.assertFalse( upgradeSessionStorage(plugin) )
+
+def test_suite():
+    return unittest.defaultTestLoader.loadTestsFromName( __name__ )
@@ -0,0 +1,162 @@
+
+# python
+import time
+import unittest
+
+from anz.casclient import utils
+from anz.casclient.transport import Transport, setDeadline, \
+     restoreDeadline, getRemainingTime
+from anz.casclient.exceptions import ConnectionException, \
+     DeadlineExceededException
+from anz.casclient.proxyretriever import Cas20ProxyRetriever
+from anz.casclient.tests.fakecas import FakeCASServer
+
+class TransportTests( unittest.TestCase ):
+
+    def setUp( self ):
+        self.cas = FakeCASServer().start()
+        self.transport = Transport()
+        self.calls = []
+
+    def tearDown( self ):
+        self.transport.clear()
+        self.cas.stop()
+
+    def _path( self, path ):
+        return self.cas.url[:-len( '/cas' )] + path
+
+    def test_reuses_connections( self ):
+        for i in range( 10 ):
+            ticket = self.cas.issueTicket( 'bob' )
+            body = self.transport.request(
+                '%s/validate?ticket=%s&service=x' % (self.cas.url, ticket) )
+            self.assertEqual( body, 'yes\nbob\n' )
+
+        self.assertEqual( len(self.cas.requests), 10 )
+        self.assertEqual( self.cas.connections, 1 )
+
+    def test_http_error( self ):
+        self.assertRaises( ConnectionException, self.transport.request,
+                           self._path('/nowhere') )
+
+    def test_follows_redirects_of_get( self ):
+        ticket = self.cas.issueTicket( 'bob' )
+        target = '/cas/validate?ticket=%s&service=x' % ticket
+        self.cas.routes['/moved'] = lambda h: ( 302, {'Location': target},
+                                                '' )
+        self.assertEqual( self.transport.request(self._path('/moved')),
+                          'yes\nbob\n' )
+
+    def test_too_many_redirects( self ):
+        self.cas.routes['/loop'] = lambda h: ( 302, {'Location': '/loop'},
+                                               '' )
+        self.assertRaises( ConnectionException, self.transport.request,
+                           self._path('/loop') )
+
+    def test_post_redirects( self ):
+        # 302 would turn the POST into a GET and lose its body
+        self.cas.routes['/found'] = lambda h: (
+            302, {'Location': '/cas/samlValidate'}, '' )
+        self.assertRaises( ConnectionException, self.transport.request,
+                           self._path('/found'), '<x/>' )
+
+        # 307 keeps the method and body
+        self.cas.routes['/temporary'] = lambda h: (
+            307, {'Location': '/cas/samlValidate'}, '' )
+        body = self.transport.request( self._path('/temporary'), '<x/>' )
+        self.assertTrue( 'saml1p:RequestDenied' in body )
+        self.assertEqual( self.cas.requests[-1],
+                          ('POST', '/cas/samlValidate') )
+
+    def _dropFirst( self, handler ):
+        # close the kept-alive connection without answering, once
+        self.calls.append( handler.command )
+        if len( self.calls ) == 1:
+            handler.close_connection = 1
+            return None
+
+        return 200, {}, 'done'
+
+    def test_retries_get_on_closed_connection( self ):
+        self.transport.request( self._path('/cas/login') )
+        self.cas.routes['/drop'] = self._dropFirst
+        self.assertEqual( self.transport.request(self._path('/drop')),
+                          'done' )
+        self.assertEqual( self.calls, ['GET', 'GET'] )
+
+    def test_does_not_resend_post( self ):
+        self.transport.request( self._path('/cas/login') )
+        self.cas.routes['/drop'] = self._dropFirst
+        self.assertRaises( ConnectionException, self.transport.request,
+                           self._path('/drop'), '<x/>' )
+        self.assertEqual( self.calls, ['POST'] )
+
+    def _trickle( self, handler ):
+        # announce a large body and send it one byte at a time, each byte
+        # well within the read timeout
+        handler.send_response( 200 )
+        handler.send_header( 'Content-Length', '1000' )
+        handler.end_headers()
+        try:
+            for i in range( 1000 ):
+                handler.wfile.write( 'x' )
+                handler.wfile.flush()
+                time.sleep( 0.02 )
+        except Exception:
+            pass
+
+    def test_deadline_stops_trickling_response( self ):
+        self.cas.routes['/trickle'] = self._trickle
+        previous = setDeadline( 0.3 )
+        start = time.time()
+        try:
+            self.assertRaises( ConnectionException, self.transport.request,
+                               self._path('/trickle'), readTimeout=5 )
+        finally:
+            restoreDeadline( previous )
+
+        self.assertTrue( time.time() - start < 1 )
+
+    def test_deadline_bounds_waiting_for_connection( self ):
+        transport = Transport( maxPerHost=1 )
+        pool = transport.getPool( 'http', '127.0.0.1',
+                                  int(self.cas.url.split(':')[2][:-4]) )
+        conn, reused = pool.acquire()
+        previous = setDeadline( 0.2 )
+        start = time.time()
+        try:
+            try:
+                transport.request( self.cas.url + '/login' )
+            except ConnectionException, e:
+                self.assertEqual( str(e), 'Deadline exceeded.' )
+            else:
+                self.fail( 'request did not wait for a free connection' )
+        finally:
+            restoreDeadline( previous )
+            pool.release( conn, reusable=False )
+
+        self.assertTrue( time.time() - start < 1 )
+
+        # the slot is usable again
+        self.assertTrue( 'login' in transport.request(self.cas.url +
+                                                      '/login') )
+        transport.clear()
+
+    def test_expired_deadline_is_not_fanned_out( self ):
+        retriever = Cas20ProxyRetriever( self.cas.url )
+        # no time left at all, which setDeadline takes for no deadline
+        utils.getRemainingTime = lambda: 0.0
+        try:
+            tickets, errors = retriever.getProxyTicketIdsFor(
+                'PGT-1', ['http://a', 'http://b'] )
+        finally:
+            utils.getRemainingTime = getRemainingTime
+
+        self.assertEqual( tickets, {} )
+        self.assertEqual( sorted(errors), ['http://a', 'http://b'] )
+        for error in errors.values():
+            self.assertTrue( isinstance(error, DeadlineExceededException) )
+        self.assertEqual( self.cas.requests, [] )
+
+def test_suite():
+    return unittest.defaultTestLoader.loadTestsFromName( __name__ )
@@ -0,0 +1,82 @@
+
+# python
+import threading
+import time
+import unittest
+
+# zope
+import transaction
+from ZODB.DB import DB
+from ZODB.MappingStorage import MappingStorage
+
+from anz.casclient.transport import setDeadline, restoreDeadline
+from anz.casclient.proxygrantingticketstorage import \
+     ProxyGrantingTicketStorage, VolatileProxyGrantingTicketStorage
+from anz.casclient.validationspecification import \
+     Cas20ServiceTicketValidator
+
+class PgtRetrievalTests( unittest.TestCase ):
+
+    def setUp( self ):
+        self.validator = Cas20ServiceTicketValidator(
+            'http://localhost/cas', VolatileProxyGrantingTicketStorage() )
+
+    def test_wait_is_bounded_by_deadline( self ):
+        previous = setDeadline( 0.2 )
+        start = time.time()
+        try:
+            self.assertEqual( self.validator._retrievePgt('PGTIOU-never'),
+                              None )
+        finally:
+            restoreDeadline( previous )
+
+        self.assertTrue( time.time() - start < 1 )
+
+    def test_polls_the_zodb_storage( self ):
+        db = DB( MappingStorage() )
+        conn = db.open()
+        conn.root()['pgt'] = ProxyGrantingTicketStorage()
+        transaction.commit()
+
+        # the request has changes of its own
+        conn.root()['changed'] = True
+        validator = Cas20ServiceTicketValidator( 'http://localhost/cas',
+                                                 conn.root()['pgt'] )
+
+        def callBack():
+            # the proxy callback handled by another Zope client
+            time.sleep( 0.2 )
+            manager = transaction.TransactionManager()
+            other = db.open( transaction_manager=manager )
+            other.root()['pgt'].add( 'PGTIOU-1', 'PGT-1' )
+            manager.commit()
+            other.close()
+
+        thread = threading.Thread( target=callBack )
+        thread.start()
+        opened = []
+        dbOpen = db.open
+
+        def recordingOpen( *args, **kw ):
+            opened.append( threading.currentThread() )
+            return dbOpen( *args, **kw )
+        db.open = recordingOpen
+        previous = setDeadline( 1.5 )
+        try:
+            self.assertEqual( validator._retrievePgt('PGTIOU-1'), 'PGT-1' )
+        finally:
+            restoreDeadline( previous )
+            thread.join()
+            del db.open
+
+        # one connection for all the polls
+        self.assertEqual( opened.count(threading.currentThread()), 1 )
+
+        # the transaction of the request was not aborted
+        self.assertEqual( conn.root().get('changed'), True )
+        transaction.abort()
+        conn.close()
+        db.close()
+
+def test_suite():
+    return unittest.defaultTestLoader.loadTestsFromName( __name__ )
@@ -0,0 +1,482 @@
+
+# python
+import httplib
+import socket
+import threading
+import time
+from urlparse import urlsplit, urljoin
+from logging import getLogger
+
+from anz.casclient.exceptions import ConnectionException, \
+     DeadlineExceededException, HTTPErrorException
+
+LOG = getLogger( 'anz.casclient' )
+
+# Default seconds to wait for a connection to the CAS server to be set up.
+DEFAULT_CONNECT_TIMEOUT = 5
+
+# Default seconds to wait for the CAS server to send (part of) its response.
+DEFAULT_READ_TIMEOUT = 5
+
+# Max number of redirects followed for one request.
+MAX_REDIRECTS = 5
+
+_local = threading.local()
+
+def setDeadline( seconds ):
+    ''' Set a deadline for all the requests the current thread sends from
+    now on. Timeouts of those requests are shortened so none of them
+    outlive the deadline.
+
+    @param seconds
+    seconds from now, None or 0 means no deadline.
+
+    @return
+    the previous deadline, to be given back to restoreDeadline.
+
+    '''
+    previous = getattr( _local, 'deadline', None )
+    deadline = seconds and time.time() + seconds or None
+    if previous is not None and \
+       ( deadline is None or previous < deadline ):
+        # Never extend an enclosing deadline.
+        deadline = previous
+
+    _local.deadline = deadline
+    return previous
+
+def restoreDeadline( previous ):
+    ''' Restore the deadline that was replaced by setDeadline. '''
+    _local.deadline = previous
+
+def getRemainingTime():
+    ''' Return the seconds left before the deadline of the current thread
+    or None if no deadline is set.
+
+    '''
+    deadline = getattr( _local, 'deadline', None )
+    if deadline is None:
+        return None
+
+    return deadline - time.time()
+
+class _DeadlineSocket( object ):
+    ''' Socket wrapper checking the deadline of the request before each
+    read and write, so a server trickling its response byte by byte can
+    not keep a request running past the deadline.
+
+    '''
+
+    def __init__( self, sock ):
+        self._sock = sock
+        self.readTimeout = None
+        self.deadline = None
+
+    def __getattr__( self, name ):
+        return getattr( self._sock, name )
+
+    def arm( self, readTimeout, deadline ):
+        ''' Apply readTimeout to each read and write of the next request,
+        and stop it at deadline (a time.time() value or None).
+
+        '''
+        self.readTimeout = readTimeout
+        self.deadline = deadline
+
+    def _check( self ):
+        timeout = self.readTimeout
+        if self.deadline is not None:
+            remaining = self.deadline - time.time()
+            if remaining <= 0:
+                raise DeadlineExceededException( 'Deadline exceeded.' )
+
+            timeout = _clip( timeout, remaining )
+
+        self._sock.settimeout( timeout )
+
+    def recv( self, *args ):
+        self._check()
+        return self._sock.recv( *args )
+
+    def recv_into( self, *args ):
+        self._check()
+        return self._sock.recv_into( *args )
+
+    def sendall( self, *args ):
+        self._check()
+        return self._sock.sendall( *args )
+
+    def makefile( self, mode='r', bufsize=-1 ):
+        # reads of the response go through recv above
+        return socket._fileobject( self, mode, bufsize )
+
+class HTTPConnectionPool( object ):
+    ''' A thread-safe pool of persistent (keep-alive) connections to one
+    host.
+
+    Idle connections are kept for reuse until they have not been used for
+    idleTimeout seconds, at most poolSize of them are kept, and no more
+    than maxPerHost connections to the host are open at the same time.
+
+    '''
+
+    def __init__( self, scheme, host, port, poolSize=10, maxPerHost=20,
+                  idleTimeout=30 ):
+        ''' Construct a connection pool.
+
+        @param scheme
+        'http' or 'https'
+
+        @param host
+        host name of the server
+
+        @param port
+        port of the server
+
+        @param poolSize
+        max number of idle connections kept for reuse
+
+        @param maxPerHost
+        max number of connections open to the host at the same time
+
+        @param idleTimeout
+        seconds an idle connection is kept before it is discarded
+
+        '''
+        self.scheme = scheme
+        self.host = host
+        self.port = port
+        self.poolSize = poolSize
+        self.maxPerHost = maxPerHost
+        self.idleTimeout = idleTimeout
+
+        self._idle = []
+        self._lock = threading.Lock()
+        self._slots = threading.Condition( threading.Lock() )
+        self._open = 0
+
+    def acquire( self, timeout=None ):
+        ''' Return a (connection, reused) pair, reusing an idle connection
+        when one is available. New connections are not connected yet.
+
+        @param timeout
+        max seconds to wait while maxPerHost connections are in use,
+        None waits as long as needed
+
+        '''
+        self._acquireSlot( timeout )
+
+        now = time.time()
+        conn = None
+        self._lock.acquire()
+        try:
+            while self._idle:
+                candidate, lastUsed = self._idle.pop()
+                if now - lastUsed < self.idleTimeout:
+                    conn = candidate
+                    break
+
+                candidate.close()
+        finally:
+            self._lock.release()
+
+        if conn is not None:
+            return conn, True
+
+        return self._newConnection(), False
+
+    def release( self, conn, reusable=True ):
+        ''' Give a connection back to the pool.
+
+        @param conn
+        the connection returned by acquire
+
+        @param reusable
+        whether the connection may be kept alive for later requests
+
+        '''
+        try:
+            if reusable:
+                self._lock.acquire()
+                try:
+                    if len( self._idle ) < self.poolSize:
+                        self._idle.append( (conn, time.time()) )
+                        conn = None
+                finally:
+                    self._lock.release()
+
+            if conn is not None:
+                conn.close()
+        finally:
+            self._releaseSlot()
+
+    def clear( self ):
+        ''' Close all idle connections. '''
+        self._lock.acquire()
+        try:
+            idle, self._idle = self._idle, []
+        finally:
+            self._lock.release()
+
+        for conn, lastUsed in idle:
+            conn.close()
+
+    def _acquireSlot( self, timeout ):
+        end = timeout is not None and time.time() + timeout or None
+        self._slots.acquire()
+        try:
+            while self._open >= self.maxPerHost:
+                if end is None:
+                    self._slots.wait()
+                    continue
+
+                remaining = end - time.time()
+                if remaining <= 0:
+                    raise DeadlineExceededException( 'Deadline exceeded.' )
+
+                self._slots.wait( remaining )
+
+            self._open += 1
+        finally:
+            self._slots.release()
+
+    def _releaseSlot( self ):
+        self._slots.acquire()
+        try:
+            self._open -= 1
+            self._slots.notify()
+        finally:
+            self._slots.release()
+
+    def _newConnection( self ):
+        if self.scheme == 'https':
+            return httplib.HTTPSConnection( self.host, self.port )
+
+        return httplib.HTTPConnection( self.host, self.port )
+
+class Transport( object ):
+    ''' Shared HTTP transport used for all CAS back-channel calls.
+
+    Keeps one HTTPConnectionPool per (scheme, host, port), so the TCP
+    connection and TLS session to the CAS server are reused across
+    validations instead of being set up for each request.
+
+    '''
+
+    def __init__( self, poolSize=10, maxPerHost=20, idleTimeout=30 ):
+        ''' Construct a transport.
+
+        See HTTPConnectionPool for the meaning of the parameters, they are
+        applied to each per host pool.
+
+        '''
+        self.poolSize = poolSize
+        self.maxPerHost = maxPerHost
+        self.idleTimeout = idleTimeout
+
+        self._pools = {}
+        self._lock = threading.Lock()
+
+    def getPool( self, scheme, host, port ):
+        ''' Retrieve the connection pool of a host, create it if needed. '''
+        key = ( scheme, host, port )
+        self._lock.acquire()
+        try:
+            pool = self._pools.get( key )
+            if pool is None:
+                pool = HTTPConnectionPool( scheme, host, port,
+                                           poolSize=self.poolSize,
+                                           maxPerHost=self.maxPerHost,
+                                           idleTimeout=self.idleTimeout )
+                self._pools[key] = pool
+        finally:
+            self._lock.release()
+
+        return pool
+
+    def request( self, url, data=None, headers=None, connectTimeout=None,
+                 readTimeout=None ):
+        ''' Send a request and return the body of the response.
+
+        @param url
+        the url to request
+
+        @param data
+        request body, if given a POST is sent instead of a GET
+
+        @param headers
+        extra request headers
+
+        @param connectTimeout
+        seconds to wait for the connection to be set up, default to
+        DEFAULT_CONNECT_TIMEOUT
+
+        @param readTimeout
+        seconds to wait for each read of the response, default to
+        DEFAULT_READ_TIMEOUT
+
+        @return
+        the body of the response.
+
+        '''
+        method = data is None and 'GET' or 'POST'
+        for i in range( MAX_REDIRECTS + 1 ):
+            status, location, body = self._request( method, url, data,
+                                                    headers, connectTimeout,
+                                                    readTimeout )
+            target = getRedirect( method, status, location, url )
+            if target is None:
+                return body
+
+            url = target
+
+        raise ConnectionException( 'Too many redirects.' )
+
+    def _request( self, method, url, data, headers, connectTimeout,
+                  readTimeout ):
+        ''' Send one request.
+
+        @return
+        a ( status, location header, body ) tuple.
+
+        '''
+        connectTimeout = connectTimeout or DEFAULT_CONNECT_TIMEOUT
+        readTimeout = readTimeout or DEFAULT_READ_TIMEOUT
+
+        parts = urlsplit( url )
+        scheme = parts.scheme or 'http'
+        if scheme not in ( 'http', 'https' ):
+            raise ConnectionException( 'Unsupported scheme: %s' % scheme )
+
+        port = parts.port or ( scheme == 'https' and 443 or 80 )
+        path = parts.path or '/'
+        if parts.query:
+            path = '%s?%s' % ( path, parts.query )
+
+        headers = dict( headers or {} )
+
+        pool = self.getPool( scheme, parts.hostname, port )
+        deadline = getattr( _local, 'deadline', None )
+        while True:
+            remaining = getRemainingTime()
+            if remaining is not None and remaining <= 0:
+                raise DeadlineExceededException( 'Deadline exceeded.' )
+
+            # Waiting for a free connection is part of setting one up.
+            conn, reused = pool.acquire( _clip(connectTimeout, remaining) )
+            sent = False
+            try:
+                if conn.sock is None:
+                    conn.timeout = _clip( connectTimeout, getRemainingTime() )
+                    conn.connect()
+                    conn.sock = _DeadlineSocket( conn.sock )
+
+                conn.sock.arm( readTimeout, deadline )
+                conn.request( method, path, data, headers )
+                sent = True
+                response = conn.getresponse()
+                body = response.read()
+            except ( httplib.HTTPException, socket.error ), e:
+                pool.release( conn, reusable=False )
+                if reused and not isinstance( e, socket.timeout ) and \
+                   ( method == 'GET' or not sent ):
+                    # The server closed the kept-alive connection, try
+                    # again on a new one. A POST the server may have
+                    # received already is not sent twice.
+                    continue
+
+                LOG.warning( e )
+                remaining = getRemainingTime()
+                if isinstance( e, socket.timeout ) and \
+                   remaining is not None and remaining <= 0:
+                    # the timeout was shortened to the deadline
+                    raise DeadlineExceededException( 'Deadline exceeded.' )
+
+                raise ConnectionException( 'Fail to connect, %s' % e )
+            except:
+                pool.release( conn, reusable=False )
+                raise
+
+            pool.release( conn, reusable=not response.will_close )
+            break
+
+        if response.status >= 400:
+            LOG.warning( 'HTTP Error %s: %s' % ( response.status,
+                                                 response.reason ) )
+            raise HTTPErrorException( response.status )
+
+        return response.status, response.getheader( 'location' ), body
+
+    def clear( self ):
+        ''' Close all idle connections of all pools. '''
+        self._lock.acquire()
+        try:
+            pools = self._pools.values()
+        finally:
+            self._lock.release()
+
+        for pool in pools:
+            pool.clear()
+
+def getRedirect( method, status, location, url ):
+    ''' Return the url a response redirects to, None if it is not a
+    redirect.
+
+    GET requests follow all redirects, POST requests only 307 and 308,
+    which keep the method and body. Other 3xx responses raise a
+    ConnectionException, their body is not what the caller asked for.
+
+    @param method
+    'GET' or 'POST'
+
+    @param status
+    the HTTP status code of the response
+
+    @param location
+    the Location header of the response
+
+    @param url
+    the url that was requested
+
+    '''
+    if status < 300 or status >= 400:
+        return None
+
+    followed = method == 'GET' and ( 301, 302, 303, 307, 308 ) or \
+               ( 307, 308 )
+    if status not in followed or not location:
+        LOG.warning( 'Unexpected redirect %s of %s to %s' % ( status, url,
+                                                               location ) )
+        raise ConnectionException( 'Unexpected redirect: %s' % status )
+
+    return urljoin( url, location )
+
+def _clip( timeout, remaining ):
+    if remaining is not None and remaining < timeout:
+        return remaining
+
+    return timeout
+
+_transport = Transport()
+
+def getTransport():
+    ''' Retrieve the transport shared by the whole process. '''
+    return _transport
+
+def configureTransport( poolSize=10, maxPerHost=20, idleTimeout=30 ):
+    ''' Make the shared transport use the given pool settings. If they
+    changed, it is replaced by a new one and the idle connections of the
+    old one are closed.
+
+    '''
+    global _transport
+    old = _transport
+    if ( old.poolSize, old.maxPerHost, old.idleTimeout ) == \
+       ( poolSize, maxPerHost, idleTimeout ):
+        return old
+
+    _transport = Transport( poolSize=poolSize,
+                            maxPerHost=maxPerHost,
+                            idleTimeout=idleTimeout )
+    old.clear()
+    return _transport
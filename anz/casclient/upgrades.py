@@ -0,0 +1,60 @@
+
+# python
+from logging import getLogger
+
+# zope
+import transaction
+
+from anz.casclient.sessionmappingstorage import SessionMappingStorage, \
+     PartitionedSessionMappingStorage
+
+LOG = getLogger( 'anz.casclient' )
+
+META_TYPE = 'Anz CAS Client'
+
+def upgradeSessionStorage( plugin ):
+    ''' Move the session mappings of a plugin to the partitioned storage.
+
+    Handles plugins created before the storage was partitioned.
+
+    @param plugin
+    an AnzCASClient object
+
+    @return
+    whether the plugin was changed.
+
+    '''
+    storage = plugin._sessionStorage
+    if isinstance( storage, SessionMappingStorage ):
+        partitioned = PartitionedSessionMappingStorage()
+        for mappingId, sessionId in \
+                storage._mapping_id_to_session_id.items():
+            partitioned.addSession( mappingId, sessionId )
+
+        plugin._sessionStorage = partitioned
+        return True
+
+    return False
+
+def upgrade( app ):
+    ''' Upgrade all the plugins found under app and commit.
+
+    Run it once after upgrading the package, e.g. from 'bin/instance
+    debug':
+
+    >>> from anz.casclient.upgrades import upgrade
+    >>> upgrade( app )
+
+    @return
+    the number of upgraded plugins.
+
+    '''
+    count = 0
+    for path, plugin in app.ZopeFind( app, obj_metatypes=[META_TYPE],
+                                      search_sub=1 ):
+        if upgradeSessionStorage( plugin ):
+            LOG.info( 'Upgraded the session mapping storage of %s.' % path )
+            count += 1
+
+    transaction.commit()
+    return count
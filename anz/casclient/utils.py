@@ -1,27 +1,147 @@
 
 # python
-import socket
-from urllib2 import urlopen, URLError, HTTPError
+import threading
+from Queue import Queue, Empty
 from logging import getLogger
 
-from anz.casclient.exceptions import ConnectionException
+from anz.casclient.transport import getTransport, getRemainingTime, \
+     setDeadline, restoreDeadline
+from anz.casclient.circuitbreaker import getCircuitBreaker, isFailure
+from anz.casclient.endpoints import getEndpointGroup
+from anz.casclient.exceptions import ConnectionException, \
+     CircuitOpenException, DeadlineExceededException
 
 LOG = getLogger( 'anz.casclient' )
 
-def retrieveResponseFromServer( url ):
+def retrieveResponseFromServer( url, data=None, headers=None,
+                                connectTimeout=None, readTimeout=None,
+                                transport=None ):
     ''' Contacts the CAS Server and retrieve the response.
+
+    The request is sent through the shared transport, which reuses
+    persistent connections to the CAS server. If a circuit breaker guards
+    the CAS server and it is open, CircuitOpenException is raised without
+    contacting the server. If the CAS server is served by an endpoint
+    group (see endpoints.EndpointGroup), the request is sent to one of its
+    nodes.
+
+    @param url
+    the url to request
+
+    @param data
+    request body, if given a POST is sent instead of a GET
+
+    @param headers
+    extra request headers
+
+    @param connectTimeout
+    seconds to wait for the connection to be set up
+
+    @param readTimeout
+    seconds to wait for each read of the response
+
+    @param transport
+    the transport to send the request with, default to the shared pooled
+    transport
+
     '''
-    socket.setdefaulttimeout( 5 )
+    transport = transport or getTransport()
+
+    def send( url ):
+        return _send( transport, url, data, headers, connectTimeout,
+                      readTimeout )
+
+    group = getEndpointGroup( url )
+    if group is not None:
+        return group.request( send, url )
+
+    return send( url )
+
+def _send( transport, url, data, headers, connectTimeout, readTimeout ):
+    breaker = getCircuitBreaker( url )
+    if breaker is None:
+        return transport.request( url, data, headers,
+                                  connectTimeout=connectTimeout,
+                                  readTimeout=readTimeout )
+
+    if not breaker.allow():
+        raise CircuitOpenException( 'CAS server unavailable, circuit open.' )
+
     try:
-        response = urlopen( url )
-    except HTTPError, e:
-        LOG.warning( e )
-        raise ConnectionException( 'Error code: %s' % e.code )
-    except URLError, e:
-        LOG.warning( e )
-        raise ConnectionException( 'Fail to connect, %s' % e.reason )
-    except Exception, e:
-        LOG.warning( e )
+        response = transport.request( url, data, headers,
+                                      connectTimeout=connectTimeout,
+                                      readTimeout=readTimeout )
+    except ConnectionException, e:
+        if isFailure( e ):
+            breaker.recordFailure()
+        elif not isinstance( e, DeadlineExceededException ):
+            # the server answered
+            breaker.recordSuccess()
         raise
-    
-    return response.read()
+
+    breaker.recordSuccess()
+    return response
+
+def mapConcurrently( func, items, maxWorkers=4 ):
+    ''' Call func on each of items using a bounded number of threads.
+
+    The deadline set on the calling thread (see transport.setDeadline)
+    applies to the worker threads too. If it passed already, func is not
+    called and each item gets a DeadlineExceededException.
+
+    @param func
+    a callable taking one item
+
+    @param items
+    the items to call func on
+
+    @param maxWorkers
+    max number of calls running at the same time
+
+    @return
+    a list of ( result, exception ) pairs in the order of items, exception
+    is None if the call succeeded.
+
+    '''
+    items = list( items )
+    remaining = getRemainingTime()
+    if remaining is not None and remaining <= 0:
+        # setDeadline would take 0 for no deadline at all, call nothing
+        return [ ( None, DeadlineExceededException('Deadline exceeded.') )
+                 for item in items ]
+
+    results = [ None ] * len( items )
+    queue = Queue()
+    for index in range( len(items) ):
+        queue.put( index )
+
+    def work():
+        previous = setDeadline( remaining )
+        try:
+            while True:
+                try:
+                    index = queue.get_nowait()
+                except Empty:
+                    return
+
+                try:
+                    results[index] = ( func(items[index]), None )
+                except Exception, e:
+                    LOG.warning( e )
+                    results[index] = ( None, e )
+        finally:
+            restoreDeadline( previous )
+
+    # The calling thread works too.
+    threads = []
+    for i in range( min(maxWorkers, len(items)) - 1 ):
+        thread = threading.Thread( target=work )
+        thread.setDaemon( True )
+        thread.start()
+        threads.append( thread )
+
+    work()
+    for thread in threads:
+        thread.join()
+
+    return results
@@ -1,6 +1,5 @@
 
 # python
-from xml.dom import minidom as minidom
 from datetime import datetime
 from xml.etree import ElementTree
 
@@ -14,11 +13,15 @@ from anz.casclient.events import SAMLPropertiesExist
 from anz.casclient.principal import Principal
 from anz.casclient.assertion import Assertion
 from anz.casclient.proxyretriever import Cas20ProxyRetriever
+from anz.casclient.proxygrantingticketstorage import getPgtRendezvous
+from anz.casclient.responseparser import parseCas20Response, \
+     parseCas30JsonResponse
 from anz.casclient.utils import retrieveResponseFromServer
+from anz.casclient.transport import getRemainingTime
+from anz.casclient.metrics import getMetrics
 from anz.casclient.exceptions import TicketValidationException, \
      InternalException, ConnectionException, InvalidProxyChainException
 
-import requests
 import time
 
 
@@ -28,10 +31,47 @@ class TicketValidator( object ):
 
     implements( ITicketValidator )
 
-    def __init__( self, casServerUrlPrefix, renew=False ):
-        ''' Construct a ticket validator object. '''
+    # Key of the proxy ticket pool principals with a pgt get their proxy
+    # tickets from, set by the plugin (see proxyticketpool).
+    poolKey = None
+
+    def __init__( self, casServerUrlPrefix, renew=False,
+                  connectTimeout=None, readTimeout=None, transport=None ):
+        ''' Construct a ticket validator object.
+
+        @param casServerUrlPrefix
+        the start of the CAS server URL
+
+        @param renew
+        whether to ask CAS to validate only tickets issued from a
+        presentation of primary credentials
+
+        @param connectTimeout
+        seconds to wait for the connection to the CAS server
+
+        @param readTimeout
+        seconds to wait for each read of the CAS server response
+
+        @param transport
+        the transport to send requests to the CAS server with, default to
+        the shared pooled transport
+
+        '''
         self.casServerUrlPrefix = casServerUrlPrefix
         self.renew = renew
+        self.connectTimeout = connectTimeout
+        self.readTimeout = readTimeout
+        self.transport = transport
+
+        # The validation URL up to its query string, validators are reused
+        # for many validations so it is computed once.
+        url = [ casServerUrlPrefix ]
+        if not casServerUrlPrefix.endswith( '/' ):
+            url.append( '/' )
+
+        url.append( self.getUrlSuffix() )
+        url.append( '?' )
+        self._validationUrl = ''.join( url )
 
     def getUrlSuffix( self ):
         ''' See interfaces.ITicketValidator. '''
@@ -41,17 +81,24 @@ class TicketValidator( object ):
         ''' See interfaces.ITicketValidator. '''
         validationUrl = self._constructValidationUrl(
             ticket, service, proxyCallbackUrl )
-        serverResponse = self.retrieveResponseFromServer(
-            validationUrl, ticket )
+        metrics = getMetrics()
+        serverResponse = metrics.call( 'validation_network',
+                                       self.retrieveResponseFromServer,
+                                       validationUrl, ticket )
 
         if not serverResponse:
-            raise 'The CAS server returned no response.'
+            raise ConnectionException(
+                'The CAS server returned no response.' )
 
-        return self.parseResponseFromServer( serverResponse )
+        return metrics.call( 'validation_parse',
+                             self.parseResponseFromServer, serverResponse )
 
     def retrieveResponseFromServer( self, validationUrl, ticket ):
         ''' See interfaces.ITicketValidator. '''
-        return retrieveResponseFromServer( validationUrl )
+        return retrieveResponseFromServer( validationUrl,
+                                           connectTimeout=self.connectTimeout,
+                                           readTimeout=self.readTimeout,
+                                           transport=self.transport )
 
     def parseResponseFromServer( self, response ):
         ''' See interfaces.ITicketValidator. '''
@@ -74,13 +121,7 @@ class TicketValidator( object ):
 
         '''
         url = []
-        url.append( self.casServerUrlPrefix )
-        if not self.casServerUrlPrefix[-1] == '/':
-            url.append( '/' )
-
-        url.append( self.getUrlSuffix() )
-        url.append( '?' )
-
+        url.append( self._validationUrl )
         url.append( 'ticket=%s' % ticket )
         url.append( '&service=%s' % service )
 
@@ -106,7 +147,8 @@ class Cas10TicketValidator( TicketValidator ):
         lines = response.split( '\n' )
         first = lines[0]
         if not first=='yes':
-            raise 'CAS Server could not validate ticket.'
+            raise TicketValidationException(
+                'CAS Server could not validate ticket.' )
 
         userId = lines[1]
         return Assertion( Principal( userId ) )
@@ -118,9 +160,21 @@ class Cas20ServiceTicketValidator( TicketValidator ):
     '''
     CAS_NS = 'http://www.yale.edu/tp/cas'
 
-    def __init__( self, casServerUrlPrefix, pgtStorage, renew=False ):
+    # Max seconds to wait for the proxy callback to deliver the pgt.
+    PGT_WAIT_TIMEOUT = 2
+
+    # Mapping the slim proxy callback hands tickets over through when the
+    # pgt storage is in the ZODB, set by the plugin (see
+    # proxygrantingticketstorage.getPgtHandover).
+    pgtHandover = None
+
+    def __init__( self, casServerUrlPrefix, pgtStorage, renew=False,
+                  connectTimeout=None, readTimeout=None, transport=None ):
         super(Cas20ServiceTicketValidator, self).__init__( casServerUrlPrefix,
-                                                           renew )
+                                                           renew,
+                                                           connectTimeout,
+                                                           readTimeout,
+                                                           transport )
         self.pgtStorage = pgtStorage
 
     def getUrlSuffix( self ):
@@ -129,56 +183,133 @@ class Cas20ServiceTicketValidator( TicketValidator ):
 
     def parseResponseFromServer( self, response ):
         ''' See interfaces.ITicketValidator. '''
+        return self._buildAssertion( self._parseResponse(response) )
+
+    def _parseResponse( self, response ):
+        ''' Parse the response in one pass into a Cas20Response object. '''
         try:
-            dom = minidom.parseString( response )
-            elements = dom.getElementsByTagNameNS( self.CAS_NS,
-                                                   'authenticationFailure' )
-            if elements:
-                raise TicketValidationException( elements[0].firstChild.data )
-
-            elements = dom.getElementsByTagNameNS( self.CAS_NS, 'user' )
-            userId = elements and elements[0].firstChild.data or None
+            return parseCas20Response( response )
+        except Exception, e:
+            raise InternalException( str(e) )
+
+    def _buildAssertion( self, result ):
+        ''' Build the assertion from a parsed response. '''
+        try:
+            if result.failureCode or result.failureMessage:
+                raise TicketValidationException(
+                    result.failureMessage or result.failureCode )
+
+            userId = result.user
             if not userId:
                 raise TicketValidationException(
                     'No principal was found in the response.' )
 
-            elements = dom.getElementsByTagNameNS( self.CAS_NS,
-                                                   'proxyGrantingTicket' )
-            pgtIouNode = elements and elements[0] or None
-            if pgtIouNode:
-                pgtIou = pgtIouNode.firstChild.data
-
-                # Explicite call transaction.begin() to sync invalidations
-                # for a given transaction, make sure to get the latest pgt
-                # storage data. This will be a issue when anz.cas and
-                # anz.casclient deploied on the same zope instance.
-                transaction.begin()
-
-                pgt = self.pgtStorage.retrieve( pgtIou )
+            attributes = result.getAttributes()
+            pgtIou = result.pgtIou
+            if pgtIou:
+                pgt = getMetrics().call( 'pgt_storage', self._retrievePgt,
+                                         pgtIou )
                 if pgt:
                     principal = Principal(
                         userId, pgt,
-                        Cas20ProxyRetriever(self.casServerUrlPrefix) )
+                        Cas20ProxyRetriever(self.casServerUrlPrefix,
+                                            self.connectTimeout,
+                                            self.readTimeout,
+                                            self.poolKey),
+                        attributes )
                 else:
                     raise TicketValidationException(
                         'No pgt found for pgtIou %s.' % pgtIou )
             else:
-                principal = Principal( userId )
+                principal = Principal( userId, attributes=attributes )
 
             return Assertion( principal )
         except Exception, e:
             raise InternalException( str(e) )
 
+    def _retrievePgt( self, pgtIou ):
+        ''' Retrieve the pgt of pgtIou, waiting for the proxy callback
+        delivering it if needed.
+
+        '''
+        rendezvous = getPgtRendezvous()
+
+        # Most of the time the callback was handled by this process.
+        pgt = rendezvous.get( pgtIou ) or self.pgtStorage.retrieve( pgtIou )
+        if pgt:
+            return pgt
+
+        # The callback may still be running, or was handled by another Zope
+        # client: wait for it, polling the storage the Zope clients share,
+        # but not past the deadline of the request.
+        timeout = self.PGT_WAIT_TIMEOUT
+        remaining = getRemainingTime()
+        if remaining is not None:
+            timeout = max( 0, min(timeout, remaining) )
+
+        lookup = _SharedLookup( self.pgtStorage, self.pgtHandover )
+        try:
+            return rendezvous.wait( pgtIou, timeout, lookup )
+        finally:
+            lookup.close()
+
+class _SharedLookup( object ):
+    ''' Looks pgtIous up in the latest state of the pgt storage and in the
+    tickets handed over by the slim proxy callback, as seen by all the Zope
+    clients, while a validation waits for its pgt.
+
+    The connection of the request does not see what other Zope clients
+    committed since the request started, and syncing it would abort the
+    request's transaction. A ZODB storage is read from a connection of its
+    own instead, opened once per wait and synced between polls.
+
+    '''
+
+    def __init__( self, pgtStorage, pgtHandover=None ):
+        self.pgtStorage = pgtStorage
+        self.pgtHandover = pgtHandover
+        self._conn = None
+
+    def __call__( self, pgtIou ):
+        pgt = self._retrieve( pgtIou )
+        if not pgt and self.pgtHandover is not None:
+            pgt = self.pgtHandover.pop( pgtIou )
+
+        return pgt or None
+
+    def close( self ):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _retrieve( self, pgtIou ):
+        jar = getattr( self.pgtStorage, '_p_jar', None )
+        if jar is None:
+            return self.pgtStorage.retrieve( pgtIou )
+
+        if self._conn is None:
+            self._conn = jar.db().open(
+                transaction_manager=transaction.TransactionManager() )
+        else:
+            # see what was committed since the last poll
+            self._conn.sync()
+
+        return self._conn.get( self.pgtStorage._p_oid ).retrieve( pgtIou )
+
 class Cas20ProxyTicketValidator( Cas20ServiceTicketValidator ):
     ''' Extension Service Ticket validation to validate service tickets and
     proxy tickets.
 
     '''
     def __init__( self, casServerUrlPrefix, pgtStorage, acceptAnyProxy=True,
-                  allowedProxyChains=[], renew=False ):
+                  allowedProxyChains=[], renew=False, connectTimeout=None,
+                  readTimeout=None, transport=None ):
         super(Cas20ProxyTicketValidator, self).__init__( casServerUrlPrefix,
                                                          pgtStorage,
-                                                         renew )
+                                                         renew,
+                                                         connectTimeout,
+                                                         readTimeout,
+                                                         transport )
 
         self.acceptAnyProxy = acceptAnyProxy
         self.allowedProxyChains = allowedProxyChains
@@ -189,20 +320,14 @@ class Cas20ProxyTicketValidator( Cas20ServiceTicketValidator ):
 
     def parseResponseFromServer( self, response ):
         ''' See interfaces.ITicketValidator. '''
-        assertion = super(Cas20ProxyTicketValidator, self).\
-                  parseResponseFromServer( response )
+        result = self._parseResponse( response )
+        assertion = self._buildAssertion( result )
 
-        self._validateProxyChain( response )
+        self._validateProxyChain( result.proxies )
 
         return assertion
 
-    def _validateProxyChain( self, response ):
-        dom = minidom.parseString( response )
-        elements = dom.getElementsByTagNameNS( self.CAS_NS,
-                                               'proxy' )
-        proxies = []
-        for e in elements:
-            proxies.append( e.firstChild.data )
+    def _validateProxyChain( self, proxies ):
         proxies = ' '.join( proxies )
 
         if self.acceptAnyProxy or not proxies or \
@@ -211,6 +336,73 @@ class Cas20ProxyTicketValidator( Cas20ServiceTicketValidator ):
 
         raise InvalidProxyChainException( 'Invalid proxy chain: %s' % proxies )
 
+class Cas30ResponseFormat( object ):
+    ''' Mixin asking a CAS 3.0 server for responses in the XML or in the
+    JSON format.
+
+    '''
+    # 'XML' or 'JSON'
+    responseFormat = 'XML'
+
+    def _constructValidationUrl( self, ticket, service, proxyCallbackUrl ):
+        url = super( Cas30ResponseFormat, self )._constructValidationUrl(
+            ticket, service, proxyCallbackUrl )
+        if self.responseFormat == 'JSON':
+            url += '&format=JSON'
+
+        return url
+
+    def _parseResponse( self, response ):
+        if self.responseFormat != 'JSON':
+            return super( Cas30ResponseFormat, self )._parseResponse(
+                response )
+
+        try:
+            return parseCas30JsonResponse( response )
+        except Exception, e:
+            raise InternalException( str(e) )
+
+class Cas30ServiceTicketValidator( Cas30ResponseFormat,
+                                   Cas20ServiceTicketValidator ):
+    ''' Implementation of the Ticket Validator that will validate Service
+    Tickets in compliance with the CAS 3, user attributes are released in
+    the response.
+
+    '''
+    def __init__( self, casServerUrlPrefix, pgtStorage, renew=False,
+                  connectTimeout=None, readTimeout=None, transport=None,
+                  responseFormat='XML' ):
+        self.responseFormat = responseFormat
+        super(Cas30ServiceTicketValidator, self).__init__( casServerUrlPrefix,
+                                                           pgtStorage,
+                                                           renew,
+                                                           connectTimeout,
+                                                           readTimeout,
+                                                           transport )
+
+    def getUrlSuffix( self ):
+        ''' See interfaces.ITicketValidator. '''
+        return 'p3/serviceValidate'
+
+class Cas30ProxyTicketValidator( Cas30ResponseFormat,
+                                 Cas20ProxyTicketValidator ):
+    ''' Extension of the CAS 3 Service Ticket validation to validate
+    service tickets and proxy tickets.
+
+    '''
+    def __init__( self, casServerUrlPrefix, pgtStorage, acceptAnyProxy=True,
+                  allowedProxyChains=[], renew=False, connectTimeout=None,
+                  readTimeout=None, transport=None, responseFormat='XML' ):
+        self.responseFormat = responseFormat
+        super(Cas30ProxyTicketValidator, self).__init__(
+            casServerUrlPrefix, pgtStorage, acceptAnyProxy,
+            allowedProxyChains, renew, connectTimeout, readTimeout,
+            transport )
+
+    def getUrlSuffix( self ):
+        ''' See interfaces.ITicketValidator. '''
+        return 'p3/proxyValidate'
+
 
 class Cas20SAMLServiceTicketValidator(TicketValidator):
     ''' Implementation of the Ticket Validator that will validate Service
@@ -219,9 +411,13 @@ class Cas20SAMLServiceTicketValidator(TicketValidator):
     '''
     SAML_NS = '{urn:oasis:names:tc:SAML:1.0:assertion}'
 
-    def __init__(self, casServerUrlPrefix, pgtStorage, renew=False):
+    def __init__(self, casServerUrlPrefix, pgtStorage, renew=False,
+                 connectTimeout=None, readTimeout=None, transport=None):
         super(Cas20SAMLServiceTicketValidator, self).__init__(casServerUrlPrefix,
-                                                           renew)
+                                                           renew,
+                                                           connectTimeout,
+                                                           readTimeout,
+                                                           transport)
         self.pgtStorage = pgtStorage
 
     def getUrlSuffix(self):
@@ -249,10 +445,9 @@ class Cas20SAMLServiceTicketValidator(TicketValidator):
                 raise TicketValidationException(
                     'No principal was found in the response.')
 
-            principal = Principal(username)
-
             attribute_tag = tree.findall('.//{}Attribute'.format(self.SAML_NS))
 
+            attributes = {}
             if attribute_tag:
                 properties = {}
                 for attribute in attribute_tag:
@@ -262,21 +457,59 @@ class Cas20SAMLServiceTicketValidator(TicketValidator):
                         attribute_value = value_tag[0].text
 
                     properties.update({attribute_key: attribute_value})
+
+                    values = [v.text for v in value_tag]
+                    if len(values) == 1:
+                        attributes[attribute_key] = values[0]
+                    else:
+                        attributes[attribute_key] = values
                 properties.update(dict(username=username))
                 notify(SAMLPropertiesExist(properties))
 
-            return Assertion(principal)
+            principal = Principal(username, attributes=attributes)
+
+            validFromDate = validUntilDate = None
+            conditions = tree.find('.//{}Conditions'.format(self.SAML_NS))
+            if conditions is not None:
+                validFromDate = self._parseDate(conditions.get('NotBefore'))
+                validUntilDate = self._parseDate(
+                    conditions.get('NotOnOrAfter'))
+
+            authenticationAttributes = {}
+            statement = tree.find(
+                './/{}AuthenticationStatement'.format(self.SAML_NS))
+            if statement is not None:
+                authenticationAttributes['samlAuthenticationStatementAuthMethod'] = \
+                    statement.get('AuthenticationMethod')
+                authenticationAttributes['authenticationDate'] = \
+                    statement.get('AuthenticationInstant')
+
+            return Assertion(principal, validFromDate, validUntilDate,
+                             authenticationAttributes)
         except Exception, e:
             raise InternalException(str(e))
 
+    def _parseDate(self, value):
+        ''' Parse a SAML date like 2008-12-10T14:12:14.817Z into a naive
+        UTC datetime, None if not set.
+
+        '''
+        if not value:
+            return None
+
+        return datetime.strptime(value.split('.')[0].rstrip('Z'),
+                                 '%Y-%m-%dT%H:%M:%S')
+
     def retrieveResponseFromServer(self, validationUrl, ticket):
         ''' See interfaces.ITicketValidator. '''
 
         request_id = '_192.168.16.51.' + str(int(time.time()))
         request_instant = datetime.isoformat(datetime.now()) + 'Z'
         payload = """<SOAP-ENV:Envelope xmlns:SOAP-ENV="http://schemas.xmlsoap.org/soap/envelope/"><SOAP-ENV:Header/><SOAP-ENV:Body><samlp:Request xmlns:samlp="urn:oasis:names:tc:SAML:1.0:protocol" MajorVersion="1" MinorVersion="1" RequestID="{request_id}" IssueInstant="{request_instant}"><samlp:AssertionArtifact>{ticket}</samlp:AssertionArtifact></samlp:Request></SOAP-ENV:Body></SOAP-ENV:Envelope>""".format(**dict(request_id=request_id, request_instant=request_instant, ticket=ticket))
-        req = requests.post(validationUrl, payload, headers={'Content-Type': 'text/xml'})
-        return req.text
+        return retrieveResponseFromServer(
+            validationUrl, payload, {'Content-Type': 'text/xml'},
+            connectTimeout=self.connectTimeout, readTimeout=self.readTimeout,
+            transport=self.transport)
 
     def _constructValidationUrl(self, ticket, service, proxyCallbackUrl):
         ''' Constructs the URL to send the validation request to.
@@ -288,14 +521,4 @@ class Cas20SAMLServiceTicketValidator(TicketValidator):
         the fully constructed URL.
 
         '''
-        url = []
-        url.append(self.casServerUrlPrefix)
-        if not self.casServerUrlPrefix[-1] == '/':
-            url.append('/')
-
-        url.append(self.getUrlSuffix())
-        url.append('?')
-
-        url.append('TARGET=%s' % service)
-
-        return ''.join(url)
+        return '%sTARGET=%s' % (self._validationUrl, service)